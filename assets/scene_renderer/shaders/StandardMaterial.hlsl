@@ -70,7 +70,7 @@ float4 psmain(StandardVertexOutput input) : SV_TARGET
     
         // Apply TBN transform
         float3 vN = N;
-        float3 vT = mul(instance.modelMatrix, float4(input.Tangent.xyz, 0)).xyz;
+        float3 vT = normalize(mul(instance.modelMatrix, float4(input.Tangent.xyz, 0)).xyz);
         float3 vB = cross(vN, vT) * input.Tangent.w;
         N = normalize(vNt.x * vT + vNt.y * vB + vNt.z * vN);
     }
@@ -16,6 +16,8 @@
 #include "ppx/scene/scene_gltf_loader.h"
 #include "ppx/graphics_util.h"
 
+#include <iostream>
+
 namespace {
 
 using namespace ppx;
@@ -26,6 +28,9 @@ const grfx::Api kApi = grfx::API_DX_12_0;
 const grfx::Api kApi = grfx::API_VK_1_1;
 #endif
 
+// Frames each scene is rendered for in batch mode. The screenshot is taken of the last one.
+constexpr uint32_t kBatchFrameCount = 2;
+
 // Calculates a world space bounding box for the mesh. May be bigger than the actual bounding box (especially if rotation is applied) since the node's bounding box is the starting point for transformation (not the individual vertices).
 ppx::AABB GetMeshNodeBoundingBox(const scene::MeshNode& meshNode)
 {
@@ -86,11 +91,71 @@ void GltfBasicMaterialsApp::Setup()
         mPerFrame.push_back(frame);
     }
 
+    // IBL Textures
+    {
+        PPX_CHECKED_CALL(grfx_util::CreateIBLTexturesFromFile(GetDevice()->GetGraphicsQueue(), GetAssetPath("poly_haven/ibl/old_depot_4k.ibl"), &mIBLIrrMap, &mIBLEnvMap));
+    }
+
+    // Shaders, shared by the pipelines of every scene
+    {
+        PPX_CHECKED_CALL(CreateShader("scene_renderer/shaders", "MaterialVertex.vs", &mVS));
+        PPX_CHECKED_CALL(CreateShader("scene_renderer/shaders", "StandardMaterial.ps", &mStandardMaterialPS));
+        PPX_CHECKED_CALL(CreateShader("scene_renderer/shaders", "UnlitMaterial.ps", &mUnlitMaterialPS));
+        PPX_CHECKED_CALL(CreateShader("scene_renderer/shaders", "ErrorMaterial.ps", &mErrorMaterialPS));
+    }
+
+    if (mSceneBatchKnob->GetValue().empty()) {
+        LoadScene(mSceneAssetKnob->GetValue());
+        return;
+    }
+
+    if (mSceneBatchKnob->GetValue() == "-") {
+        mBatchStream = &std::cin;
+    }
+    else {
+        mBatchFile.open(mSceneBatchKnob->GetValue());
+        PPX_ASSERT_MSG(mBatchFile.is_open(), "cannot open batch manifest: " << mSceneBatchKnob->GetValue());
+        mBatchStream = &mBatchFile;
+    }
+    if (!LoadNextBatchEntry()) {
+        PPX_LOG_WARN("Batch manifest is empty");
+        Quit();
+    }
+}
+
+bool GltfBasicMaterialsApp::LoadNextBatchEntry()
+{
+    // Each line is an asset and the path to save its screenshot to, separated by a tab.
+    std::string line;
+    while (std::getline(*mBatchStream, line)) {
+        if (!line.empty() && line.back() == '\r') {
+            line.pop_back();
+        }
+        if (line.empty()) {
+            continue;
+        }
+        const size_t separator = line.find('\t');
+        PPX_ASSERT_MSG(separator != std::string::npos, "malformed batch manifest line: " << line);
+
+        mBatchEntry.asset          = line.substr(0, separator);
+        mBatchEntry.screenshotPath = line.substr(separator + 1);
+        mBatchFrameCount           = 0;
+
+        // Lets a test runner attribute the output up to the matching "end" line to this entry.
+        PPX_LOG_INFO("gltf-scene-batch: begin " << mBatchIndex << " " << mBatchEntry.asset);
+        LoadScene(mBatchEntry.asset);
+        return true;
+    }
+    return false;
+}
+
+void GltfBasicMaterialsApp::LoadScene(const std::string& asset)
+{
     // Load GLTF scene
     {
         scene::GltfLoader* pLoader = nullptr;
         //
-        PPX_CHECKED_CALL(scene::GltfLoader::Create(GetAssetPath(mSceneAssetKnob->GetValue()), /*pMaterialSelector=*/nullptr, &pLoader));
+        PPX_CHECKED_CALL(scene::GltfLoader::Create(GetAssetPath(asset), /*pMaterialSelector=*/nullptr, &pLoader));
 
         PPX_CHECKED_CALL(pLoader->LoadScene(GetDevice(), 0, &mScene));
         if (mScene->GetCameraNodeCount() == 0) {
@@ -108,11 +173,6 @@ void GltfBasicMaterialsApp::Setup()
         delete pLoader;
     }
 
-    // IBL Textures
-    {
-        PPX_CHECKED_CALL(grfx_util::CreateIBLTexturesFromFile(GetDevice()->GetGraphicsQueue(), GetAssetPath("poly_haven/ibl/old_depot_4k.ibl"), &mIBLIrrMap, &mIBLEnvMap));
-    }
-
     // Pipeline args
     {
         PPX_CHECKED_CALL(scene::MaterialPipelineArgs::Create(GetDevice(), &mPipelineArgs));
@@ -178,20 +238,10 @@ void GltfBasicMaterialsApp::Setup()
         // Get vertex bindings - every mesh in the test scene should have the same attributes
         auto vertexBindings = mScene->GetMeshNode(0)->GetMesh()->GetMeshData()->GetAvailableVertexBindings();
 
-        auto CreatePipeline = [this, &vertexBindings](const std::string& vsName, const std::string& psName, grfx::GraphicsPipeline** ppPipeline) {
-            std::vector<char> bytecode = LoadShader("scene_renderer/shaders", vsName);
-            PPX_ASSERT_MSG(!bytecode.empty(), "VS shader bytecode load failed");
-            grfx::ShaderModuleCreateInfo shaderCreateInfo = {static_cast<uint32_t>(bytecode.size()), bytecode.data()};
-            PPX_CHECKED_CALL(GetDevice()->CreateShaderModule(&shaderCreateInfo, &mVS));
-
-            bytecode = LoadShader("scene_renderer/shaders", psName);
-            PPX_ASSERT_MSG(!bytecode.empty(), "PS shader bytecode load failed");
-            shaderCreateInfo = {static_cast<uint32_t>(bytecode.size()), bytecode.data()};
-            PPX_CHECKED_CALL(GetDevice()->CreateShaderModule(&shaderCreateInfo, &mPS));
-
+        auto CreatePipeline = [this, &vertexBindings](grfx::ShaderModule* pVS, grfx::ShaderModule* pPS, grfx::GraphicsPipeline** ppPipeline) {
             grfx::GraphicsPipelineCreateInfo2 gpCreateInfo  = {};
-            gpCreateInfo.VS                                 = {mVS.Get(), "vsmain"};
-            gpCreateInfo.PS                                 = {mPS.Get(), "psmain"};
+            gpCreateInfo.VS                                 = {pVS, "vsmain"};
+            gpCreateInfo.PS                                 = {pPS, "psmain"};
             gpCreateInfo.topology                           = grfx::PRIMITIVE_TOPOLOGY_TRIANGLE_LIST;
             gpCreateInfo.polygonMode                        = grfx::POLYGON_MODE_FILL;
             gpCreateInfo.cullMode                           = grfx::CULL_MODE_BACK;
@@ -213,9 +263,9 @@ void GltfBasicMaterialsApp::Setup()
         };
 
         // Pipelines
-        CreatePipeline("MaterialVertex.vs", "StandardMaterial.ps", &mStandardMaterialPipeline);
-        CreatePipeline("MaterialVertex.vs", "UnlitMaterial.ps", &mUnlitMaterialPipeline);
-        CreatePipeline("MaterialVertex.vs", "ErrorMaterial.ps", &mErrorMaterialPipeline);
+        CreatePipeline(mVS, mStandardMaterialPS, &mStandardMaterialPipeline);
+        CreatePipeline(mVS, mUnlitMaterialPS, &mUnlitMaterialPipeline);
+        CreatePipeline(mVS, mErrorMaterialPS, &mErrorMaterialPipeline);
 
         // Compile pipelines for mmaterials
         for (auto it : mMaterialIndexMap) {
@@ -235,10 +285,34 @@ void GltfBasicMaterialsApp::Setup()
     }
 }
 
-void GltfBasicMaterialsApp::Shutdown()
+void GltfBasicMaterialsApp::UnloadScene()
 {
+    // The scene's resources may still be used by frames in flight
+    PPX_CHECKED_CALL(GetGraphicsQueue()->WaitIdle());
+
+    for (grfx::GraphicsPipelinePtr* pPipeline : {&mStandardMaterialPipeline, &mUnlitMaterialPipeline, &mErrorMaterialPipeline}) {
+        if (*pPipeline) {
+            GetDevice()->DestroyGraphicsPipeline(*pPipeline);
+            pPipeline->Reset();
+        }
+    }
+    if (mPipelineInterface) {
+        GetDevice()->DestroyPipelineInterface(mPipelineInterface);
+        mPipelineInterface.Reset();
+    }
+    mMaterialPipelineMap.clear();
+    mMaterialIndexMap.clear();
+
     delete mScene;
+    mScene = nullptr;
     delete mPipelineArgs;
+    mPipelineArgs = nullptr;
+    mDefaultCamera.reset();
+}
+
+void GltfBasicMaterialsApp::Shutdown()
+{
+    UnloadScene();
 }
 
 void GltfBasicMaterialsApp::Render()
@@ -366,12 +440,32 @@ void GltfBasicMaterialsApp::Render()
     PPX_CHECKED_CALL(GetGraphicsQueue()->Submit(&submitInfo));
 
     PPX_CHECKED_CALL(swapchain->Present(imageIndex, 1, &presentationReadySemaphore));
+
+    // In batch mode, move on to the next scene once the current one has been rendered for
+    // enough frames, keeping the device, swapchain and shaders.
+    if ((mBatchStream != nullptr) && (++mBatchFrameCount >= kBatchFrameCount)) {
+        SaveImage(swapchain->GetColorImage(imageIndex), mBatchEntry.screenshotPath, grfx::RESOURCE_STATE_PRESENT);
+        PPX_LOG_INFO("gltf-scene-batch: end " << mBatchIndex);
+
+        UnloadScene();
+        ++mBatchIndex;
+        if (!LoadNextBatchEntry()) {
+            Quit();
+        }
+    }
 }
 
 void GltfBasicMaterialsApp::InitKnobs()
 {
     GetKnobManager().InitKnob(&mSceneAssetKnob, "gltf-scene-asset", "scene_renderer/scenes/tests/gltf_test_basic_materials.glb");
     mSceneAssetKnob->SetFlagDescription("GLTF asset to load and render");
+
+    GetKnobManager().InitKnob(&mSceneBatchKnob, "gltf-scene-batch", "");
+    mSceneBatchKnob->SetFlagDescription(
+        "Render every GLTF asset listed in this file, or in stdin if it is `-`, one after the other. "
+        "Each line is an asset and the path to save its screenshot to, separated by a tab. "
+        "Replaces `--gltf-scene-asset`.");
+    mSceneBatchKnob->SetFlagParameters("<path>");
 }
 
 void GltfBasicMaterialsApp::MouseMove(int32_t x, int32_t y, int32_t dx, int32_t dy, uint32_t buttons)
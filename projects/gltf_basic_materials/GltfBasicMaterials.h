@@ -20,6 +20,7 @@
 #include "ppx/scene/scene_mesh.h"
 #include "ppx/scene/scene_pipeline_args.h"
 
+#include <fstream>
 #include <unordered_map>
 
 class GltfBasicMaterialsApp
@@ -43,9 +44,25 @@ private:
         ppx::grfx::FencePtr         renderCompleteFence;
     };
 
+    // An asset to render in batch mode, see `--gltf-scene-batch`.
+    struct BatchEntry
+    {
+        std::string asset;
+        std::string screenshotPath;
+    };
+
+    void LoadScene(const std::string& asset);
+    void UnloadScene();
+
+    // Reads the next entry of the batch manifest and loads its scene.
+    // Returns false once the manifest is exhausted.
+    bool LoadNextBatchEntry();
+
     std::vector<PerFrame>           mPerFrame;
     ppx::grfx::ShaderModulePtr      mVS;
-    ppx::grfx::ShaderModulePtr      mPS;
+    ppx::grfx::ShaderModulePtr      mStandardMaterialPS;
+    ppx::grfx::ShaderModulePtr      mUnlitMaterialPS;
+    ppx::grfx::ShaderModulePtr      mErrorMaterialPS;
     ppx::grfx::PipelineInterfacePtr mPipelineInterface;
     ppx::grfx::GraphicsPipelinePtr  mStandardMaterialPipeline = nullptr;
     ppx::grfx::GraphicsPipelinePtr  mUnlitMaterialPipeline    = nullptr;
@@ -61,6 +78,14 @@ private:
     ppx::grfx::TexturePtr mIBLEnvMap;
 
     std::shared_ptr<ppx::KnobFlag<std::string>> mSceneAssetKnob;
+    std::shared_ptr<ppx::KnobFlag<std::string>> mSceneBatchKnob;
+
+    // Batch mode state. mBatchStream is either mBatchFile or std::cin.
+    std::ifstream mBatchFile;
+    std::istream* mBatchStream = nullptr;
+    BatchEntry    mBatchEntry;
+    uint32_t      mBatchIndex      = 0;
+    uint32_t      mBatchFrameCount = 0;
 
     // Contains a value only if the GLTF scene doesn't have a camera.
     std::optional<ppx::ArcballCamera> mDefaultCamera;
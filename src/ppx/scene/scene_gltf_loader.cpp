@@ -129,6 +129,26 @@ static grfx::Format GetFormat(const cgltf_accessor* pGltfAccessor)
     return grfx::FORMAT_UNDEFINED;
 }
 
+// Returns true if the accessor's elements are of the given type and its
+// components are floats, or the 8-bit and 16-bit integers allowed by
+// KHR_mesh_quantization, which cgltf_accessor_unpack_floats dequantizes.
+static bool IsUnpackableVertexAttribute(const cgltf_accessor* pGltfAccessor, cgltf_type type)
+{
+    if (IsNull(pGltfAccessor) || (pGltfAccessor->type != type)) {
+        return false;
+    }
+
+    switch (pGltfAccessor->component_type) {
+        default: break;
+        case cgltf_component_type_r_8:
+        case cgltf_component_type_r_8u:
+        case cgltf_component_type_r_16:
+        case cgltf_component_type_r_16u:
+        case cgltf_component_type_r_32f: return true;
+    }
+    return false;
+}
+
 static scene::NodeType GetNodeType(const cgltf_node* pGltfNode)
 {
     if (IsNull(pGltfNode)) {
@@ -1612,7 +1632,11 @@ ppx::Result GltfLoader::LoadMeshData(
                 }
 
                 // Bounding box
-                bool hasBoundingBox = (gltflAccessors.pPositions->has_min && gltflAccessors.pPositions->has_max);
+                //
+                // The min and max of normalized positions aren't normalized, so
+                // those are left to be calculated from the unpacked positions.
+                //
+                bool hasBoundingBox = (gltflAccessors.pPositions->has_min && gltflAccessors.pPositions->has_max && !gltflAccessors.pPositions->normalized);
                 if (hasBoundingBox) {
                     batch.boundingBox = ppx::AABB(
                         *reinterpret_cast<const float3*>(gltflAccessors.pPositions->min),
@@ -1631,28 +1655,28 @@ ppx::Result GltfLoader::LoadMeshData(
                 }
 
                 // Check vertex data formats
-                auto positionFormat = GetFormat(gltflAccessors.pPositions);
-                auto texCoordFormat = GetFormat(gltflAccessors.pTexCoords);
-                auto normalFormat   = GetFormat(gltflAccessors.pNormals);
-                auto tangentFormat  = GetFormat(gltflAccessors.pTangents);
-                auto colorFormat    = GetFormat(gltflAccessors.pColors);
+                //
+                // Quantized positions, normals, tangents and tex coords are
+                // dequantized to the target float formats when unpacked.
+                //
+                auto colorFormat = GetFormat(gltflAccessors.pColors);
 
-                PPX_ASSERT_MSG((positionFormat == targetPositionFormat), "GLTF: vertex positions format is not supported");
+                PPX_ASSERT_MSG(IsUnpackableVertexAttribute(gltflAccessors.pPositions, cgltf_type_vec3), "GLTF: vertex positions format is not supported");
                 auto positions = UnpackFloat3s(*gltflAccessors.pPositions);
 
                 std::vector<glm::float2> texCoords;
                 if (loadParams.requiredVertexAttributes.bits.texCoords && !IsNull(gltflAccessors.pTexCoords)) {
-                    PPX_ASSERT_MSG((texCoordFormat == targetTexCoordFormat), "GLTF: vertex tex coords sourceIndexTypeFormat is not supported");
+                    PPX_ASSERT_MSG(IsUnpackableVertexAttribute(gltflAccessors.pTexCoords, cgltf_type_vec2), "GLTF: vertex tex coords format is not supported");
                     texCoords = UnpackFloat2s(*gltflAccessors.pTexCoords);
                 }
                 std::vector<glm::float3> normals;
                 if (loadParams.requiredVertexAttributes.bits.normals && !IsNull(gltflAccessors.pNormals)) {
-                    PPX_ASSERT_MSG((normalFormat == targetNormalFormat), "GLTF: vertex normals format is not supported");
+                    PPX_ASSERT_MSG(IsUnpackableVertexAttribute(gltflAccessors.pNormals, cgltf_type_vec3), "GLTF: vertex normals format is not supported");
                     normals = UnpackFloat3s(*gltflAccessors.pNormals);
                 }
                 std::vector<glm::float4> tangents;
                 if (loadParams.requiredVertexAttributes.bits.tangents && !IsNull(gltflAccessors.pTangents)) {
-                    PPX_ASSERT_MSG((tangentFormat == targetTangentFormat), "GLTF: vertex tangents format is not supported");
+                    PPX_ASSERT_MSG(IsUnpackableVertexAttribute(gltflAccessors.pTangents, cgltf_type_vec4), "GLTF: vertex tangents format is not supported");
                     tangents = UnpackFloat4s(*gltflAccessors.pTangents);
                 }
                 std::vector<glm::float3> colors;
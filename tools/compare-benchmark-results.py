@@ -20,6 +20,10 @@ This script accepts a list of directories, each containing benchmark results
 from benchmark runs. The first results directory specified on the command line
 is used as a baseline, against which all other results are compared against.
 
+Results are either the CSV files written by benchmarks with --stats-file, or
+the JSON metrics reports written by applications run with --enable-metrics.
+Every gauge and counter of a metrics report is compared.
+
 The following is a valid directory structure:
 -- results_dir_1
 -- -- texture_load_1.csv
@@ -36,98 +40,660 @@ $ tools/compare-benchmarks-results.py results_dir_1 results_dir_2 results_dir_3
 """
 
 import argparse
+import array
+import bisect
+import collections
+from concurrent import futures
+import contextlib
 import csv
 import dataclasses
+import datetime
+import hashlib
+import itertools
+import json
 import logging
+import math
+import mmap
+import operator
 import os
-import statistics
+import re
+import shutil
+import socket
+import sqlite3
 import sys
+import time
+import xml.etree.ElementTree as ET
 
 # Metric names (from benchmark output format).
 _CSV_BENCHMARK_METRICS = ['Pipeline GPU time (ms)', 'Frame CPU time (ms)']
 
+# Number of CSV rows converted to columns at a time when reading results.
+_CSV_READ_CHUNK_ROWS = 65536
 
-@dataclasses.dataclass
-class FrameDatapoint:
-  num_frame: int
-  metrics: list[float]
+# Number of bytes read at a time from a CSV file followed with --follow.
+_FOLLOW_READ_CHUNK_BYTES = 1 << 20
+
+# Directory, inside each results directory, holding the ResultsCache.
+_RESULTS_CACHE_DIR_NAME = '.benchmark_cache'
+
+# Bumped whenever the layout of ResultsCache entries changes.
+_RESULTS_CACHE_VERSION = 2
+
+# Value of `interpretation` in metrics reports for MetricInterpretation
+# HIGHER_IS_BETTER (see include/ppx/metrics.h).
+_METRICS_REPORT_HIGHER_IS_BETTER = 1
+
+# Start of the array of [seconds, value] entries of a gauge in a metrics report.
+_METRICS_REPORT_TIME_SERIES_START = re.compile(rb'"time_series"\s*:\s*\[\s*')
+
+# End of a non-empty time series, i.e. of its last entry and of the series.
+_METRICS_REPORT_TIME_SERIES_END = re.compile(rb'\]\s*\]')
+
+# A number, or null for a non-finite number, in a metrics report.
+_METRICS_REPORT_NUMBER = re.compile(rb'-?[0-9][0-9.eE+-]*|null')
+
+# Default frame time budget for --tail_latency, i.e. 60 frames per second.
+_DEFAULT_FRAME_BUDGET_MS = 16.6
+
+# Size in pixels of per-frame plots in HTML output. Series are decimated to
+# the min and max of one bucket per two horizontal pixels.
+_PLOT_WIDTH = 800
+_PLOT_HEIGHT = 160
+
+# Colors of the results directories in per-frame plots, in order.
+_PLOT_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
 
 
 @dataclasses.dataclass
 class AggregatedTestMetric:
+  """Aggregated values of a metric.
+
+  Tail latency and frame pacing values are only set for metrics with multiple
+  datapoints, and low FPS and frame budget values only for metrics measured in
+  milliseconds.
+
+  Attributes:
+    frames_over_budget: Maps frame time budgets, in milliseconds, to the number
+      of datapoints over that budget.
+    longest_over_budget_streak: Maps frame time budgets, in milliseconds, to
+      the largest number of consecutive datapoints over that budget.
+  """
   name: str
   min: float
   avg: float
   median: float
   max: float
+  higher_is_better: bool = False
+  p90: float | None = None
+  p95: float | None = None
+  p99: float | None = None
+  p99_9: float | None = None
+  variance: float | None = None
+  low_1_percent_fps: float | None = None
+  low_0_1_percent_fps: float | None = None
+  frames_over_budget: dict[float, int] = dataclasses.field(default_factory=dict)
+  longest_over_budget_streak: dict[float, int] = dataclasses.field(
+      default_factory=dict)
+
+
+def _IsMilliseconds(metric_name):
+  return metric_name.endswith('(ms)')
+
+
+def _Percentile(sorted_data, percent):
+  """Linearly interpolated percentile of sorted, non-empty data."""
+  position = (len(sorted_data) - 1) * percent / 100
+  lower = math.floor(position)
+  upper = min(lower + 1, len(sorted_data) - 1)
+  fraction = position - lower
+  return sorted_data[lower] * (1 - fraction) + sorted_data[upper] * fraction
+
+
+def _LowFps(sorted_frame_times_ms, percent):
+  """Frame rate over the slowest `percent` of frames ("1% low FPS")."""
+  count = max(1, int(len(sorted_frame_times_ms) * percent / 100))
+  slowest = sorted_frame_times_ms[-count:]
+  mean = math.fsum(slowest) / count
+  return 1000 / mean if mean > 0 else math.inf
+
+
+def _LongestStreakOver(data, threshold):
+  """Largest number of consecutive values in `data` above `threshold`."""
+  return max((len(list(group))
+              for over, group in itertools.groupby(map(threshold.__lt__, data))
+              if over),
+             default=0)
 
 
 @dataclasses.dataclass
 class TestResults:
-  """A collection of per-frame datapoints."""
-  frame_datapoints: list[FrameDatapoint]
+  """A collection of per-frame datapoints, stored column by column.
+
+  Attributes:
+    frame_numbers: The frame number of each datapoint of a CSV benchmark file.
+      Empty for metrics reports, where the series aren't indexed by frame.
+    metrics: Maps metric names to an array holding the value of the metric
+      for each datapoint.
+    counters: Maps the names of metrics that have a single value, such as
+      counters in metrics reports, to that value.
+    higher_is_better: The names of metrics where larger values are better.
+    steady_state: Set once trimmed to a steady state. Maps metric names, or ''
+      for all metrics of frame-indexed results, to the (first, last, kept,
+      total) datapoints kept: first and last are frame numbers, or 1-based
+      entry indices for series that aren't indexed by frame.
+  """
+  frame_numbers: array.array = dataclasses.field(
+      default_factory=lambda: array.array('q'))
+  metrics: dict[str, array.array] = dataclasses.field(default_factory=dict)
+  counters: dict[str, float] = dataclasses.field(default_factory=dict)
+  higher_is_better: set[str] = dataclasses.field(default_factory=set)
+  steady_state: dict[str, tuple[int, int, int, int]] = dataclasses.field(
+      default_factory=dict)
+
+  def GetMetricNames(self):
+    return list(self.metrics) + list(self.counters)
 
-  def GetMetric(self, metric_index):
-    data = [frame.metrics[metric_index] for frame in self.frame_datapoints]
-    return AggregatedTestMetric(_CSV_BENCHMARK_METRICS[metric_index], min(data),
-                                statistics.mean(data), statistics.median(data),
-                                max(data))
+  def GetMetric(self, name, frame_budgets_ms=()):
+    """Aggregate the values of a metric.
+
+    Args:
+      name: The name of the metric.
+      frame_budgets_ms: Frame time budgets, in milliseconds, to count the
+        datapoints over. Only used for metrics measured in milliseconds.
+
+    Returns:
+      The AggregatedTestMetric of the metric.
+    """
+    higher_is_better = name in self.higher_is_better
+    if name in self.counters:
+      value = self.counters[name]
+      return AggregatedTestMetric(name, value, value, value, value,
+                                  higher_is_better)
+
+    # A single sort yields min, median, max, percentiles and the slowest
+    # frames; sums run over the array without any per-value Python code.
+    values = self.metrics[name]
+    data = sorted(values)
+    count = len(data)
+    if count % 2:
+      median = data[count // 2]
+    else:
+      median = (data[count // 2 - 1] + data[count // 2]) / 2
+    mean = math.fsum(data) / count
+    variance = 0.0
+    if count > 1:
+      sum_of_squares = math.fsum(map(operator.mul, data, data))
+      variance = max(0.0, (sum_of_squares - count * mean * mean) / (count - 1))
+
+    metric = AggregatedTestMetric(
+        name,
+        data[0],
+        mean,
+        median,
+        data[-1],
+        higher_is_better,
+        p90=_Percentile(data, 90),
+        p95=_Percentile(data, 95),
+        p99=_Percentile(data, 99),
+        p99_9=_Percentile(data, 99.9),
+        variance=variance)
+    if _IsMilliseconds(name):
+      metric.low_1_percent_fps = _LowFps(data, 1)
+      metric.low_0_1_percent_fps = _LowFps(data, 0.1)
+      for budget in frame_budgets_ms:
+        metric.frames_over_budget[budget] = (
+            count - bisect.bisect_right(data, budget))
+        metric.longest_over_budget_streak[budget] = _LongestStreakOver(
+            values, budget)
+    return metric
 
   def ContainsDatapoints(self):
-    return self.frame_datapoints
+    return any(self.metrics.values()) or bool(self.counters)
+
+  def SkipFrames(self, num_frames_to_ignore):
+    """Return the results without the datapoints of frames 1..N.
+
+    Series that aren't indexed by frame drop their first N entries instead.
+    Counters are kept as they are.
+    """
+    if not self.frame_numbers:
+      if num_frames_to_ignore <= 0:
+        return self
+      return dataclasses.replace(
+          self,
+          metrics={
+              name: values[num_frames_to_ignore:]
+              for name, values in self.metrics.items()
+          })
+
+    if min(self.frame_numbers) > num_frames_to_ignore:
+      return self
+    keep = bytes(map(num_frames_to_ignore.__lt__, self.frame_numbers))
+    return dataclasses.replace(
+        self,
+        frame_numbers=array.array(
+            'q', itertools.compress(self.frame_numbers, keep)),
+        metrics={
+            name: array.array('d', itertools.compress(values, keep))
+            for name, values in self.metrics.items()
+        })
+
+  def TrimToSteadyState(self, detector):
+    """Return the results without warm-up and throttled datapoints.
+
+    All metrics of frame-indexed results keep the same frames: the frames
+    where every metric is steady. Other series are trimmed independently.
+
+    Args:
+      detector: The SteadyStateDetector finding the steady datapoints.
+    """
+    if self.frame_numbers:
+      ranges = [detector.Detect(values) for values in self.metrics.values()]
+      start = max(r[0] for r in ranges)
+      end = max(start, min(r[1] for r in ranges))
+      if start == end:
+        return self
+      steady_state = {
+          '': (self.frame_numbers[start], self.frame_numbers[end - 1],
+               end - start, len(self.frame_numbers))
+      }
+      return dataclasses.replace(
+          self,
+          frame_numbers=self.frame_numbers[start:end],
+          metrics={
+              name: values[start:end] for name, values in self.metrics.items()
+          },
+          steady_state=steady_state)
+
+    metrics = {}
+    steady_state = {}
+    for name, values in self.metrics.items():
+      start, end = detector.Detect(values)
+      metrics[name] = values[start:end]
+      if end > start:
+        steady_state[name] = (start + 1, end, end - start, len(values))
+    return dataclasses.replace(
+        self, metrics=metrics, steady_state=steady_state)
+
+
+@dataclasses.dataclass
+class SteadyStateDetector:
+  """Finds where a series of datapoints reaches a steady state.
+
+  Benchmarks warm up over a variable number of frames (shader compilation,
+  pipeline caches, clock ramp-up), and may throttle towards the end. The
+  steady level is the median of the rolling means of the series, and the
+  steady state spans from the first to the last window whose mean is within a
+  tolerance of that level. Since a window can be steady on average and still
+  include the last warm-up frames, the span then excludes any frame of its
+  first and last windows that is further from the steady level than both the
+  tolerance and the usual frame to frame noise, with the frames before or
+  after it.
+
+  Attributes:
+    window: The number of datapoints in each rolling window.
+    tolerance_percent: How far, in percent of the steady level, the mean of a
+      window may be for the window to be steady.
+  """
+  window: int = 60
+  tolerance_percent: float = 10.0
+
+  def Detect(self, values):
+    """Return the [start, end) range of steady datapoints in `values`."""
+    count = len(values)
+    window = self.window
+    if window < 1 or count < 2 * window:
+      return 0, count
+
+    # Rolling sums come from prefix sums, without any per-value Python code.
+    prefix_sums = array.array('d', itertools.accumulate(values, initial=0.0))
+    sums = array.array('d', map(operator.sub, prefix_sums[window:],
+                                prefix_sums[:-window]))
+    reference = sorted(sums)[len(sums) // 2]
+    tolerance = abs(reference) * self.tolerance_percent / 100
+    low = reference - tolerance
+    high = reference + tolerance
+
+    # Only the windows up to the first and from the last steady one are read.
+    start = next(i for i in range(len(sums)) if low <= sums[i] <= high)
+    last = next(
+        i for i in range(len(sums) - 1, -1, -1) if low <= sums[i] <= high)
+    end = last + window
+
+    # The first and last steady windows are only steady on average, so they
+    # are cut after (before) their last (first) outlier. The noise is four
+    # scaled median absolute deviations of the steady datapoints, so that
+    # noisy series don't lose frames that are merely typical.
+    steady = sorted(values[start:end])
+    median = steady[len(steady) // 2]
+    deviations = sorted(abs(value - median) for value in steady)
+    spread = max(tolerance / window,
+                 4 * 1.4826 * deviations[len(deviations) // 2])
+    frame_low = reference / window - spread
+    frame_high = reference / window + spread
+    outliers = [
+        i for i in range(start, min(start + window, end))
+        if not frame_low <= values[i] <= frame_high
+    ]
+    if outliers:
+      start = outliers[-1] + 1
+    outliers = [
+        i for i in range(max(end - window, start), end)
+        if not frame_low <= values[i] <= frame_high
+    ]
+    if outliers:
+      end = outliers[0]
+    return start, end
 
 
 def CollectBenchmarkTestResults(results_dir):
   """Collect benchmark results file names by benchmark test case name.
 
+  Results are either CSV benchmark files or JSON metrics reports written by
+  applications run with --enable-metrics. The test case name is the filename
+  without its extension.
+
   Args:
-    results_dir: The directory where CSV benchmark test results are present.
+    results_dir: The directory where benchmark test results are present.
 
   Returns:
     A dictionary that maps test case names to the filename containing results.
   """
   test_cases = dict()
-  for _, _, filenames in os.walk(results_dir):
+  for _, dirnames, filenames in os.walk(results_dir):
+    if _RESULTS_CACHE_DIR_NAME in dirnames:
+      dirnames.remove(_RESULTS_CACHE_DIR_NAME)
     for filename in sorted(filenames):
-      if filename.endswith('.csv'):
-        test_cases[filename[:-4]] = os.path.join(results_dir, filename)
+      test_name, extension = os.path.splitext(filename)
+      if extension not in ('.csv', '.json'):
+        continue
+      if test_name in test_cases:
+        logging.warning('Ignoring %s, results for %s were already found',
+                        os.path.join(results_dir, filename), test_name)
+        continue
+      test_cases[test_name] = os.path.join(results_dir, filename)
   return test_cases
 
 
-def ReadTestResults(result_filename, num_frames_to_ignore):
-  """Read test results given a path to a CSV benchmark file.
+def _ParseTestResultsCsv(result_filename):
+  """Parse every frame of a CSV benchmark file.
 
   Args:
     result_filename: The path to the CSV output from a benchmark run.
+
+  Returns:
+    The parsed test results, or None if the file is invalid.
+  """
+  results = TestResults(
+      metrics={name: array.array('d') for name in _CSV_BENCHMARK_METRICS})
+  num_columns = 1 + len(_CSV_BENCHMARK_METRICS)
+  with open(result_filename, newline='') as f:
+    r = csv.reader(f, delimiter=',')
+    # Rows are converted in chunks so that the per-value work happens in
+    # zip/map/array rather than in a Python loop over every row.
+    for chunk in iter(lambda: list(itertools.islice(r, _CSV_READ_CHUNK_ROWS)),
+                      []):
+      if min(map(len, chunk)) < num_columns:
+        logging.error('Invalid result CSV format for file %s', result_filename)
+        return None
+      columns = list(zip(*chunk))[:num_columns]
+      frame_numbers = array.array('q', map(int, columns[0]))
+      if min(frame_numbers) < 0:
+        logging.error('Invalid frame number %s found in CSV file %s',
+                      min(frame_numbers), result_filename)
+        return None
+
+      results.frame_numbers.extend(frame_numbers)
+      for values, column in zip(results.metrics.values(), columns[1:]):
+        values.extend(map(float, column))
+
+  return results
+
+
+def _ParseTimeSeriesValues(report, start, end):
+  """Parse the values of the [seconds, value] entries in report[start:end]."""
+  # Numbers are converted straight from the matches into the array, without
+  # building any intermediate list.
+  numbers = map(
+      operator.itemgetter(0),
+      itertools.islice(
+          _METRICS_REPORT_NUMBER.finditer(report, start, end), 1, None, 2))
+  # Non-finite values are written as null, and are left out.
+  if report.find(b'null', start, end) != -1:
+    numbers = filter(b'null'.__ne__, numbers)
+  return array.array('d', map(float, numbers))
+
+
+def _ParseMetricsReport(result_filename):
+  """Parse every gauge and counter of a metrics report.
+
+  A metrics report is the JSON file written by applications run with
+  --enable-metrics (see ppx::metrics::Report). Gauges become metrics, named
+  after the run if the report has several runs, and counters become counters.
+
+  The `time_series` arrays hold most of a report, so they are scanned directly
+  into numeric arrays, and only the rest of the report is decoded as JSON.
+
+  Args:
+    result_filename: The path to the metrics report.
+
+  Returns:
+    The parsed test results, or None if the file is invalid.
+  """
+  with open(result_filename, 'rb') as f:
+    if os.fstat(f.fileno()).st_size == 0:
+      logging.error('Invalid metrics report %s', result_filename)
+      return None
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as report:
+      pieces = []
+      series = []
+      position = 0
+      for match in _METRICS_REPORT_TIME_SERIES_START.finditer(report):
+        if match.start() < position:
+          continue
+        if report[match.end():match.end() + 1] == b']':
+          end = match.end()
+          series.append(array.array('d'))
+        else:
+          end_match = _METRICS_REPORT_TIME_SERIES_END.search(
+              report, match.end())
+          if not end_match:
+            logging.error('Invalid metrics report %s', result_filename)
+            return None
+          end = end_match.end() - 1
+          series.append(_ParseTimeSeriesValues(report, match.end(), end))
+        # Leave an empty time series in place of the parsed one.
+        pieces.append(report[position:match.end()])
+        position = end
+      pieces.append(report[position:])
+
+  results = TestResults()
+  try:
+    content = json.loads(b''.join(pieces))
+    runs = content['runs']
+    gauges = [(run, gauge) for run in runs for gauge in run['gauges']]
+    if len(gauges) != len(series):
+      raise ValueError('time series do not match gauges')
+
+    def Name(run, metric):
+      metadata = metric['metadata']
+      name = metadata['name']
+      if metadata.get('unit'):
+        name = '{} ({})'.format(name, metadata['unit'])
+      if len(runs) > 1:
+        name = '{}: {}'.format(run['name'], name)
+      if metadata.get('interpretation') == _METRICS_REPORT_HIGHER_IS_BETTER:
+        results.higher_is_better.add(name)
+      return name
+
+    for (run, gauge), values in zip(gauges, series):
+      results.metrics[Name(run, gauge)] = values
+    for run in runs:
+      for counter in run['counters']:
+        results.counters[Name(run, counter)] = float(counter['value'])
+  except (KeyError, TypeError, ValueError) as e:
+    logging.error('Invalid metrics report %s: %s', result_filename, e)
+    return None
+
+  return results
+
+
+class ResultsCache:
+  """A binary cache of parsed results files, stored next to the results.
+
+  Each cached file has two entries in the cache directory: `<file>.bin` holds
+  the packed frame number and metric arrays, and `<file>.json` is a manifest
+  describing them along with any counters. An entry is only used while the
+  size and SHA-256 of the results file still match its manifest. The file is
+  only hashed when its modification time changed; if its contents turn out to
+  be the same, the manifest is updated with the new time.
+  """
+
+  def __init__(self, result_filename):
+    self.result_filename = result_filename
+    cache_dir = os.path.join(
+        os.path.dirname(result_filename), _RESULTS_CACHE_DIR_NAME)
+    basename = os.path.basename(result_filename)
+    self.manifest_filename = os.path.join(cache_dir, basename + '.json')
+    self.data_filename = os.path.join(cache_dir, basename + '.bin')
+
+  @staticmethod
+  def Clear(results_dir):
+    """Delete the cache directory of a results directory, if any."""
+    shutil.rmtree(
+        os.path.join(results_dir, _RESULTS_CACHE_DIR_NAME), ignore_errors=True)
+
+  def _Digest(self):
+    with open(self.result_filename, 'rb') as f:
+      return hashlib.file_digest(f, 'sha256').hexdigest()
+
+  def _Fingerprint(self):
+    stat = os.stat(self.result_filename)
+    return {
+        'version': _RESULTS_CACHE_VERSION,
+        'byteorder': sys.byteorder,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+    }
+
+  def Load(self):
+    """Return the cached results, or None if there is no valid entry."""
+    try:
+      with open(self.manifest_filename) as f:
+        manifest = json.load(f)
+    except (OSError, ValueError):
+      return None
+
+    fingerprint = self._Fingerprint()
+    if any(manifest.get(k) != v for k, v in fingerprint.items()
+           if k != 'mtime_ns'):
+      self.Drop()
+      return None
+    if manifest.get('mtime_ns') != fingerprint['mtime_ns']:
+      if manifest.get('sha256') != self._Digest():
+        self.Drop()
+        return None
+      manifest['mtime_ns'] = fingerprint['mtime_ns']
+      try:
+        self._WriteManifest(manifest)
+      except OSError:
+        pass  # Touched files are hashed again next time.
+
+    results = TestResults(
+        metrics={name: array.array('d') for name, _ in manifest['metrics']},
+        counters=manifest['counters'],
+        higher_is_better=set(manifest['higher_is_better']))
+    try:
+      with open(self.data_filename, 'rb') as f:
+        results.frame_numbers.fromfile(f, manifest['num_frames'])
+        for name, length in manifest['metrics']:
+          results.metrics[name].fromfile(f, length)
+    except (OSError, EOFError):
+      self.Drop()
+      return None
+    return results
+
+  def Store(self, results):
+    """Write an entry for `results`, replacing any previous entry."""
+    manifest = self._Fingerprint()
+    manifest['sha256'] = self._Digest()
+    manifest['num_frames'] = len(results.frame_numbers)
+    manifest['metrics'] = [
+        [name, len(values)] for name, values in results.metrics.items()
+    ]
+    manifest['counters'] = results.counters
+    manifest['higher_is_better'] = sorted(results.higher_is_better)
+    try:
+      os.makedirs(os.path.dirname(self.data_filename), exist_ok=True)
+      # Write to temporary files first so that a concurrent or interrupted run
+      # never observes a partially written entry.
+      with open(self.data_filename + '.tmp', 'wb') as f:
+        results.frame_numbers.tofile(f)
+        for values in results.metrics.values():
+          values.tofile(f)
+      os.replace(self.data_filename + '.tmp', self.data_filename)
+      self._WriteManifest(manifest)
+    except OSError as e:
+      logging.warning('Unable to cache results for %s: %s',
+                      self.result_filename, e)
+
+  def _WriteManifest(self, manifest):
+    with open(self.manifest_filename + '.tmp', 'w') as f:
+      json.dump(manifest, f)
+    os.replace(self.manifest_filename + '.tmp', self.manifest_filename)
+
+  def Drop(self):
+    """Remove the entry for the results file, if any."""
+    for filename in (self.manifest_filename, self.data_filename):
+      try:
+        os.remove(filename)
+      except OSError:
+        pass
+
+
+def ReadTestResults(result_filename,
+                    num_frames_to_ignore,
+                    use_cache=True,
+                    steady_state=None):
+  """Read test results given a path to a results file.
+
+  Args:
+    result_filename: The path to the CSV output from a benchmark run, or to a
+      metrics report.
     num_frames_to_ignore: The number N of frames to ignore. The datapoints of
       the first N frames will be ignored when reading results.
+    use_cache: Whether to read and update the ResultsCache for the file.
+    steady_state: If set, the SteadyStateDetector used to trim the results
+      once frames have been ignored.
 
   Returns:
     The parsed test results.
   """
-  frame_datapoints = []
-  with open(result_filename) as f:
-    r = csv.reader(f, delimiter=',')
-    for row in r:
-      if len(row) < 3:
-        logging.error('Invalid result CSV format for file %s', result_filename)
-        return TestResults()
-      frame_num = int(row[0])
-      if frame_num < 0:
-        logging.error('Invalid frame number %s found in CSV file %s', frame_num,
-                      result_filename)
-        return TestResults()
-      if frame_num <= num_frames_to_ignore:
-        continue
-      frame_datapoints.append(
-          FrameDatapoint(frame_num,
-                         [float(row[1]), float(row[2])]))
+  cache = ResultsCache(result_filename) if use_cache else None
+  results = cache.Load() if cache else None
+  if results is None:
+    if result_filename.endswith('.json'):
+      results = _ParseMetricsReport(result_filename)
+    else:
+      results = _ParseTestResultsCsv(result_filename)
+    if results is None:
+      if cache:
+        cache.Drop()
+      return TestResults()
+    if cache:
+      cache.Store(results)
 
-  return TestResults(frame_datapoints)
+  results = results.SkipFrames(num_frames_to_ignore)
+  if steady_state:
+    results = results.TrimToSteadyState(steady_state)
+  return results
 
 
 def GetPercentageDiff(first, second):
   """Get the percentage difference of `second` over `first`."""
+  if first == second:
+    return 0.0
   if first == 0:
     first = 1e-10
   return ((second - first) * 100.0) / first
@@ -168,37 +734,945 @@ def PrintMetricResultsComparison(name_baseline, name_other, metric_baseline,
               name_baseline))
 
 
-def CompareTestResults(results, names, num_frames_to_ignore):
-  """Compare a set of benchmark results, using the first as the baseline."""
-  base_results = results[0]
+def _FormatValues(values):
+  return ', '.join(
+      str(v) if isinstance(v, int) else '{:.2f}'.format(v) for v in values)
+
+
+def PrintSteadyState(results_name, steady_state):
+  """Print the datapoints kept by TestResults.TrimToSteadyState."""
+  for name, (first, last, kept, total) in steady_state.items():
+    if name:
+      description = 'Steady state of {}: entries'.format(name)
+    else:
+      description = 'Steady state: frames'
+    print('\t[{}] {} {}..{} ({} of {} kept)'.format(results_name, description,
+                                                    first, last, kept, total))
+
+
+def PrintMetricValuesBaseline(results_name, title, values):
+  """Print a titled list of values of a baseline metric."""
+  print('--- {}'.format(title))
+  print('\t[{}] {}'.format(results_name, _FormatValues(values)))
+
+
+def PrintMetricValuesComparison(name_baseline, name_other, values_baseline,
+                                values_other):
+  """Print a list of values of a metric against the baseline values."""
+  print('\t[{}] {} ({} vs {})'.format(
+      name_other, _FormatValues(values_other),
+      ', '.join('{:+5.2f}%'.format(GetPercentageDiff(b, o))
+                for b, o in zip(values_baseline, values_other)), name_baseline))
+
+
+def TailLatencyTables(metric):
+  """Return the tail latency and frame pacing values of a metric.
+
+  Returns:
+    A list of (title, getter) pairs, where getter returns the values shown
+    under that title for an AggregatedTestMetric.
+  """
+  if metric.p90 is None:
+    return []
+  tables = [
+      ('{}, P90/P95/P99/P99.9'.format(metric.name),
+       lambda m: [m.p90, m.p95, m.p99, m.p99_9]),
+      ('{}, Variance'.format(metric.name), lambda m: [m.variance]),
+  ]
+  if metric.low_1_percent_fps is not None:
+    tables.append(('{}, 1% low FPS/0.1% low FPS'.format(metric.name),
+                   lambda m: [m.low_1_percent_fps, m.low_0_1_percent_fps]))
+  for budget in metric.frames_over_budget:
+    tables.append(
+        ('{}, Frames over {} ms/Longest streak'.format(metric.name, budget),
+         lambda m, b=budget:
+         [m.frames_over_budget[b], m.longest_over_budget_streak[b]]))
+  return tables
+
+
+def MannWhitneyUTest(baseline, other):
+  """Run a two-sided Mann-Whitney U test on two samples.
+
+  Uses the normal approximation with a correction for ties, which is accurate
+  for the sample sizes produced by benchmark runs. Ranks are never
+  materialized: both samples are sorted once, the U statistic is computed
+  from binary searches of every value of `other` in the sorted baseline, and
+  ties are found by comparing neighbours in the merged samples.
+
+  Args:
+    baseline: The baseline sample.
+    other: The sample compared against the baseline.
+
+  Returns:
+    The p-value of the null hypothesis that both samples come from the same
+    distribution.
+  """
+  n1 = len(baseline)
+  n2 = len(other)
+  if n1 == 0 or n2 == 0:
+    return 1.0
+
+  sorted_baseline = sorted(baseline)
+  sorted_other = sorted(other)
+  # Sorting two concatenated sorted runs only merges them.
+  merged = sorted_baseline + sorted_other
+  merged.sort()
+  # Frame times rarely repeat, so the groups are only built if there are ties.
+  has_ties = any(map(operator.eq, merged, itertools.islice(merged, 1, None)))
+  ties = 0.0
+  if has_ties:
+    ties = math.fsum(
+        t**3 - t
+        for t in (len(list(group)) for _, group in itertools.groupby(merged))
+        if t > 1)
+
+  # U counts the (baseline, other) pairs where `other` is larger, with ties
+  # counting for half. Mapping bisect over the sorted samples keeps the work per
+  # frame out of the interpreter.
+  baselines = itertools.repeat(sorted_baseline, n2)
+  u = sum(map(bisect.bisect_left, baselines, sorted_other))
+  if has_ties:
+    baselines = itertools.repeat(sorted_baseline, n2)
+    u = (u + sum(map(bisect.bisect_right, baselines, sorted_other))) / 2
+  n = n1 + n2
+  variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+  if variance <= 0:
+    return 1.0
+  z = (u - n1 * n2 / 2) / math.sqrt(variance)
+  return math.erfc(abs(z) / math.sqrt(2))
+
+
+@dataclasses.dataclass
+class RegressionGate:
+  """Thresholds deciding whether a metric regressed against its baseline.
+
+  A metric regresses when the Mann-Whitney U test rejects the hypothesis that
+  both runs come from the same distribution, and its median also got worse by
+  more than a minimum amount. Larger values are worse, unless the metric is
+  marked as higher_is_better.
+
+  Attributes:
+    alpha: The significance level of the test.
+    threshold_percent: The minimum change of the median, in percent, for a
+      significant difference to count as a regression.
+  """
+  alpha: float = 0.01
+  threshold_percent: float = 5.0
+
+  def Evaluate(self, baseline, other, metric_baseline, metric_other):
+    """Return the p-value and whether `other` regressed against `baseline`."""
+    p_value = MannWhitneyUTest(baseline, other)
+    percentage_diff_median = GetPercentageDiff(metric_baseline.median,
+                                               metric_other.median)
+    if metric_baseline.higher_is_better:
+      percentage_diff_median = -percentage_diff_median
+    regressed = (p_value < self.alpha and
+                 percentage_diff_median > self.threshold_percent)
+    return p_value, regressed
+
+
+def PrintMetricGateResult(name_other, p_value, regressed):
+  """Print the outcome of a RegressionGate evaluation."""
+  print('\t[{}] Mann-Whitney U p-value: {:.3g}{}'.format(
+      name_other, p_value, ' REGRESSION' if regressed else ''))
+
+
+class LogHistogram:
+  """Streaming quantiles of positive values, within a relative error.
+
+  Values are counted in bins whose bounds grow geometrically, so any quantile
+  is known within `relative_error` of a value at that rank whatever order the
+  values come in, e.g. with warm-up frames first. Memory grows with the
+  logarithm of the range of the values, not with their number. Values that
+  aren't positive are counted together as zero, and non-finite ones are left
+  out.
+  """
+
+  def __init__(self, relative_error=0.005):
+    self.gamma = (1 + relative_error) / (1 - relative_error)
+    self.log_gamma = math.log(self.gamma)
+    # Bin i counts the values in (gamma ** (i - 1), gamma ** i].
+    self.bins = collections.Counter()
+    self.zeros = 0
+    self.count = 0
+
+  def Add(self, value):
+    if not math.isfinite(value):
+      return
+    self.count += 1
+    if value > 0:
+      self.bins[math.ceil(math.log(value) / self.log_gamma)] += 1
+    else:
+      self.zeros += 1
+
+  def Value(self, quantile):
+    """Return the estimate of a quantile, from 0 to 1, or NaN if empty."""
+    if not self.count:
+      return math.nan
+    rank = quantile * (self.count - 1)
+    seen = self.zeros
+    if rank < seen:
+      return 0.0
+    for index in sorted(self.bins):
+      seen += self.bins[index]
+      if rank < seen:
+        break
+    # The point of the bin with the same relative error to both its bounds.
+    return 2 * self.gamma**index / (self.gamma + 1)
+
+
+class RunningMetric:
+  """Aggregates a metric one value at a time, in constant memory.
+
+  The mean and variance use Welford's algorithm. Percentiles are approximate,
+  from a LogHistogram, and within 0.5% of the exact ones.
+  """
+
+  def __init__(self, name, frame_budgets_ms=()):
+    self.name = name
+    self.count = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+    self.min = math.inf
+    self.max = -math.inf
+    self.histogram = LogHistogram()
+    self.frame_budgets_ms = frame_budgets_ms if _IsMilliseconds(name) else ()
+    self.frames_over_budget = {budget: 0 for budget in self.frame_budgets_ms}
+    self.current_streak = dict(self.frames_over_budget)
+    self.longest_streak = dict(self.frames_over_budget)
+
+  def Add(self, value):
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self.m2 += delta * (value - self.mean)
+    self.min = min(self.min, value)
+    self.max = max(self.max, value)
+    self.histogram.Add(value)
+    for budget in self.frame_budgets_ms:
+      if value > budget:
+        self.frames_over_budget[budget] += 1
+        self.current_streak[budget] += 1
+        self.longest_streak[budget] = max(self.longest_streak[budget],
+                                          self.current_streak[budget])
+      else:
+        self.current_streak[budget] = 0
+
+  def _Percentile(self, percent):
+    # Estimates are kept within the exact range of the values.
+    return min(max(self.histogram.Value(percent / 100), self.min), self.max)
+
+  def GetMetric(self):
+    """Return the AggregatedTestMetric of the values added so far."""
+    return AggregatedTestMetric(
+        self.name,
+        self.min,
+        self.mean,
+        self._Percentile(50),
+        self.max,
+        p90=self._Percentile(90),
+        p95=self._Percentile(95),
+        p99=self._Percentile(99),
+        p99_9=self._Percentile(99.9),
+        variance=self.m2 / (self.count - 1) if self.count > 1 else 0.0,
+        frames_over_budget=dict(self.frames_over_budget),
+        longest_over_budget_streak=dict(self.longest_streak))
+
+
+class LiveTestResults:
+  """Test results aggregated from a CSV benchmark file that is still growing.
+
+  Each Update() only reads the bytes appended since the previous one, so a
+  file is never read twice and memory doesn't grow with the number of frames.
+  """
+
+  def __init__(self, result_filename, num_frames_to_ignore,
+               frame_budgets_ms=()):
+    self.result_filename = result_filename
+    self.num_frames_to_ignore = num_frames_to_ignore
+    self.frame_budgets_ms = frame_budgets_ms
+    self._Reset()
+
+  def _Reset(self):
+    self.offset = 0
+    self.partial_line = b''
+    self.metrics = [
+        RunningMetric(name, self.frame_budgets_ms)
+        for name in _CSV_BENCHMARK_METRICS
+    ]
+
+  def Update(self):
+    """Aggregate the rows appended to the file since the last update."""
+    try:
+      f = open(self.result_filename, 'rb')
+    except FileNotFoundError:
+      return
+    with f:
+      if os.fstat(f.fileno()).st_size < self.offset:
+        logging.info('%s was truncated, restarting', self.result_filename)
+        self._Reset()
+      f.seek(self.offset)
+      # Bounded reads keep memory constant even when first reading a large
+      # existing file.
+      while data := f.read(_FOLLOW_READ_CHUNK_BYTES):
+        self.offset += len(data)
+        self._AddData(data)
+
+  def _AddData(self, data):
+    # The last line may still be in the middle of being written, or be cut by
+    # the end of the chunk.
+    lines = (self.partial_line + data).split(b'\n')
+    self.partial_line = lines.pop()
+    rows = csv.reader(line.decode() for line in lines if line.strip())
+    num_columns = 1 + len(_CSV_BENCHMARK_METRICS)
+    for row in rows:
+      try:
+        if len(row) < num_columns:
+          raise ValueError('expected {} columns'.format(num_columns))
+        frame_num = int(row[0])
+        values = [float(v) for v in row[1:num_columns]]
+      except ValueError as e:
+        logging.error('Ignoring invalid row %s in CSV file %s: %s', row,
+                      self.result_filename, e)
+        continue
+      if frame_num <= self.num_frames_to_ignore:
+        continue
+      for metric, value in zip(self.metrics, values):
+        metric.Add(value)
+
+  def ContainsDatapoints(self):
+    return self.metrics[0].count > 0
+
+
+def FollowTestResults(live_filename,
+                      base_filename,
+                      base_name,
+                      num_frames_to_ignore,
+                      interval_s,
+                      use_cache=True,
+                      frame_budgets_ms=None):
+  """Repeatedly compare a growing CSV benchmark file against a baseline.
+
+  Runs until interrupted.
+
+  Args:
+    live_filename: The path to the CSV file being written by a benchmark.
+    base_filename: The path to the baseline results of the same test case.
+    base_name: The name of the baseline results.
+    num_frames_to_ignore: The number N of frames to ignore in each file.
+    interval_s: The number of seconds between comparisons.
+    use_cache: Whether to read and update the ResultsCache of the baseline.
+    frame_budgets_ms: If set, also compare tail latency and frame pacing,
+      counting the frames over each of these budgets in milliseconds.
+
+  Returns:
+    0 once interrupted.
+  """
+  base_data = ReadTestResults(base_filename, num_frames_to_ignore, use_cache)
+  if not base_data.ContainsDatapoints():
+    logging.error('No baseline data in %s', base_filename)
+    return -1
+  base_metrics = [
+      base_data.GetMetric(name, frame_budgets_ms or ())
+      for name in _CSV_BENCHMARK_METRICS
+  ]
+  live = LiveTestResults(live_filename, num_frames_to_ignore,
+                         frame_budgets_ms or ())
+  live_name = os.path.basename(live_filename)
+
+  try:
+    while True:
+      live.Update()
+      print('Benchmark %s (%d frames):' % (live_name, live.metrics[0].count))
+      for base_metric, running_metric in zip(base_metrics, live.metrics):
+        PrintMetricResultsBaseline(base_name, base_metric)
+        if not live.ContainsDatapoints():
+          print('\t[%s] No data' % live_name)
+          continue
+        live_metric = running_metric.GetMetric()
+        PrintMetricResultsComparison(base_name, live_name, base_metric,
+                                     live_metric)
+        if frame_budgets_ms is None:
+          continue
+        # Low FPS can't be computed in constant memory, so only the values of
+        # the live metric are shown.
+        for title, getter in TailLatencyTables(live_metric):
+          PrintMetricValuesBaseline(base_name, title, getter(base_metric))
+          PrintMetricValuesComparison(base_name, live_name,
+                                      getter(base_metric), getter(live_metric))
+      print('', flush=True)
+      time.sleep(interval_s)
+  except KeyboardInterrupt:
+    return 0
+
+
+def LoadTestResults(results,
+                    num_frames_to_ignore,
+                    jobs,
+                    use_cache=True,
+                    steady_state=None):
+  """Read every results file needed for a comparison exactly once.
+
+  Files are parsed in parallel across a process pool. Only test cases present
+  in the baseline are loaded, since no others are compared.
+
+  Args:
+    results: A list of dictionaries, one per results directory, mapping test
+      case names to result filenames. The first is the baseline.
+    num_frames_to_ignore: The number N of frames to ignore in each file.
+    jobs: The maximum number of worker processes, or None for one per CPU.
+    use_cache: Whether to read and update each directory's ResultsCache.
+    steady_state: If set, the SteadyStateDetector used to trim each file.
+
+  Returns:
+    A list parallel to `results` of dictionaries mapping test case names to
+    parsed TestResults.
+  """
+  loaded = [dict() for _ in results]
+  with futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+    future_to_key = {}
+    for i, test_cases in enumerate(results):
+      for test_name in results[0]:
+        if test_name not in test_cases:
+          continue
+        future = executor.submit(ReadTestResults, test_cases[test_name],
+                                 num_frames_to_ignore, use_cache, steady_state)
+        future_to_key[future] = (i, test_name)
+
+    for future in futures.as_completed(future_to_key):
+      i, test_name = future_to_key[future]
+      loaded[i][test_name] = future.result()
+
+  return loaded
+
+
+def _Statistics(metric):
+  """Map the name of each statistic of an AggregatedTestMetric to its value."""
+  statistics = {
+      field.name: getattr(metric, field.name)
+      for field in dataclasses.fields(metric)
+      if field.type in (float, float | None) and
+      getattr(metric, field.name) is not None
+  }
+  for budget, count in metric.frames_over_budget.items():
+    statistics['frames_over_{}_ms'.format(budget)] = count
+  for budget, streak in metric.longest_over_budget_streak.items():
+    statistics['longest_streak_over_{}_ms'.format(budget)] = streak
+  return statistics
+
+
+class HistoryStore:
+  """An append-only SQLite database of aggregated benchmark results.
+
+  Every ingested results directory is a run, recorded along with the commit,
+  host and benchmark flags it was produced with. The statistics of each
+  metric of each test case are stored precomputed and indexed, so that trends
+  over many runs can be queried without reading any results file.
+  """
+
+  _SCHEMA = """
+      CREATE TABLE IF NOT EXISTS runs (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          commit_sha TEXT NOT NULL,
+          host TEXT NOT NULL,
+          flags TEXT NOT NULL,
+          results_dir TEXT NOT NULL,
+          ingested_at TEXT NOT NULL,
+          UNIQUE (commit_sha, host, flags, results_dir));
+      CREATE TABLE IF NOT EXISTS aggregates (
+          run_id INTEGER NOT NULL REFERENCES runs(id),
+          test_case TEXT NOT NULL,
+          metric TEXT NOT NULL,
+          statistic TEXT NOT NULL,
+          value REAL NOT NULL);
+      CREATE INDEX IF NOT EXISTS aggregates_by_metric
+          ON aggregates (test_case, metric, statistic, run_id);
+  """
+
+  def __init__(self, path):
+    self.connection = sqlite3.connect(path)
+    self.connection.executescript(self._SCHEMA)
+
+  def Close(self):
+    self.connection.close()
+
+  def Ingest(self, results_dir, commit_sha, host, flags, aggregated):
+    """Record a run.
+
+    Args:
+      results_dir: The name of the results directory of the run.
+      commit_sha: The commit the benchmarks were built from.
+      host: The host the benchmarks ran on.
+      flags: The flags the benchmarks ran with.
+      aggregated: Maps test case names to lists of AggregatedTestMetric.
+
+    Returns:
+      False if the run was already ingested, True otherwise.
+    """
+    with self.connection:
+      try:
+        cursor = self.connection.execute(
+            'INSERT INTO runs (commit_sha, host, flags, results_dir, '
+            'ingested_at) VALUES (?, ?, ?, ?, ?)',
+            (commit_sha, host, flags, results_dir,
+             datetime.datetime.now().isoformat()))
+      except sqlite3.IntegrityError:
+        return False
+      run_id = cursor.lastrowid
+      self.connection.executemany(
+          'INSERT INTO aggregates '
+          '(run_id, test_case, metric, statistic, value) '
+          'VALUES (?, ?, ?, ?, ?)',
+          ((run_id, test_name, metric.name, statistic, value)
+           for test_name, metrics in aggregated.items()
+           for metric in metrics
+           for statistic, value in _Statistics(metric).items()))
+    return True
+
+  def Query(self, test_name, metric_name, statistic, limit):
+    """Return the latest values of a statistic, oldest first.
+
+    Returns:
+      A list of (commit_sha, host, results_dir, ingested_at, value) tuples for
+      the last `limit` runs that recorded the statistic.
+    """
+    rows = self.connection.execute(
+        'SELECT runs.commit_sha, runs.host, runs.results_dir, '
+        'runs.ingested_at, aggregates.value '
+        'FROM aggregates JOIN runs ON runs.id = aggregates.run_id '
+        'WHERE aggregates.test_case = ? AND aggregates.metric = ? '
+        'AND aggregates.statistic = ? ORDER BY aggregates.run_id DESC LIMIT ?',
+        (test_name, metric_name, statistic, limit)).fetchall()
+    return rows[::-1]
+
+
+def IngestTestResults(history,
+                      results,
+                      names,
+                      num_frames_to_ignore,
+                      commit_sha,
+                      host,
+                      flags,
+                      jobs=None,
+                      use_cache=True,
+                      frame_budgets_ms=(),
+                      steady_state=None):
+  """Aggregate every test case of some results directories into a HistoryStore.
+
+  Returns:
+    0.
+  """
+  for test_cases, name in zip(results, names):
+    loaded = LoadTestResults([test_cases], num_frames_to_ignore, jobs,
+                             use_cache, steady_state)[0]
+    aggregated = {
+        test_name: [
+            data.GetMetric(metric_name, frame_budgets_ms)
+            for metric_name in data.GetMetricNames()
+            if data.metrics.get(metric_name) or metric_name in data.counters
+        ] for test_name, data in loaded.items()
+    }
+    if history.Ingest(name, commit_sha, host, flags, aggregated):
+      logging.info('Ingested %d test cases of %s', len(aggregated), name)
+    else:
+      logging.warning('Skipping %s, already ingested for commit %s on %s', name,
+                      commit_sha, host)
+  return 0
+
+
+def PrintHistory(history, test_name, metric_name, statistic, limit):
+  """Print the trend of a statistic over the latest runs."""
+  rows = history.Query(test_name, metric_name, statistic, limit)
+  print('Benchmark %s:' % test_name)
+  print('--- {}, {} over the last {} runs'.format(metric_name, statistic,
+                                                  len(rows)))
+  for commit_sha, host, results_dir, ingested_at, value in rows:
+    print('\t[{}] {:.2f} ({} on {}, {})'.format(commit_sha, value, results_dir,
+                                                host, ingested_at))
+  return 0
+
+
+@dataclasses.dataclass
+class BenchmarkComparison:
+  """The comparison of a test case across all results directories.
+
+  Attributes:
+    test_name: The name of the test case.
+    results: One entry per results directory, holding the TestResults of the
+      test case, or None if the directory has no results for it.
+    metric_names: The names of the metrics of the baseline.
+    aggregated: One entry per results directory, mapping metric names to
+      AggregatedTestMetric. Metrics without datapoints are left out.
+    gate_results: Maps (metric name, results directory index) to the
+      (p-value, regressed) outcome of the RegressionGate, if any.
+  """
+  test_name: str
+  results: list[TestResults | None]
+  metric_names: list[str] = dataclasses.field(default_factory=list)
+  aggregated: list[dict[str, AggregatedTestMetric]] = dataclasses.field(
+      default_factory=list)
+  gate_results: dict[tuple[str, int], tuple[float, bool]] = dataclasses.field(
+      default_factory=dict)
+
+
+def BuildComparisons(test_names, loaded, gate=None, frame_budgets_ms=None):
+  """Aggregate and compare every test case of loaded results.
+
+  Args:
+    test_names: The test cases to compare, i.e. those of the baseline.
+    loaded: The output of LoadTestResults. The first entry is the baseline.
+    gate: If set, the RegressionGate evaluated for every comparison.
+    frame_budgets_ms: If set, the frame budgets counted by GetMetric.
+
+  Returns:
+    A list of BenchmarkComparison, one per test case.
+  """
+  comparisons = []
+  for test_name in test_names:
+    comparison = BenchmarkComparison(
+        test_name, [test_results.get(test_name) for test_results in loaded])
+    comparisons.append(comparison)
+    base_data = comparison.results[0]
+    if not base_data.ContainsDatapoints():
+      continue
+
+    # Aggregate each metric of each results file once.
+    comparison.metric_names = base_data.GetMetricNames()
+    for data in comparison.results:
+      aggregated = {}
+      comparison.aggregated.append(aggregated)
+      if data is None:
+        continue
+      for name in comparison.metric_names:
+        if data.metrics.get(name) or name in data.counters:
+          aggregated[name] = data.GetMetric(name, frame_budgets_ms or ())
+
+    # Counters are single values, which can't be tested for significance.
+    if not gate:
+      continue
+    for name in base_data.metrics:
+      if name not in comparison.aggregated[0]:
+        continue
+      for i in range(1, len(loaded)):
+        if name in comparison.aggregated[i]:
+          comparison.gate_results[(name, i)] = gate.Evaluate(
+              base_data.metrics[name], comparison.results[i].metrics[name],
+              comparison.aggregated[0][name], comparison.aggregated[i][name])
+
+  return comparisons
+
+
+def PrintComparisons(comparisons, names, frame_budgets_ms=None):
+  """Print comparisons as human-readable text."""
   base_name = names[0]
+  for comparison in comparisons:
+    print('Benchmark %s:' % comparison.test_name)
+
+    for name, data in zip(names, comparison.results):
+      if data is not None:
+        PrintSteadyState(name, data.steady_state)
 
-  for test_name in base_results:
-    print('Benchmark %s:' % test_name)
+    if not comparison.aggregated:
+      print('\t[%s] No data' % base_name)
+      print('')
+      continue
 
     # For each metric measured, print baseline and comparisons.
-    base_data = ReadTestResults(base_results[test_name], num_frames_to_ignore)
-    for m in range(0, len(_CSV_BENCHMARK_METRICS)):
-      PrintMetricResultsBaseline(base_name, base_data.GetMetric(m))
+    aggregated = comparison.aggregated
+    for name in comparison.metric_names:
+      if name not in aggregated[0]:
+        continue
+      PrintMetricResultsBaseline(base_name, aggregated[0][name])
 
       # Output the metric values from all other benchmarks results,
       # showing a percentage comparison against the baseline.
-      for i in range(1, len(results)):
-        other_results = results[i]
+      for i in range(1, len(names)):
         other_name = names[i]
-        if test_name not in other_results:
+        if name not in aggregated[i]:
           print('\t[%s] No data' % other_name)
           continue
 
-        other_data = ReadTestResults(other_results[test_name],
-                                     num_frames_to_ignore)
-        PrintMetricResultsComparison(base_name, other_name,
-                                     base_data.GetMetric(m),
-                                     other_data.GetMetric(m))
+        PrintMetricResultsComparison(base_name, other_name, aggregated[0][name],
+                                     aggregated[i][name])
+        if (name, i) in comparison.gate_results:
+          PrintMetricGateResult(other_name,
+                                *comparison.gate_results[(name, i)])
+
+      if frame_budgets_ms is None:
+        continue
+      for title, getter in TailLatencyTables(aggregated[0][name]):
+        PrintMetricValuesBaseline(base_name, title, getter(aggregated[0][name]))
+        for i in range(1, len(names)):
+          if name in aggregated[i]:
+            PrintMetricValuesComparison(base_name, names[i],
+                                        getter(aggregated[0][name]),
+                                        getter(aggregated[i][name]))
 
     print('')
 
-  return 0
+
+def _ComparisonRecords(comparison, names):
+  """Yield (results name, metric, statistic, value, baseline value, diff).
+
+  The baseline value and percentage difference are None for the baseline
+  itself, and for the outcome of the RegressionGate.
+  """
+  for i, name in enumerate(names):
+    if i >= len(comparison.aggregated):
+      break
+    for metric_name in comparison.metric_names:
+      metric = comparison.aggregated[i].get(metric_name)
+      if metric is None:
+        continue
+      base_statistics = _Statistics(comparison.aggregated[0][metric_name])
+      for statistic, value in _Statistics(metric).items():
+        if i == 0 or statistic not in base_statistics:
+          yield name, metric_name, statistic, value, None, None
+        else:
+          base_value = base_statistics[statistic]
+          yield (name, metric_name, statistic, value, base_value,
+                 GetPercentageDiff(base_value, value))
+      if (metric_name, i) in comparison.gate_results:
+        p_value, regressed = comparison.gate_results[(metric_name, i)]
+        yield name, metric_name, 'p_value', p_value, None, None
+        yield name, metric_name, 'regressed', int(regressed), None, None
+
+
+def WriteComparisonsJson(comparisons, names, output):
+  """Write comparisons as a JSON document of all aggregates and deltas."""
+  benchmarks = []
+  for comparison in comparisons:
+    results = {}
+    for name, data in zip(names, comparison.results):
+      if data is not None:
+        results[name] = {
+            'steady_state': {
+                metric_name or 'frames': dict(
+                    zip(('first', 'last', 'kept', 'total'), kept))
+                for metric_name, kept in data.steady_state.items()
+            },
+            'metrics': {},
+        }
+    for (name, metric_name, statistic, value, base_value,
+         diff) in _ComparisonRecords(comparison, names):
+      metric = results[name]['metrics'].setdefault(metric_name, {})
+      metric[statistic] = value
+      if diff is not None:
+        metric.setdefault('percentage_diff', {})[statistic] = diff
+    benchmarks.append({'name': comparison.test_name, 'results': results})
+
+  json.dump({
+      'baseline': names[0],
+      'results': names,
+      'benchmarks': benchmarks
+  },
+            output,
+            indent=2)
+  output.write('\n')
+
+
+def WriteComparisonsCsv(comparisons, names, output):
+  """Write comparisons as a flat CSV table, one row per statistic."""
+  writer = csv.writer(output, lineterminator='\n')
+  writer.writerow([
+      'benchmark', 'results', 'metric', 'statistic', 'value', 'baseline_value',
+      'percentage_diff'
+  ])
+  for comparison in comparisons:
+    for record in _ComparisonRecords(comparison, names):
+      writer.writerow([comparison.test_name] +
+                      ['' if v is None else v for v in record])
+
+
+def _DecimateMinMax(values, max_buckets):
+  """Reduce a series to the min and max of each of up to max_buckets buckets.
+
+  Returns:
+    A list of (index, value) points that preserve every spike of the series.
+  """
+  count = len(values)
+  if count <= 2 * max_buckets:
+    return list(enumerate(values))
+  points = []
+  for bucket in range(max_buckets):
+    start = bucket * count // max_buckets
+    end = (bucket + 1) * count // max_buckets
+    chunk = values[start:end]
+    low = min(chunk)
+    high = max(chunk)
+    low_index = start + chunk.index(low)
+    high_index = start + chunk.index(high)
+    points.extend(sorted([(low_index, low), (high_index, high)]))
+  return points
+
+
+def _PlotSeries(parent, series):
+  """Add an SVG plot of several series to an ElementTree element.
+
+  Args:
+    parent: The element to add the plot to.
+    series: A list of (name, values) pairs.
+  """
+  decimated = [(name, _DecimateMinMax(values, _PLOT_WIDTH // 2), len(values))
+               for name, values in series
+               if values]
+  if not decimated:
+    return
+  low = min(v for _, points, _ in decimated for _, v in points)
+  high = max(v for _, points, _ in decimated for _, v in points)
+  span = (high - low) or 1.0
+  svg = ET.SubElement(
+      parent,
+      'svg',
+      width=str(_PLOT_WIDTH),
+      height=str(_PLOT_HEIGHT),
+      viewBox='0 0 {} {}'.format(_PLOT_WIDTH, _PLOT_HEIGHT))
+  for color, (name, points, count) in zip(
+      itertools.cycle(_PLOT_COLORS), decimated):
+    polyline = ET.SubElement(
+        svg,
+        'polyline',
+        fill='none',
+        stroke=color,
+        points=' '.join('{:.1f},{:.1f}'.format(
+            index * (_PLOT_WIDTH - 1) / max(1, count - 1),
+            (_PLOT_HEIGHT - 1) * (1 - (value - low) / span))
+                        for index, value in points))
+    ET.SubElement(polyline, 'title').text = name
+  legend = ET.SubElement(parent, 'p')
+  for color, (name, _, _) in zip(itertools.cycle(_PLOT_COLORS), decimated):
+    ET.SubElement(legend, 'span', style='color: %s' % color).text = (
+        '\u25a0 %s ' % name)
+  ET.SubElement(legend, 'span').text = '(range {:.2f} to {:.2f})'.format(
+      low, high)
+
+
+def WriteComparisonsHtml(comparisons, names, output):
+  """Write comparisons as a self-contained HTML report with per-frame plots."""
+  html = ET.Element('html')
+  head = ET.SubElement(html, 'head')
+  ET.SubElement(head, 'meta', charset='utf-8')
+  ET.SubElement(head, 'title').text = 'Benchmark comparison'
+  ET.SubElement(head, 'style').text = (
+      'table { border-collapse: collapse; } '
+      'td, th { padding: 2px 8px; text-align: right; } '
+      'tbody tr:nth-child(odd) { background-color: #eee; } '
+      '.regressed { color: #c00; font-weight: bold; }')
+  body = ET.SubElement(html, 'body')
+  ET.SubElement(body, 'p').text = 'Baseline: %s' % names[0]
+
+  statistics = ['min', 'avg', 'median', 'max']
+  for comparison in comparisons:
+    ET.SubElement(body, 'h2').text = comparison.test_name
+    for name, data in zip(names, comparison.results):
+      if data is None:
+        continue
+      for metric_name, kept in data.steady_state.items():
+        of = ' of ' + metric_name if metric_name else ''
+        ET.SubElement(body, 'p').text = (
+            '[{}] Steady state{}: {}..{} ({} of {} kept)'.format(
+                name, of, *kept))
+    if not comparison.aggregated:
+      ET.SubElement(body, 'p').text = 'No data'
+      continue
+
+    for metric_name in comparison.metric_names:
+      base_metric = comparison.aggregated[0].get(metric_name)
+      if base_metric is None:
+        continue
+      ET.SubElement(body, 'h3').text = metric_name
+      table = ET.SubElement(body, 'table')
+      header = ET.SubElement(ET.SubElement(table, 'thead'), 'tr')
+      for title in ['Results'] + statistics + ['p-value']:
+        ET.SubElement(header, 'th').text = title
+      tbody = ET.SubElement(table, 'tbody')
+      for i, name in enumerate(names):
+        tr = ET.SubElement(tbody, 'tr')
+        ET.SubElement(tr, 'td').text = name
+        metric = comparison.aggregated[i].get(metric_name)
+        if metric is None:
+          ET.SubElement(tr, 'td', colspan=str(len(statistics) + 1)).text = (
+              'No data')
+          continue
+        for statistic in statistics:
+          value = getattr(metric, statistic)
+          text = '{:.2f}'.format(value)
+          if i > 0:
+            text += ' ({:+.2f}%)'.format(
+                GetPercentageDiff(getattr(base_metric, statistic), value))
+          ET.SubElement(tr, 'td').text = text
+        gate_result = comparison.gate_results.get((metric_name, i))
+        td = ET.SubElement(tr, 'td')
+        if gate_result:
+          td.text = '{:.3g}'.format(gate_result[0])
+          if gate_result[1]:
+            td.set('class', 'regressed')
+            td.text += ' REGRESSION'
+
+      if metric_name in comparison.results[0].metrics:
+        _PlotSeries(body, [(name, data.metrics.get(metric_name))
+                           for name, data in zip(names, comparison.results)
+                           if data is not None])
+
+  output.write('<!DOCTYPE html>\n')
+  output.write(ET.tostring(html, encoding='unicode', method='html'))
+  output.write('\n')
+
+
+def CompareTestResults(results,
+                       names,
+                       num_frames_to_ignore,
+                       jobs=None,
+                       use_cache=True,
+                       gate=None,
+                       frame_budgets_ms=None,
+                       steady_state=None,
+                       output_format='text',
+                       output=None):
+  """Compare a set of benchmark results, using the first as the baseline.
+
+  Args:
+    results: A list of dictionaries, one per results directory, mapping test
+      case names to result filenames. The first is the baseline.
+    names: The names of the results directories.
+    num_frames_to_ignore: The number N of frames to ignore in each file.
+    jobs: The maximum number of processes reading results files.
+    use_cache: Whether to read and update each directory's ResultsCache.
+    gate: If set, the RegressionGate evaluated for every comparison.
+    frame_budgets_ms: If set, also compare tail latency and frame pacing,
+      counting the frames over each of these budgets in milliseconds.
+    steady_state: If set, the SteadyStateDetector used to trim each file.
+    output_format: One of 'text', 'json', 'csv' or 'html'.
+    output: The file to write the comparison to. Default is stdout.
+
+  Returns:
+    1 if `gate` is set and any metric regressed against the baseline, 0
+    otherwise.
+  """
+  loaded = LoadTestResults(results, num_frames_to_ignore, jobs, use_cache,
+                           steady_state)
+  comparisons = BuildComparisons(results[0], loaded, gate, frame_budgets_ms)
+
+  output = output or sys.stdout
+  if output_format == 'json':
+    WriteComparisonsJson(comparisons, names, output)
+  elif output_format == 'csv':
+    WriteComparisonsCsv(comparisons, names, output)
+  elif output_format == 'html':
+    WriteComparisonsHtml(comparisons, names, output)
+  else:
+    with contextlib.redirect_stdout(output):
+      PrintComparisons(comparisons, names, frame_budgets_ms)
+
+  regressions = [(comparison.test_name, metric_name, names[i])
+                 for comparison in comparisons
+                 for (metric_name, i), (_, regressed) in
+                 comparison.gate_results.items()
+                 if regressed]
+  for test_name, metric_name, other_name in regressions:
+    logging.error('Regression in %s: %s of %s vs %s', test_name, metric_name,
+                  other_name, names[0])
+  return 1 if regressions else 0
 
 
 def ProcessArgs():
@@ -207,11 +1681,80 @@ def ProcessArgs():
       description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
   parser.add_argument(
       'results_dirs',
-      nargs='+',
+      nargs='*',
       default=[],
       help='A list of directories where the benchmark results are stored. '
       'The first benchmark results will be compared to each of the others',
   )
+  parser.add_argument(
+      '--history_db',
+      help='Path to a SQLite database of benchmark history, used by '
+      '--history_ingest and --history_query. Created if missing.',
+  )
+  parser.add_argument(
+      '--history_ingest',
+      action='store_true',
+      help='Instead of comparing, add the aggregated results of each results '
+      'directory to --history_db as a run of --commit_sha.',
+  )
+  parser.add_argument(
+      '--commit_sha',
+      help='With --history_ingest, the commit the benchmarks were built from.',
+  )
+  parser.add_argument(
+      '--host',
+      default=socket.getfqdn(),
+      help='With --history_ingest, the host the benchmarks ran on. Default is '
+      'this host.',
+  )
+  parser.add_argument(
+      '--benchmark_flags',
+      default='',
+      help='With --history_ingest, the flags the benchmarks ran with.',
+  )
+  parser.add_argument(
+      '--history_query',
+      metavar='TEST_CASE',
+      help='Instead of comparing, print a statistic of a test case over the '
+      'latest runs in --history_db. No results directories are needed.',
+  )
+  parser.add_argument(
+      '--history_metric',
+      default=_CSV_BENCHMARK_METRICS[0],
+      help='With --history_query, the metric to print.',
+  )
+  parser.add_argument(
+      '--history_statistic',
+      default='median',
+      help='With --history_query, the statistic to print, e.g. avg, median, '
+      'p95, low_1_percent_fps or frames_over_16.6_ms.',
+  )
+  parser.add_argument(
+      '--history_limit',
+      type=int,
+      default=200,
+      help='With --history_query, the number of latest runs to print.',
+  )
+  parser.add_argument(
+      '--follow',
+      metavar='CSV_FILE',
+      help='Watch a CSV file while a benchmark is still writing it, and '
+      'periodically compare it against the results of the same test case in '
+      'the first results directory. Memory use stays constant however long '
+      'the file grows, and percentiles of the followed file are approximate, '
+      'within 0.5%%. Runs until interrupted.',
+  )
+  parser.add_argument(
+      '--follow_test_case',
+      help='With --follow, the test case to compare against. Default is the '
+      'name of the followed file without its extension.',
+  )
+  parser.add_argument(
+      '--follow_interval_s',
+      type=float,
+      default=5.0,
+      help='With --follow, the number of seconds between comparisons.',
+  )
   parser.add_argument(
       '--ignore_first_N_frames',
       type=int,
@@ -220,6 +1763,94 @@ def ProcessArgs():
       'reading test results. If set to zero, all frames will be processed. '
       'Default is set to 1 as the first frame usually contains setup times.',
   )
+  parser.add_argument(
+      '--trim_steady_state',
+      action='store_true',
+      help='Detect where each results file reaches a steady state, and leave '
+      'out the warm-up datapoints before it and any throttled datapoints '
+      'after it. Applied after --ignore_first_N_frames.',
+  )
+  parser.add_argument(
+      '--steady_state_window',
+      type=int,
+      default=SteadyStateDetector.window,
+      help='With --trim_steady_state, the number of frames in the rolling '
+      'window used to detect the steady state.',
+  )
+  parser.add_argument(
+      '--steady_state_tolerance_percent',
+      type=float,
+      default=SteadyStateDetector.tolerance_percent,
+      help='With --trim_steady_state, how far, in percent, the mean of a '
+      'window may be from the steady level for the window to be steady.',
+  )
+  parser.add_argument(
+      '-j',
+      '--jobs',
+      type=int,
+      default=None,
+      help='The number of processes used to read results files in parallel. '
+      'Default is one per CPU.',
+  )
+  parser.add_argument(
+      '--no_cache',
+      action='store_true',
+      help='Parse every results file from text, without reading or updating '
+      'the parsed results cached in %s inside each results directory.' %
+      _RESULTS_CACHE_DIR_NAME,
+  )
+  parser.add_argument(
+      '--output_format',
+      choices=('text', 'json', 'csv', 'html'),
+      default='text',
+      help='How to write the comparison: human-readable text, a JSON '
+      'document of all aggregates and deltas, a flat CSV table, or a '
+      'self-contained HTML report with per-frame plots.',
+  )
+  parser.add_argument(
+      '--output',
+      help='The file to write the comparison to. Default is stdout.',
+  )
+  parser.add_argument(
+      '--tail_latency',
+      action='store_true',
+      help='Also compare percentiles, variance, 1%% and 0.1%% low FPS, and '
+      'the frames over each --frame_budget_ms.',
+  )
+  parser.add_argument(
+      '--frame_budget_ms',
+      type=float,
+      action='append',
+      help='With --tail_latency or --history_ingest, a frame time budget to '
+      'count the frames over, along with the longest streak of consecutive '
+      'frames over it. May be repeated. Default is %s.' %
+      _DEFAULT_FRAME_BUDGET_MS,
+  )
+  parser.add_argument(
+      '--gate',
+      action='store_true',
+      help='Test every comparison for a statistically significant regression '
+      'and exit with a non-zero status if any is found.',
+  )
+  parser.add_argument(
+      '--gate_alpha',
+      type=float,
+      default=RegressionGate.alpha,
+      help='With --gate, the significance level of the Mann-Whitney U test.',
+  )
+  parser.add_argument(
+      '--gate_threshold_percent',
+      type=float,
+      default=RegressionGate.threshold_percent,
+      help='With --gate, the minimum increase of the median, in percent, for '
+      'a significant difference to count as a regression.',
+  )
+  parser.add_argument(
+      '--clear_cache',
+      action='store_true',
+      help='Delete the cached parsed results of every results directory '
+      'before comparing.',
+  )
 
   args = parser.parse_args()
   return args
@@ -231,7 +1862,25 @@ def main():
 
   args = ProcessArgs()
 
-  if len(args.results_dirs) < 2:
+  if (args.history_ingest or args.history_query) and not args.history_db:
+    logging.error('--history_db is required to ingest or query history')
+    return -1
+  if args.history_query:
+    history = HistoryStore(args.history_db)
+    try:
+      return PrintHistory(history, args.history_query, args.history_metric,
+                          args.history_statistic, args.history_limit)
+    finally:
+      history.Close()
+  if args.history_ingest and not args.commit_sha:
+    logging.error('--commit_sha is required to ingest history')
+    return -1
+
+  if not args.results_dirs:
+    logging.error('No benchmark result directories specified')
+    return -1
+  if (len(args.results_dirs) < 2 and not args.follow and
+      not args.history_ingest):
     logging.error('Not enough benchmark result directories specified, at least '
                   'two required to perform comparisons')
     return -1
@@ -242,9 +1891,58 @@ def main():
       logging.error('Path %s is not a valid directory', d)
       return -1
 
+  if args.clear_cache:
+    for d in dirs:
+      ResultsCache.Clear(d)
+
   results = [CollectBenchmarkTestResults(d) for d in dirs]
   names = [os.path.basename(d) for d in dirs]
-  return CompareTestResults(results, names, args.ignore_first_N_frames)
+  gate = None
+  if args.gate:
+    gate = RegressionGate(args.gate_alpha, args.gate_threshold_percent)
+  all_frame_budgets_ms = args.frame_budget_ms or [_DEFAULT_FRAME_BUDGET_MS]
+  frame_budgets_ms = None
+  if args.tail_latency:
+    frame_budgets_ms = all_frame_budgets_ms
+  steady_state = None
+  if args.trim_steady_state:
+    steady_state = SteadyStateDetector(args.steady_state_window,
+                                       args.steady_state_tolerance_percent)
+
+  if args.history_ingest:
+    history = HistoryStore(args.history_db)
+    try:
+      return IngestTestResults(history, results, names,
+                               args.ignore_first_N_frames, args.commit_sha,
+                               args.host, args.benchmark_flags, args.jobs,
+                               not args.no_cache, all_frame_budgets_ms,
+                               steady_state)
+    finally:
+      history.Close()
+
+  if args.follow:
+    test_name = args.follow_test_case or os.path.splitext(
+        os.path.basename(args.follow))[0]
+    if test_name not in results[0] or not results[0][test_name].endswith(
+        '.csv'):
+      logging.error('No CSV results for test case %s in %s', test_name,
+                    dirs[0])
+      return -1
+    return FollowTestResults(args.follow, results[0][test_name], names[0],
+                             args.ignore_first_N_frames,
+                             args.follow_interval_s, not args.no_cache,
+                             frame_budgets_ms)
+  output = None
+  if args.output:
+    output = open(args.output, 'w', newline='')
+  try:
+    return CompareTestResults(results, names, args.ignore_first_N_frames,
+                              args.jobs, not args.no_cache, gate,
+                              frame_budgets_ms, steady_state,
+                              args.output_format, output)
+  finally:
+    if output:
+      output.close()
 
 
 if __name__ == '__main__':
@@ -1,17 +1,98 @@
 """Renders all glTF-Sample-Assets using gltf_scene_viewer and produces a report."""
 
 import argparse
+import concurrent.futures
 import json
+import math
+import mmap
 import os
 import pathlib
+import re
 import shutil
-import subprocess
+import struct
 import xml.etree.ElementTree as ET
+import zlib
+
+# Binary PPM header: magic, width, height and maxval separated by whitespace
+# or comments, then a single whitespace character before the samples.
+_PPM_SEPARATOR = rb'(?:\s|#[^\n]*\n)+'
+_PPM_HEADER = re.compile(rb'P6' + _PPM_SEPARATOR + rb'(\d+)' + _PPM_SEPARATOR +
+                         rb'(\d+)' + _PPM_SEPARATOR + rb'(\d+)\s')
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+  """Returns a PNG chunk with its length and CRC."""
+  return (struct.pack('>I', len(data)) + chunk_type + data +
+          struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+
+def _convert_screenshot(ppm_path: pathlib.Path,
+                        png_path: pathlib.Path,
+                        max_width: int | None = None):
+  """Converts a binary PPM screenshot to PNG to support more browsers.
+
+  The PPM is mapped rather than read, and its rows are compressed straight
+  into the PNG without filtering, so that large screenshots convert at about
+  the speed of zlib. Screenshots wider than `max_width` are downscaled by an
+  integer factor, keeping every Nth pixel of every Nth row.
+
+  Arguments:
+    ppm_path: Screenshot written by BigWheels.
+    png_path: Destination of the PNG.
+    max_width: Maximum width of the PNG in pixels, or None for full size.
+
+  Raises:
+    ValueError: `ppm_path` is empty, truncated or not a binary PPM with 8 or
+      16 bits per sample.
+  """
+  with ppm_path.open('rb') as ppm_file, mmap.mmap(
+      ppm_file.fileno(), 0, access=mmap.ACCESS_READ) as ppm:
+    header = _PPM_HEADER.match(ppm)
+    if not header:
+      raise ValueError(f'{ppm_path} is not a binary PPM')
+    width, height, maxval = (int(value) for value in header.groups())
+    if maxval not in (255, 65535):
+      raise ValueError(f'{ppm_path} has an unsupported maxval of {maxval}')
+    # 16-bit samples are big-endian in both formats.
+    bit_depth = 8 if maxval == 255 else 16
+    pixel_size = 3 * bit_depth // 8
+    stride = width * pixel_size
+    if len(ppm) < header.end() + stride * height:
+      raise ValueError(f'{ppm_path} is truncated')
+
+    step = math.ceil(width / max_width) if max_width else 1
+    png_width = len(range(0, width, step))
+    png_height = len(range(0, height, step))
+
+    compressor = zlib.compressobj()
+    idat = []
+    for y in range(0, height, step):
+      row_start = header.end() + y * stride
+      row = ppm[row_start:row_start + stride]
+      if step > 1:
+        scaled = bytearray(png_width * pixel_size)
+        for offset in range(pixel_size):
+          scaled[offset::pixel_size] = row[offset::pixel_size * step]
+        row = scaled
+      # Each row starts with its filter type, 0 (None).
+      idat.append(compressor.compress(b'\0' + row))
+    idat.append(compressor.flush())
+
+  png_path.write_bytes(
+      _PNG_SIGNATURE +
+      _png_chunk(b'IHDR', struct.pack('>IIBBBBB', png_width, png_height,
+                                      bit_depth, 2, 0, 0, 0)) +
+      _png_chunk(b'IDAT', b''.join(idat)) +
+      _png_chunk(b'IEND', b''))
 
 
 def _make_report(input_path: pathlib.Path,
                  model_index_path: pathlib.Path,
-                 output_path: pathlib.Path):
+                 output_path: pathlib.Path,
+                 executor: concurrent.futures.Executor,
+                 thumbnail_width: int | None = None):
   """Generates an HTML website with a table of test results.
 
   This does several things:
@@ -23,6 +104,9 @@ def _make_report(input_path: pathlib.Path,
     input_path: Location of test results.
     model_index_path: Path to glTF-Sample-Assets model-index.json.
     output_path: Destination of the HTML report and associated artifacts.
+    executor: Runs the conversions of screenshots to PNG.
+    thumbnail_width: Downscale BigWheels screenshots to at most this many
+      pixels wide, or None to keep them at full size.
   """
 
   model_index_dir = model_index_path.absolute().parent
@@ -57,6 +141,8 @@ def _make_report(input_path: pathlib.Path,
   ET.SubElement(thead_tr, 'th').text = 'Logs'
 
   tbody = ET.SubElement(table, 'tbody')
+  # The cell to show each screenshot in, by its conversion to PNG.
+  conversions: dict[concurrent.futures.Future, ET.Element] = {}
   for model in model_index:
     label = model['label']  # human readable
     name = model['name']  # path in glTF-Sample-Assets repo
@@ -94,14 +180,15 @@ def _make_report(input_path: pathlib.Path,
       # BigWheels Screenshot
       # (There won't be a screenshot if the scene fails to load)
       if (test_input_path / 'actual.ppm').exists():
-        # Convert PPM -> PNG to support more browsers.
-        # Use an external program since Python lacks an image standard lib.
-        subprocess.run(['convert',
-                        str(test_input_path / 'actual.ppm'),
-                        str(test_output_path / 'actual.png')], check=True)
-        ET.SubElement(
-            ET.SubElement(tr, 'td'),
-            'img', src=f'{test_name}/actual.png', width='640px')
+        actual_td = ET.SubElement(tr, 'td')
+        ET.SubElement(actual_td, 'img', src=f'{test_name}/actual.png',
+                      width='640px')
+        conversions[executor.submit(
+            _convert_screenshot, test_input_path / 'actual.ppm',
+            test_output_path / 'actual.png', thumbnail_width)] = actual_td
+      elif (test_input_path / 'status.txt').exists() and (
+          (test_input_path / 'status.txt').read_text() == 'timed_out'):
+        ET.SubElement(tr, 'td').text = 'Timed out!'
       else:
         ET.SubElement(tr, 'td').text = 'None!'
 
@@ -122,6 +209,14 @@ def _make_report(input_path: pathlib.Path,
           ET.SubElement(logs_td, 'p'),
           'a', href=f'{test_name}/ppx.log').text = 'ppx.log'
 
+  # A test that crashed while saving its screenshot may leave a partial one.
+  for future, actual_td in conversions.items():
+    try:
+      future.result()
+    except ValueError:
+      actual_td.clear()
+      actual_td.text = 'Invalid screenshot!'
+
   ET.ElementTree(element=html).write(output_path / 'index.html', method='html')
 
 
@@ -135,10 +230,21 @@ def main():
                       help='Path to glTF-Sample-Asssets model-index.json.')
   parser.add_argument('--output', type=pathlib.Path, required=True,
                       help='Directory to store the generated report.')
+  parser.add_argument('-j', '--jobs', type=int, default=None,
+                      help='How many screenshots to convert in parallel. '
+                      'Default is the number of CPUs.')
+  parser.add_argument('--thumbnail-width', type=int, default=None,
+                      help='Downscale BigWheels screenshots to at most this '
+                      'many pixels wide, making the report smaller to share. '
+                      'Default is to keep them at full size.')
   args = parser.parse_args()
+  if args.thumbnail_width is not None and args.thumbnail_width < 1:
+    parser.error('--thumbnail-width must be at least 1')
 
   os.mkdir(args.output)
-  _make_report(args.input, args.model_index, args.output)
+  with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+    _make_report(args.input, args.model_index, args.output, executor,
+                 args.thumbnail_width)
 
 
 if __name__ == '__main__':
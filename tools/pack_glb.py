@@ -13,23 +13,593 @@
 # limitations under the License.
 
 import argparse
+import base64
+import binascii
+import collections
+import concurrent.futures
+import contextlib
+import errno
+import glob
+import hashlib
+import io
+import itertools
 import json
 import logging
+import math
+import mimetypes
 import os
 from pathlib import Path
+import re
+import shlex
+import struct
+import subprocess
 import sys
-from typing import BinaryIO, TypedDict
-from urllib.parse import urlparse
+import tempfile
+from typing import (
+    Any,
+    BinaryIO,
+    Iterator,
+    MutableMapping,
+    NamedTuple,
+    Sequence,
+    TypedDict,
+)
+from urllib.parse import unquote_to_bytes, urlparse
+
+# Size of each read and write when copying files without kernel-side copies
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# errno values meaning a kernel-side copy isn't supported for a pair of files
+_UNSUPPORTED_COPY_ERRNOS = frozenset(
+    getattr(errno, name)
+    for name in ("EXDEV", "ENOSYS", "EINVAL", "EOPNOTSUPP", "ENOTSOCK")
+    if hasattr(errno, name)
+)
+
+# Name and format version of the dependency manifest written by batch packing
+MANIFEST_NAME = ".pack_glb_manifest.json"
+MANIFEST_VERSION = 2
+
+# Byte size of each accessor componentType, which views must be aligned to
+COMPONENT_TYPE_SIZES = {5120: 1, 5121: 1, 5122: 2, 5123: 2, 5125: 4, 5126: 4}
+
+# bufferView target for vertex attributes, whose strides must be 4-byte aligned
+ARRAY_BUFFER = 34962
+
+# bufferView target for indices
+ELEMENT_ARRAY_BUFFER = 34963
+
+# struct format character of each accessor componentType
+COMPONENT_TYPE_FORMATS = {
+    5120: "b",
+    5121: "B",
+    5122: "h",
+    5123: "H",
+    5125: "I",
+    5126: "f",
+}
+
+# Number of components of each accessor type, and the number of matrix columns
+TYPE_COMPONENTS = {
+    "SCALAR": (1, 1),
+    "VEC2": (2, 1),
+    "VEC3": (3, 1),
+    "VEC4": (4, 1),
+    "MAT2": (4, 2),
+    "MAT3": (9, 3),
+    "MAT4": (16, 4),
+}
+
+
+class TextureFormat(NamedTuple):
+    """A GPU-ready image container which textures can be converted to."""
+
+    # Texture extension whose "source" refers to images in this format
+    extension: str
+    mime_type: str
+    suffix: str
+    # Default converter command, where {input} and {output} are file paths
+    converter: str
+
+
+TEXTURE_FORMATS = {
+    "dds": TextureFormat(
+        "MSFT_texture_dds",
+        "image/vnd-ms.dds",
+        ".dds",
+        "compressonatorcli -fd BC7 -miplevels 16 {input} {output}",
+    ),
+    "ktx2": TextureFormat(
+        "KHR_texture_basisu",
+        "image/ktx2",
+        ".ktx2",
+        "toktx --t2 --genmipmap --encode uastc {output} {input}",
+    ),
+}
+
+# Suffixes of the images which can be converted, by MIME type
+CONVERTIBLE_IMAGE_SUFFIXES = {"image/png": ".png", "image/jpeg": ".jpg"}
+
+# Number of entries in the post-transform vertex cache that triangles are
+# reordered for. Small enough to suit mobile GPUs, whose caches are smallest.
+VERTEX_CACHE_SIZE = 16
+
+# Deepest nesting of arrays and objects that LazyJSONObject can skip over without
+# parsing. Descriptions nested deeper than this are parsed in full.
+LAZY_JSON_MAX_DEPTH = 32
+
+_JSON_WHITESPACE = re.compile(rb"[ \t\n\r]*")
+_JSON_STRING = rb'"(?:[^"\\]++|\\.)*+"'
+_JSON_KEY = re.compile(_JSON_STRING)
+_JSON_SCALAR = re.compile(_JSON_STRING + rb"|[^\s,\]}]++")
+
+
+def _json_container_pattern(depth: int) -> re.Pattern:
+    """Return a pattern matching a JSON array or object nested up to `depth`
+    levels deep, by balancing brackets outside of strings.
+
+    Possessive quantifiers keep the regex engine from saving backtracking state,
+    so skipping over even huge arrays runs in constant memory.
+    """
+    pattern = rb"(?!)"
+    for _ in range(depth):
+        pattern = (
+            rb'[\[{](?:[^"\[\]{}]++|' + _JSON_STRING + rb"|" + pattern + rb")*+[\]}]"
+        )
+    return re.compile(pattern)
+
+
+_JSON_CONTAINER = _json_container_pattern(LAZY_JSON_MAX_DEPTH)
 
 
 def align_to_4(value: int) -> int:
     return (value + 3) & ~3
 
 
+def align_to(value: int, alignment: int) -> int:
+    return (value + alignment - 1) // alignment * alignment
+
+
+def element_size(accessor: dict) -> int:
+    """Return the size in bytes of one element of an accessor.
+
+    Matrix columns of 1 and 2-byte components are padded to 4 bytes.
+    """
+    components, columns = TYPE_COMPONENTS[accessor["type"]]
+    component_size = COMPONENT_TYPE_SIZES[accessor["componentType"]]
+    column_size = components // columns * component_size
+    if columns > 1:
+        column_size = align_to_4(column_size)
+    return column_size * columns
+
+
 class GLTFError(Exception):
     """General exception class for GLTF and GLB errors"""
 
 
+def _kernel_copy_functions():
+    """Returns the available kernel-side copies, taking (in_fd, out_fd, count)."""
+    functions = []
+    if hasattr(os, "copy_file_range"):
+        functions.append(os.copy_file_range)
+    if hasattr(os, "sendfile"):
+        functions.append(
+            lambda in_fd, out_fd, count: os.sendfile(out_fd, in_fd, None, count)
+        )
+    return functions
+
+
+def copy_file_data(source: BinaryIO, dest: BinaryIO, length: int) -> None:
+    """Copy `length` bytes from the current position of `source` to `dest`.
+
+    Where the platform and both files allow it, the data is copied by the kernel
+    (copy_file_range, then sendfile) without ever entering Python. Otherwise it
+    is copied in chunks of COPY_CHUNK_SIZE bytes, so memory use doesn't depend
+    on the size of the file either way.
+    """
+    remaining = length
+    try:
+        in_fd = source.fileno()
+        out_fd = dest.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        in_fd = out_fd = None
+
+    if in_fd is not None and out_fd is not None and dest.seekable():
+        # Kernel-side copies use the file descriptor offsets, so anything
+        # buffered in `dest` must be written first, and positions resynchronized.
+        dest.flush()
+        for copy in _kernel_copy_functions():
+            try:
+                while remaining > 0:
+                    copied = copy(in_fd, out_fd, remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                break
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_COPY_ERRNOS:
+                    raise
+        dest.seek(os.lseek(out_fd, 0, os.SEEK_CUR))
+        if remaining > 0:
+            source.seek(os.lseek(in_fd, 0, os.SEEK_CUR))
+
+    while remaining > 0:
+        chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        dest.write(chunk)
+        remaining -= len(chunk)
+
+    if remaining > 0:
+        raise GLTFError(
+            f"Unexpected end of file: {length - remaining} of {length} bytes copied"
+        )
+
+
+class _RawJSON(NamedTuple):
+    """The location of an unparsed JSON value."""
+
+    start: int
+    end: int
+
+
+class LazyJSONObject(MutableMapping[str, Any]):
+    """A JSON object whose members are only parsed when they are first accessed.
+
+    The packer only rewrites a few members of a description, so for scenes with
+    large node and accessor arrays, locating each member by its brackets, without
+    building any Python objects, is much cheaper than parsing everything. Members
+    which are never accessed are written back by `encode` byte for byte.
+
+    Untouched members are passed through without being validated; if the
+    document can't be split into members it is parsed in full instead, which
+    reports any syntax error.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self._data = data
+        self._members: dict[str, Any] = {}
+        if not self._scan():
+            members = json.loads(data)
+            if not isinstance(members, dict):
+                raise GLTFError("The GLTF description is not a JSON object")
+            self._members = members
+
+    def _scan(self) -> bool:
+        """Record where each member's value is, and return whether the document
+        could be split into members."""
+        data = self._data
+
+        def skip_whitespace(pos: int) -> int:
+            return _JSON_WHITESPACE.match(data, pos).end()  # type: ignore
+
+        pos = skip_whitespace(3 if data.startswith(b"\xef\xbb\xbf") else 0)
+        if data[pos : pos + 1] != b"{":
+            return False
+        pos = skip_whitespace(pos + 1)
+        if data[pos : pos + 1] == b"}":
+            return not data[skip_whitespace(pos + 1) :]
+
+        while True:
+            key = _JSON_KEY.match(data, pos)
+            if key is None:
+                return False
+            pos = skip_whitespace(key.end())
+            if data[pos : pos + 1] != b":":
+                return False
+            pos = skip_whitespace(pos + 1)
+            value = _JSON_CONTAINER.match(data, pos) or _JSON_SCALAR.match(data, pos)
+            if value is None:
+                return False
+            self._members[json.loads(key.group())] = _RawJSON(pos, value.end())
+            pos = skip_whitespace(value.end())
+            if data[pos : pos + 1] == b"}":
+                return not data[skip_whitespace(pos + 1) :]
+            if data[pos : pos + 1] != b",":
+                return False
+            pos = skip_whitespace(pos + 1)
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._members[key]
+        if isinstance(value, _RawJSON):
+            value = json.loads(self._data[value.start : value.end])
+            self._members[key] = value
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._members[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self._members[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._members
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._members)
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def values_containing(self, text: bytes) -> list[Any]:
+        """Return the values of the members whose source contains `text`, and of
+        those already parsed, leaving the others unparsed."""
+        return [
+            self[key]
+            for key, value in self._members.items()
+            if not isinstance(value, _RawJSON)
+            or self._data.find(text, value.start, value.end) != -1
+        ]
+
+    def encode(self) -> bytes:
+        """Return the object as UTF-8 JSON, with the source of unparsed members
+        copied as is and the others serialized compactly."""
+        data = memoryview(self._data)
+        parts: list[bytes | memoryview] = []
+        for key, value in self._members.items():
+            parts.append(b"," if parts else b"{")
+            parts.append(json.dumps(key).encode("utf-8") + b":")
+            if isinstance(value, _RawJSON):
+                parts.append(data[value.start : value.end])
+            else:
+                parts.append(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+        parts.append(b"}" if parts else b"{}")
+        return b"".join(parts)
+
+
+def buffer_view_references(description: dict) -> list[dict]:
+    """Return every object of the description with a "bufferView" index.
+
+    This includes objects inside extensions, such as KHR_draco_mesh_compression.
+    """
+    references: list[dict] = []
+    pending: list = [description]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, LazyJSONObject):
+            pending.extend(node.values_containing(b'"bufferView"'))
+        elif isinstance(node, dict):
+            if isinstance(node.get("bufferView"), int):
+                references.append(node)
+            pending.extend(node.values())
+        elif isinstance(node, list):
+            pending.extend(node)
+    return references
+
+
+class DataURI:
+    """The contents of a `data:` URI, decoded a chunk at a time as they are read.
+
+    Only the URI string itself is kept in memory; no decoded copy of the whole
+    contents is ever made for base64 URIs.
+    """
+
+    def __init__(self, uri: str) -> None:
+        self.uri = uri
+        # Data starts after the first comma; the header is small, so find it
+        # without slicing or parsing the whole string
+        self.start = uri.find(",", 0, 1024) + 1
+        if self.start == 0:
+            raise GLTFError("Malformed data uri")
+        header = uri[len("data:") : self.start - 1].split(";")
+        self.mime_type = header[0]
+        self.is_base64 = header[-1] == "base64"
+
+        if self.is_base64:
+            data_length = len(uri) - self.start
+            if data_length % 4 != 0:
+                raise GLTFError("Malformed data uri: truncated base64 data")
+            padding = 2 if uri.endswith("==") else 1 if uri.endswith("=") else 0
+            self.length = data_length // 4 * 3 - padding
+        else:
+            self.length = len(unquote_to_bytes(uri[self.start :]))
+
+    def chunks(self, offset: int, length: int) -> Iterator[bytes]:
+        """Yield `length` decoded bytes starting at `offset`, in chunks."""
+        if offset + length > self.length:
+            raise GLTFError(
+                f"Unexpected end of data uri: {self.length} bytes, "
+                f"{offset + length} needed"
+            )
+        if not self.is_base64:
+            yield unquote_to_bytes(self.uri[self.start :])[offset : offset + length]
+            return
+
+        # Every 4 base64 characters decode to 3 bytes
+        position = self.start + offset // 3 * 4
+        skip = offset % 3
+        step = COPY_CHUNK_SIZE // 3 * 4
+        remaining = length
+        while remaining > 0:
+            try:
+                chunk = base64.b64decode(
+                    self.uri[position : position + step], validate=True
+                )
+            except binascii.Error as e:
+                raise GLTFError(f"Malformed data uri: {e}") from e
+            chunk = chunk[skip : skip + remaining]
+            skip = 0
+            remaining -= len(chunk)
+            position += step
+            yield chunk
+
+
+def parse_uri(uri: str) -> Path | DataURI:
+    """Return the local file path or the data a buffer or image uri refers to."""
+    if uri.startswith("data:"):
+        return DataURI(uri)
+    parsed = urlparse(uri)
+    if parsed.scheme != "" or parsed.netloc != "":
+        raise GLTFError(f'support for uri not implemented: "{parsed}"')
+    return Path(parsed.path)
+
+
+def reorder_triangles(
+    indices: Sequence[int], vertex_count: int, cache_size: int = VERTEX_CACHE_SIZE
+) -> list[int]:
+    """Reorder the triangles of a triangle list for vertex cache locality.
+
+    This is Tipsify, from Sander, Nehab and Barczak, "Fast Triangle Reordering
+    for Vertex Locality and Reduced Overdraw" (2007): triangles are emitted in
+    fans around a vertex, and the next fan is centered on a vertex which is
+    still in the cache, in time linear in the number of triangles. The vertices
+    of each triangle keep their order, so winding is unchanged.
+    """
+    live = [0] * vertex_count
+    for index in indices:
+        live[index] += 1
+    # Triangles using each vertex, as a flattened adjacency list
+    starts = list(itertools.accumulate(live, initial=0))
+    ends = starts[:-1]
+    adjacency = [0] * len(indices)
+    for position, index in enumerate(indices):
+        adjacency[ends[index]] = position // 3
+        ends[index] += 1
+
+    emitted = [False] * (len(indices) // 3)
+    cache_time = [0] * vertex_count
+    dead_ends: list[int] = []
+    time = cache_size + 1
+    cursor = 0
+    output: list[int] = []
+    fan = 0
+    while fan >= 0:
+        candidates = []
+        for triangle in adjacency[starts[fan] : starts[fan + 1]]:
+            if emitted[triangle]:
+                continue
+            for vertex in indices[triangle * 3 : triangle * 3 + 3]:
+                output.append(vertex)
+                dead_ends.append(vertex)
+                candidates.append(vertex)
+                live[vertex] -= 1
+                if time - cache_time[vertex] > cache_size:
+                    cache_time[vertex] = time
+                    time += 1
+            emitted[triangle] = True
+
+        # Prefer the candidate which stays in the cache longest while its
+        # remaining triangles are emitted
+        fan, best = -1, -1
+        for vertex in candidates:
+            if live[vertex] > 0:
+                age = time - cache_time[vertex]
+                priority = age if age + 2 * live[vertex] <= cache_size else 0
+                if priority > best:
+                    fan, best = vertex, priority
+        while fan < 0 and dead_ends:
+            vertex = dead_ends.pop()
+            if live[vertex] > 0:
+                fan = vertex
+        while fan < 0 and cursor < vertex_count:
+            if live[cursor] > 0:
+                fan = cursor
+            cursor += 1
+    return output
+
+
+def compact_vertices(indices: Sequence[int]) -> tuple[list[int], list[int]]:
+    """Renumber vertices in the order the indices first use them.
+
+    Returns the new indices, and the original vertex of each new one. Vertices
+    which aren't used by any index are left out.
+    """
+    new_vertices: dict[int, int] = {}
+    order: list[int] = []
+    new_indices = []
+    for index in indices:
+        vertex = new_vertices.get(index)
+        if vertex is None:
+            vertex = new_vertices[index] = len(order)
+            order.append(index)
+        new_indices.append(vertex)
+    return new_indices, order
+
+
+def quantize_attribute(
+    attribute: str,
+    accessor: dict,
+    elements: list[bytes],
+    transform: tuple[list[float], list[float]] | None,
+) -> tuple[bytes, int] | None:
+    """Quantize float vertex attributes to the integer types KHR_mesh_quantization
+    allows, updating the accessor.
+
+    Positions become unsigned shorts, mapped onto the mesh bounds by `transform`,
+    normals and tangents normalized bytes, and texture coordinates in [0, 1]
+    normalized unsigned shorts. Returns the quantized data and its stride, or
+    None if the attribute is left as floats.
+    """
+    data = b"".join(elements)
+    if attribute == "POSITION" and accessor["type"] == "VEC3" and transform:
+        translation, scale = transform
+        element = struct.Struct("<3Hxx")
+        payload = b"".join(
+            element.pack(
+                *(
+                    min(max(round((value - t) / s), 0), 65535)
+                    for value, t, s in zip(position, translation, scale)
+                )
+            )
+            for position in struct.iter_unpack("<3f", data)
+        )
+        accessor["componentType"] = 5123
+        accessor.pop("normalized", None)
+    elif attribute in ("NORMAL", "TANGENT"):
+        components = 3 if attribute == "NORMAL" else 4
+        if accessor["type"] != f"VEC{components}":
+            return None
+        element = struct.Struct("<3bx" if components == 3 else "<4b")
+        payload = b"".join(
+            element.pack(*(round(min(max(value, -1.0), 1.0) * 127) for value in vector))
+            for vector in struct.iter_unpack(f"<{components}f", data)
+        )
+        accessor["componentType"] = 5120
+        accessor["normalized"] = True
+    elif attribute.startswith("TEXCOORD_") and accessor["type"] == "VEC2":
+        coordinates = struct.unpack(f"<{len(data) // 4}f", data)
+        if not all(0.0 <= value <= 1.0 for value in coordinates):
+            return None
+        payload = struct.pack(
+            f"<{len(coordinates)}H", *(round(value * 65535) for value in coordinates)
+        )
+        accessor["componentType"] = 5123
+        accessor["normalized"] = True
+    else:
+        return None
+    # Every quantized element is padded to 4 bytes except positions, which take 8
+    return payload, 8 if attribute == "POSITION" else 4
+
+
+def default_texture_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "pack_glb" / "textures"
+
+
+def convert_texture(input_path: Path, output_path: Path, command: str) -> None:
+    """Run a texture converter command, and move its output to `output_path`.
+
+    The output is only moved into place once complete, so concurrent packers
+    sharing a cache never see partial files.
+    """
+    with tempfile.TemporaryDirectory(dir=output_path.parent) as temp_dir:
+        temp_path = Path(temp_dir) / output_path.name
+        args = [
+            arg.format(input=input_path, output=temp_path)
+            for arg in shlex.split(command)
+        ]
+        try:
+            result = subprocess.run(args, capture_output=True, text=True)
+        except FileNotFoundError as e:
+            raise GLTFError(f"Texture converter not found: {args[0]}") from e
+        if result.returncode != 0 or not temp_path.exists():
+            raise GLTFError(
+                f"Converting {input_path} failed ({result.returncode}): "
+                f"{result.stderr.strip() or result.stdout.strip()}"
+            )
+        os.replace(temp_path, output_path)
+
+
 class GLTFBufferDescription(TypedDict):
     byteLength: int
     uri: str
@@ -54,18 +624,76 @@ class GLTFDescription(TypedDict):
 
 
 class GLB:
-    """Holds the data necessary to create a GLB file."""
+    """Holds the data necessary to create a GLB file.
+
+    With `optimize`, only the bytes of referenced buffer views and images are
+    packed, identical ones are stored once, and every view is aligned to the
+    size of its accessors' components, or to `alignment` bytes if larger. The
+    BIN chunk itself then starts at a multiple of `alignment` in the file.
+
+    With `optimize_meshes`, the triangles of each mesh are reordered for the
+    vertex cache and unused vertices are removed. With `quantize`, positions,
+    normals, tangents and texture coordinates are also stored as integers using
+    KHR_mesh_quantization. Both imply `optimize`, to drop the replaced data.
 
-    def __init__(self, description: GLTFDescription, source_dir: Path) -> None:
+    With `texture_format`, a key of TEXTURE_FORMATS, every PNG or JPEG texture
+    gets a converted image in that format, added through the format's texture
+    extension so the original remains as a fallback. Conversions run in
+    parallel and are cached in `texture_cache_dir` by the hash of the image and
+    of the converter command.
+
+    The description may be a LazyJSONObject, in which case only the members
+    read by the enabled stages are parsed, and the rest are written unchanged.
+    """
+
+    def __init__(
+        self,
+        description: GLTFDescription | LazyJSONObject,
+        source_dir: Path,
+        optimize: bool = False,
+        alignment: int = 4,
+        optimize_meshes: bool = False,
+        quantize: bool = False,
+        texture_format: str | None = None,
+        texture_converter: str | None = None,
+        texture_cache_dir: str | None = None,
+    ) -> None:
         self.description = description
         self.source_dir = source_dir
+        self.optimize = optimize or optimize_meshes or quantize
+        self.alignment = alignment
+        self.optimize_meshes = optimize_meshes or quantize
+        self.quantize = quantize
         self.bin_length = 0
-        self.source_files: list[Path] = []
+        # Ranges of files, data uris and generated data making up the BIN chunk,
+        # in order, as (source, offset, length). A source of None stands for
+        # `length` bytes of zero padding.
+        self.segments: list[tuple[Path | DataURI | bytes | None, int, int]] = []
+        # Contents of buffers created while packing, by buffer index
+        self.generated_buffers: dict[int, bytes] = {}
+        self.texture_format = texture_format
+        self.texture_converter = texture_converter or (
+            TEXTURE_FORMATS[texture_format].converter if texture_format else None
+        )
+        self.texture_cache_dir = (
+            Path(texture_cache_dir).resolve()
+            if texture_cache_dir
+            else default_texture_cache_dir()
+        )
+        # Files of the images added by texture conversion, by image index
+        self.converted_images: dict[int, Path] = {}
 
     def pack(self) -> None:
         """Rewrite all references to external files as references to a packed buffer."""
-        self._pack_buffers()
-        self._pack_images()
+        if self.texture_format:
+            self._convert_textures()
+        if self.optimize_meshes:
+            self._optimize_meshes()
+        if self.optimize:
+            self._pack_optimized()
+        else:
+            self._pack_buffers()
+            self._pack_images()
         self.description["buffers"] = [{"byteLength": self.bin_length}]  # type: ignore
 
         if self.bin_length > 2**32 - 1:
@@ -80,13 +708,10 @@ class GLB:
         buffer_offsets: dict[int, int] = {}
 
         for index, buffer in enumerate(self.description["buffers"]):
-            if "uri" in buffer:
-                # this doesn't handle data uris; we can add support if necessary
-                uri = urlparse(buffer["uri"])
-                if uri.scheme != "" or uri.netloc != "":
-                    raise GLTFError(f'support for uri not implemented: "{uri}"')
-                # record the path of the locally stored external buffer to be packed
-                self.source_files.append(Path(uri.path))
+            # record the locally stored, embedded or generated buffer to be packed
+            source = self._buffer_source(index)
+            if source is not None:
+                self.segments.append((source, 0, buffer["byteLength"]))
                 buffer_offsets[index] = self.bin_length
             else:
                 if index != 0:
@@ -106,14 +731,11 @@ class GLB:
 
     def _pack_images(self) -> None:
         # Rewrite images to reference buffer views inside the internal buffer
-        for image in self.description["images"]:
-            if "uri" in image:
-                uri = urlparse(image["uri"])
-                if uri.scheme != "" or uri.netloc != "":
-                    raise GLTFError(f'support for uri not implemented: "{uri}"')
-                self.source_files.append(Path(uri.path))
-
-                image_size = os.path.getsize(self.source_dir / uri.path)
+        for index, image in enumerate(self.description["images"]):
+            if "uri" in image or index in self.converted_images:
+                source = self._image_source(index, image)
+                image_size = self._source_size(source)
+                self.segments.append((source, 0, image_size))
 
                 image["bufferView"] = len(self.description["bufferViews"])
                 self.description["bufferViews"].append(
@@ -123,18 +745,530 @@ class GLB:
                         "byteOffset": self.bin_length,
                     }
                 )
-                del image["uri"]  # type: ignore
+                image.pop("uri", None)
 
                 self.bin_length += image_size
 
+    def _buffer_source(self, index: int) -> Path | DataURI | bytes | None:
+        """Return where the contents of a buffer come from, or None for the GLB
+        stored buffer."""
+        if index in self.generated_buffers:
+            return self.generated_buffers[index]
+        buffer = self.description["buffers"][index]
+        if "uri" not in buffer:
+            return None
+        return parse_uri(buffer["uri"])
+
+    def _read_buffer(self, index: int, offset: int, length: int) -> bytes:
+        source = self._buffer_source(index)
+        if source is None:
+            raise GLTFError(f"buffer {index} has no uri")
+        if isinstance(source, bytes):
+            return source[offset : offset + length]
+        if isinstance(source, DataURI):
+            return b"".join(source.chunks(offset, length))
+        with open(self.source_dir / source, "rb") as f:
+            f.seek(offset)
+            data = f.read(length)
+        if len(data) < length:
+            raise GLTFError(
+                f"Unexpected end of file: {len(data)} of {length} bytes read"
+            )
+        return data
+
+    def _read_accessor(self, accessor: dict) -> list[bytes]:
+        """Return the bytes of each element of an accessor."""
+        view = self.description["bufferViews"][accessor["bufferView"]]
+        size = element_size(accessor)
+        stride = view.get("byteStride", size)
+        count = accessor["count"]
+        data = self._read_buffer(
+            view["buffer"],
+            view.get("byteOffset", 0) + accessor.get("byteOffset", 0),
+            stride * (count - 1) + size if count else 0,
+        )
+        return [data[i * stride : i * stride + size] for i in range(count)]
+
+    def _accessor_uses(self) -> collections.Counter:
+        """Count the references to each accessor."""
+        uses: collections.Counter = collections.Counter()
+        for mesh in self.description.get("meshes", []):
+            for primitive in mesh["primitives"]:
+                uses.update(primitive["attributes"].values())
+                if "indices" in primitive:
+                    uses[primitive["indices"]] += 1
+                for target in primitive.get("targets", []):
+                    uses.update(target.values())
+        for node in self.description.get("nodes", []):
+            instancing = node.get("extensions", {}).get("EXT_mesh_gpu_instancing")
+            if instancing is not None:
+                uses.update(instancing["attributes"].values())
+        for skin in self.description.get("skins", []):
+            if "inverseBindMatrices" in skin:
+                uses[skin["inverseBindMatrices"]] += 1
+        for animation in self.description.get("animations", []):
+            for sampler in animation["samplers"]:
+                uses.update((sampler["input"], sampler["output"]))
+        return uses
+
+    def _primitive_skip_reason(
+        self, primitive: dict, uses: collections.Counter
+    ) -> str | None:
+        """Return why a mesh primitive can't be optimized, or None if it can."""
+        if primitive.get("mode", 4) != 4:
+            return "not a triangle list"
+        if "indices" not in primitive:
+            return "not indexed"
+        if "targets" in primitive:
+            return "has morph targets"
+        if "extensions" in primitive:
+            return "uses extensions"
+        if any(
+            name.startswith(("JOINTS_", "WEIGHTS_")) for name in primitive["attributes"]
+        ):
+            return "is skinned"
+        accessors = self.description["accessors"]
+        for index in [primitive["indices"], *primitive["attributes"].values()]:
+            if "bufferView" not in accessors[index] or "sparse" in accessors[index]:
+                return "uses sparse accessors"
+            if uses[index] > 1:
+                return "shares accessors"
+        return None
+
+    def _optimize_meshes(self) -> None:
+        accessors = self.description.get("accessors", [])
+        uses = self._accessor_uses()
+        quantized = False
+        for mesh_index, mesh in enumerate(self.description.get("meshes", [])):
+            name = mesh.get("name", mesh_index)
+            # (primitive, reordered element bytes of each attribute, indices)
+            primitives = []
+            removed_vertices = 0
+            for primitive in mesh["primitives"]:
+                reason = self._primitive_skip_reason(primitive, uses)
+                if reason is not None:
+                    logging.info(
+                        "Not optimizing a primitive of mesh %s: %s", name, reason
+                    )
+                    continue
+                index_accessor = accessors[primitive["indices"]]
+                indices = struct.unpack(
+                    "<%i%s"
+                    % (
+                        index_accessor["count"],
+                        COMPONENT_TYPE_FORMATS[index_accessor["componentType"]],
+                    ),
+                    b"".join(self._read_accessor(index_accessor)),
+                )
+                vertex_count = min(
+                    accessors[index]["count"]
+                    for index in primitive["attributes"].values()
+                )
+                if max(indices, default=0) >= vertex_count:
+                    raise GLTFError(f"Mesh {name} has out of range indices")
+                indices, order = compact_vertices(
+                    reorder_triangles(indices, vertex_count)
+                )
+                removed_vertices += vertex_count - len(order)
+
+                attributes = {}
+                for attribute, index in primitive["attributes"].items():
+                    elements = self._read_accessor(accessors[index])
+                    attributes[attribute] = [elements[vertex] for vertex in order]
+                primitives.append((primitive, attributes, indices))
+            if not primitives:
+                continue
+
+            # Positions can only be quantized if every primitive of the mesh is,
+            # since they share the node transform which dequantizes them
+            transform = None
+            if self.quantize and len(primitives) == len(mesh["primitives"]):
+                transform = self._position_quantization(mesh_index, primitives)
+                if transform is not None:
+                    self._add_dequantization_nodes(mesh_index, *transform)
+
+            before = after = 0
+            for primitive, attributes, indices in primitives:
+                for index in [primitive["indices"], *primitive["attributes"].values()]:
+                    before += accessors[index]["count"] * element_size(accessors[index])
+                length, primitive_quantized = self._write_primitive(
+                    primitive, attributes, indices, transform
+                )
+                after += length
+                quantized |= primitive_quantized
+            logging.info(
+                "Mesh %s: %i bytes of vertices and indices packed into %i, "
+                "%i unused vertices removed",
+                name,
+                before,
+                after,
+                removed_vertices,
+            )
+
+        if quantized:
+            for key in ("extensionsUsed", "extensionsRequired"):
+                extensions = self.description.setdefault(key, [])
+                if "KHR_mesh_quantization" not in extensions:
+                    extensions.append("KHR_mesh_quantization")
+
+    def _position_quantization(
+        self, mesh_index: int, primitives: list
+    ) -> tuple[list[float], list[float]] | None:
+        """Return the translation and scale which map 16-bit positions onto the
+        bounds of a mesh, or None if its positions can't be quantized.
+
+        The scale is the same on every axis, so that the dequantization node
+        doesn't change the direction of normals in renderers which transform
+        them by the model matrix, like ppx's scene renderer."""
+        accessors = self.description["accessors"]
+        for node in self.description.get("nodes", []):
+            if node.get("mesh") == mesh_index and (
+                "extensions" in node or "skin" in node
+            ):
+                return None
+        low = [math.inf] * 3
+        high = [-math.inf] * 3
+        for primitive, attributes, _ in primitives:
+            accessor = accessors[primitive["attributes"].get("POSITION", -1)]
+            if accessor["componentType"] != 5126 or accessor["type"] != "VEC3":
+                return None
+            for position in struct.iter_unpack("<3f", b"".join(attributes["POSITION"])):
+                low = list(map(min, low, position))
+                high = list(map(max, high, position))
+        if math.inf in low:
+            return None
+        extent = max(h - l for l, h in zip(low, high))
+        return low, [extent / 65535 if extent > 0 else 1.0] * 3
+
+    def _add_dequantization_nodes(
+        self, mesh_index: int, translation: list[float], scale: list[float]
+    ) -> None:
+        """Move a mesh from each node using it to a new child node which scales
+        and translates its quantized positions back to their original bounds."""
+        nodes = self.description["nodes"]
+        for node in nodes[:]:
+            if node.get("mesh") == mesh_index:
+                del node["mesh"]
+                node.setdefault("children", []).append(len(nodes))
+                nodes.append(
+                    {"mesh": mesh_index, "translation": translation, "scale": scale}
+                )
+
+    def _write_primitive(
+        self,
+        primitive: dict,
+        attributes: dict[str, list[bytes]],
+        indices: list[int],
+        transform: tuple[list[float], list[float]] | None,
+    ) -> tuple[int, bool]:
+        """Store the vertices and indices of a primitive in a new buffer.
+
+        Returns the size of the new data, and whether any of it was quantized.
+        """
+        accessors = self.description["accessors"]
+        views = self.description["bufferViews"]
+        buffer_index = len(self.description["buffers"])
+        data = bytearray()
+        quantized = False
+
+        def add_view(accessor: dict, payload: bytes, stride: int, target: int) -> None:
+            data.extend(bytes(align_to_4(len(data)) - len(data)))
+            view = {
+                "buffer": buffer_index,
+                "byteOffset": len(data),
+                "byteLength": len(payload),
+                "target": target,
+            }
+            if stride != element_size(accessor):
+                view["byteStride"] = stride
+            data.extend(payload)
+            accessor["bufferView"] = len(views)
+            accessor.pop("byteOffset", None)
+            views.append(view)
+
+            if "min" in accessor or "max" in accessor:
+                components = TYPE_COMPONENTS[accessor["type"]][0]
+                element_format = "<%i%s" % (
+                    components,
+                    COMPONENT_TYPE_FORMATS[accessor["componentType"]],
+                )
+                values = [
+                    struct.unpack_from(element_format, payload, i * stride)
+                    for i in range(accessor["count"])
+                ]
+                if values:
+                    accessor["min"] = [min(column) for column in zip(*values)]
+                    accessor["max"] = [max(column) for column in zip(*values)]
+
+        for attribute, elements in attributes.items():
+            accessor = accessors[primitive["attributes"][attribute]]
+            accessor["count"] = len(elements)
+            result = None
+            if self.quantize and accessor["componentType"] == 5126:
+                result = quantize_attribute(attribute, accessor, elements, transform)
+            if result is not None:
+                payload, stride = result
+                quantized = True
+            else:
+                # Vertex attributes must start on 4-byte boundaries
+                stride = align_to_4(element_size(accessor))
+                padding = bytes(stride - element_size(accessor))
+                payload = (
+                    padding.join(elements) + padding if padding else b"".join(elements)
+                )
+            add_view(accessor, payload, stride, ARRAY_BUFFER)
+
+        accessor = accessors[primitive["indices"]]
+        vertex_count = len(next(iter(attributes.values())))
+        accessor["componentType"] = 5123 if vertex_count <= 65535 else 5125
+        accessor["count"] = len(indices)
+        payload = struct.pack(
+            "<%i%s" % (len(indices), COMPONENT_TYPE_FORMATS[accessor["componentType"]]),
+            *indices,
+        )
+        add_view(accessor, payload, element_size(accessor), ELEMENT_ARRAY_BUFFER)
+
+        self.description["buffers"].append({"byteLength": len(data)})
+        self.generated_buffers[buffer_index] = bytes(data)
+        return len(data), quantized
+
+    def _convert_textures(self) -> None:
+        texture_format = TEXTURE_FORMATS[self.texture_format]
+        images = self.description.get("images", [])
+        self.texture_cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # Converted image file of each image index, and the textures using it
+        converted: dict[int, Path] = {}
+        textures: list[tuple[dict, int]] = []
+        pending: dict[Path, tuple[Path | DataURI, str]] = {}
+        for texture in self.description.get("textures", []):
+            if "source" not in texture:
+                continue
+            if texture_format.extension in texture.get("extensions", {}):
+                continue
+            index = texture["source"]
+            image = images[index]
+            if "uri" not in image:
+                continue
+            if index not in converted:
+                source = parse_uri(image["uri"])
+                mime_type = image.get("mimeType") or (
+                    source.mime_type
+                    if isinstance(source, DataURI)
+                    else mimetypes.guess_type(source.name)[0]
+                )
+                if mime_type not in CONVERTIBLE_IMAGE_SUFFIXES:
+                    continue
+                digest = hashlib.sha256(self.texture_converter.encode("utf-8") + b"\0")
+                if isinstance(source, DataURI):
+                    for chunk in source.chunks(0, source.length):
+                        digest.update(chunk)
+                else:
+                    with open(self.source_dir / source, "rb") as f:
+                        digest = hashlib.file_digest(f, lambda: digest)
+                output = self.texture_cache_dir / (
+                    digest.hexdigest() + texture_format.suffix
+                )
+                if not output.exists():
+                    pending[output] = (source, CONVERTIBLE_IMAGE_SUFFIXES[mime_type])
+                converted[index] = output
+            textures.append((texture, index))
+
+        if pending:
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                futures = [
+                    executor.submit(self._convert_image, source, suffix, output)
+                    for output, (source, suffix) in pending.items()
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+        logging.info(
+            "Converted %i images to %s, %i from the cache",
+            len(converted),
+            self.texture_format,
+            len(converted) - len(pending),
+        )
+
+        new_indices: dict[int, int] = {}
+        for texture, index in textures:
+            if index not in new_indices:
+                new_indices[index] = len(images)
+                self.converted_images[len(images)] = converted[index]
+                image = {"mimeType": texture_format.mime_type}
+                if "name" in images[index]:
+                    image["name"] = images[index]["name"]
+                images.append(image)
+            extensions = texture.setdefault("extensions", {})
+            extensions[texture_format.extension] = {"source": new_indices[index]}
+        if new_indices:
+            extensions_used = self.description.setdefault("extensionsUsed", [])
+            if texture_format.extension not in extensions_used:
+                extensions_used.append(texture_format.extension)
+
+    def _convert_image(self, source: Path | DataURI, suffix: str, output: Path) -> None:
+        if not isinstance(source, DataURI):
+            convert_texture(self.source_dir / source, output, self.texture_converter)
+            return
+        # Converters take files, so embedded images are written out first
+        with tempfile.TemporaryDirectory(dir=self.texture_cache_dir) as temp_dir:
+            input_path = Path(temp_dir) / ("image" + suffix)
+            with open(input_path, "wb") as f:
+                for chunk in source.chunks(0, source.length):
+                    f.write(chunk)
+            convert_texture(input_path, output, self.texture_converter)
+
+    def _image_source(self, index: int, image: GLTFImageDescription) -> Path | DataURI:
+        if index in self.converted_images:
+            return self.converted_images[index]
+        source = parse_uri(image["uri"])
+        # Images in buffer views need a mimeType, which data uris carry
+        if isinstance(source, DataURI) and "mimeType" not in image:
+            image["mimeType"] = source.mime_type
+        return source
+
+    def _source_size(self, source: Path | DataURI) -> int:
+        if isinstance(source, DataURI):
+            return source.length
+        return os.path.getsize(self.source_dir / source)
+
+    def _view_alignments(self) -> dict[int, int]:
+        """Return the alignment each buffer view used by accessors requires."""
+        views = self.description["bufferViews"]
+        alignments: dict[int, int] = {}
+
+        def require(index: int, component_type: int) -> None:
+            alignment = max(COMPONENT_TYPE_SIZES.get(component_type, 4), self.alignment)
+            view = views[index]
+            if "byteStride" in view or view.get("target") == ARRAY_BUFFER:
+                alignment = max(alignment, 4)
+            alignments[index] = max(alignments.get(index, 1), alignment)
+
+        for accessor in self.description.get("accessors", []):
+            if "bufferView" in accessor:
+                require(accessor["bufferView"], accessor["componentType"])
+            sparse = accessor.get("sparse")
+            if sparse is not None:
+                indices = sparse["indices"]
+                require(indices["bufferView"], indices["componentType"])
+                require(sparse["values"]["bufferView"], accessor["componentType"])
+        return alignments
+
+    def _pack_optimized(self) -> None:
+        # The bytes behind each buffer view, as (source, offset, length),
+        # followed by a new buffer view for each external image
+        buffer_sources = [
+            self._buffer_source(index)
+            for index in range(len(self.description["buffers"]))
+        ]
+        sources = [
+            (
+                buffer_sources[view["buffer"]],
+                view.get("byteOffset", 0),
+                view["byteLength"],
+            )
+            for view in self.description["bufferViews"]
+        ]
+        original_length = sum(
+            buffer["byteLength"]
+            for index, buffer in enumerate(self.description["buffers"])
+            if index not in self.generated_buffers
+        )
+
+        for index, image in enumerate(self.description.get("images", [])):
+            if "uri" in image or index in self.converted_images:
+                source = self._image_source(index, image)
+                image_size = self._source_size(source)
+                image["bufferView"] = len(self.description["bufferViews"])
+                self.description["bufferViews"].append(
+                    {"buffer": 0, "byteLength": image_size}
+                )
+                sources.append((source, 0, image_size))
+                original_length += image_size
+                image.pop("uri", None)
+
+        references = buffer_view_references(self.description)
+        alignments = self._view_alignments()
+        views = self.description["bufferViews"]
+        packed_views: list[GLTFBufferViewDescription] = []
+        new_indices: dict[int, int] = {}
+        offsets: dict[tuple[bytes, int], int] = {}
+        with contextlib.ExitStack() as stack:
+            files: dict[Path, BinaryIO] = {}
+            for index in sorted({node["bufferView"] for node in references}):
+                source, offset, length = sources[index]
+                if source is None:
+                    raise GLTFError(
+                        f"bufferView {index} refers to a buffer without a uri"
+                    )
+                if isinstance(source, bytes):
+                    chunks = iter([source[offset : offset + length]])
+                elif isinstance(source, DataURI):
+                    chunks = source.chunks(offset, length)
+                else:
+                    if source not in files:
+                        files[source] = stack.enter_context(
+                            open(self.source_dir / source, "rb", buffering=0)
+                        )
+                    chunks = self._file_chunks(files[source], offset, length)
+                digest = hashlib.sha256()
+                for chunk in chunks:
+                    digest.update(chunk)
+                key = (digest.digest(), length)
+
+                alignment = alignments.get(index, 1)
+                if key not in offsets or offsets[key] % alignment != 0:
+                    aligned_offset = align_to(self.bin_length, alignment)
+                    if aligned_offset > self.bin_length:
+                        padding = aligned_offset - self.bin_length
+                        self.segments.append((None, 0, padding))
+                    self.segments.append((source, offset, length))
+                    offsets[key] = aligned_offset
+                    self.bin_length = aligned_offset + length
+
+                view = views[index]
+                view["buffer"] = 0
+                view["byteOffset"] = offsets[key]
+                new_indices[index] = len(packed_views)
+                packed_views.append(view)
+
+        for node in references:
+            node["bufferView"] = new_indices[node["bufferView"]]
+        self.description["bufferViews"] = packed_views
+
+        logging.info(
+            "Optimized layout: %i bytes packed into %i (%i views dropped)",
+            original_length,
+            self.bin_length,
+            len(views) - len(packed_views),
+        )
+
+    @staticmethod
+    def _file_chunks(source: BinaryIO, offset: int, length: int) -> Iterator[bytes]:
+        source.seek(offset)
+        remaining = length
+        while remaining > 0:
+            chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise GLTFError(
+                    f"Unexpected end of file: {length - remaining} of {length} "
+                    "bytes read"
+                )
+            remaining -= len(chunk)
+            yield chunk
+
     def write(self, file: BinaryIO) -> None:
         """Write a GLB file."""
-        description_json = json.dumps(self.description, separators=(",", ":")).encode(
-            "utf-8"
-        )
+        if isinstance(self.description, LazyJSONObject):
+            description_json = self.description.encode()
+        else:
+            description_json = json.dumps(
+                self.description, separators=(",", ":")
+            ).encode("utf-8")
 
         # A GLB file has a JSON chunk and a BIN chunk, each of which need to be aligned to a 4-byte boundary
-        aligned_json_length = align_to_4(len(description_json))
+        # The JSON chunk may be padded further so the BIN chunk data is aligned too
+        bin_data_offset = align_to(12 + 8 + len(description_json) + 8, self.alignment)
+        aligned_json_length = bin_data_offset - (12 + 8 + 8)
         json_padding = b" " * (aligned_json_length - len(description_json))
 
         aligned_bin_length = align_to_4(self.bin_length)
@@ -164,20 +1298,247 @@ class GLB:
         # chunkType 0x004E4942
         file.write(b"BIN\x00")
         # chunkData
-        for source_file_name in self.source_files:
-            with open(self.source_dir / source_file_name, "rb") as source_file:
-                for read in iter(lambda: source_file.read(), b""):
-                    file.write(read)
+        with contextlib.ExitStack() as stack:
+            files: dict[Path, BinaryIO] = {}
+            for source, offset, length in self.segments:
+                if source is None:
+                    file.write(bytes(length))
+                elif isinstance(source, bytes):
+                    file.write(memoryview(source)[offset : offset + length])
+                elif isinstance(source, DataURI):
+                    for chunk in source.chunks(offset, length):
+                        file.write(chunk)
+                else:
+                    if source not in files:
+                        files[source] = stack.enter_context(
+                            open(self.source_dir / source, "rb", buffering=0)
+                        )
+                    files[source].seek(offset)
+                    copy_file_data(files[source], file, length)
         file.write(bin_padding)
 
 
-def pack(gltf: GLTFDescription, source_dir: Path, dest: Path) -> None:
-    glb = GLB(gltf, source_dir)
+def pack(
+    gltf: GLTFDescription | LazyJSONObject,
+    source_dir: Path,
+    dest: Path,
+    optimize: bool = False,
+    alignment: int = 4,
+    optimize_meshes: bool = False,
+    quantize: bool = False,
+    texture_format: str | None = None,
+    texture_converter: str | None = None,
+    texture_cache_dir: str | None = None,
+) -> None:
+    glb = GLB(
+        gltf,
+        source_dir,
+        optimize,
+        alignment,
+        optimize_meshes,
+        quantize,
+        texture_format,
+        texture_converter,
+        texture_cache_dir,
+    )
     glb.pack()
     with open(dest, "wb") as f:
         glb.write(f)
 
 
+def gltf_dependencies(gltf: GLTFDescription | LazyJSONObject) -> list[Path]:
+    """Return the paths of the external files referenced by buffers and images."""
+    dependencies = []
+    for item in [*gltf.get("buffers", []), *gltf.get("images", [])]:
+        if "uri" in item and not item["uri"].startswith("data:"):
+            uri = urlparse(item["uri"])
+            if uri.scheme == "" and uri.netloc == "":
+                dependencies.append(Path(uri.path))
+    return dependencies
+
+
+def file_fingerprint(path: Path) -> dict:
+    """Return the size, modification time and SHA-256 hash of a file."""
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+
+
+def is_up_to_date(entry: dict | None, output_path: Path, options: dict) -> bool:
+    """Check a manifest entry against the files on disk and the packing options.
+
+    Files are only hashed when their modification time changed but their size
+    didn't; if the contents turn out to be the same the entry is updated with
+    the new time, so a touched file costs one hash rather than one rebuild.
+    """
+    if entry is None or entry["options"] != options:
+        return False
+    try:
+        stat = output_path.stat()
+    except OSError:
+        return False
+    if entry["output"] != {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}:
+        return False
+
+    for path, fingerprint in entry["dependencies"].items():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_size != fingerprint["size"]:
+            return False
+        if stat.st_mtime_ns != fingerprint["mtime_ns"]:
+            if file_fingerprint(Path(path))["sha256"] != fingerprint["sha256"]:
+                return False
+            fingerprint["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+
+def pack_file(input_path: Path, output_path: Path, options: dict) -> dict:
+    """Pack a single GLTF file with the keyword arguments of `pack` in `options`,
+    and return its manifest entry."""
+    with open(input_path, "rb") as f:
+        gltf = LazyJSONObject(f.read())
+    source_dir = input_path.parent.resolve()
+
+    # Fingerprint the inputs before reading them, so that any change made while
+    # packing is picked up by the next build.
+    dependencies = [input_path.resolve()]
+    dependencies += [source_dir / path for path in gltf_dependencies(gltf)]
+    fingerprints = {str(path): file_fingerprint(path) for path in dependencies}
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = output_path.with_name(output_path.name + ".tmp")
+    try:
+        pack(gltf, source_dir, temp_path, **options)
+        os.replace(temp_path, output_path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+    stat = output_path.stat()
+    return {
+        "output": {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns},
+        "dependencies": fingerprints,
+        "options": options,
+    }
+
+
+def find_gltf_files(sources: list[str]) -> dict[Path, Path]:
+    """Map the output path of every GLTF file in `sources` to its input path.
+
+    Each source is a GLTF file, a directory which is searched recursively, or a
+    glob pattern (`**` is supported). Output paths are relative to the directory,
+    or to the part of the pattern before the first wildcard, and keep the
+    directory structure below it.
+    """
+    outputs: dict[Path, Path] = {}
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            root = path
+            files = path.rglob("*.gltf")
+        elif path.is_file():
+            root = path.parent
+            files = [path]
+        else:
+            parts = path.parts
+            wildcard = next(
+                (i for i, part in enumerate(parts) if any(c in part for c in "*?[")),
+                len(parts) - 1,
+            )
+            root = Path(*parts[:wildcard])
+            files = (Path(name) for name in glob.iglob(source, recursive=True))
+
+        for input_path in files:
+            if input_path.suffix != ".gltf" or not input_path.is_file():
+                continue
+            output = input_path.relative_to(root).with_suffix(".glb")
+            previous = outputs.setdefault(output, input_path)
+            if previous.resolve() != input_path.resolve():
+                raise GLTFError(
+                    f"{previous} and {input_path} would both be packed to {output}"
+                )
+    return outputs
+
+
+def load_manifest(manifest_path: Path) -> dict[str, dict]:
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring unreadable manifest %s: %s", manifest_path, e)
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest["outputs"]
+
+
+def save_manifest(manifest_path: Path, entries: dict[str, dict]) -> None:
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    with open(temp_path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "outputs": entries}, f)
+    os.replace(temp_path, manifest_path)
+
+
+def pack_batch(
+    sources: list[str],
+    output_dir: Path,
+    jobs: int | None = None,
+    force: bool = False,
+    **options,
+) -> int:
+    """Pack every GLTF file found in `sources` into `output_dir`.
+
+    `options` are passed on to `pack`. Outputs whose GLTF, buffer and image
+    files and packing options haven't changed since they were last packed are
+    skipped, using the manifest stored in `output_dir`. The remaining files are
+    packed in parallel by `jobs` processes. Returns the number of files which
+    failed to pack.
+    """
+    outputs = find_gltf_files(sources)
+    manifest_path = output_dir / MANIFEST_NAME
+    entries = {} if force else load_manifest(manifest_path)
+
+    stale = []
+    for output, input_path in sorted(outputs.items()):
+        entry = entries.get(output.as_posix())
+        if not is_up_to_date(entry, output_dir / output, options):
+            stale.append((output, input_path))
+
+    failures = 0
+    if stale:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(pack_file, input_path, output_dir / output, options): (
+                    output,
+                    input_path,
+                )
+                for output, input_path in stale
+            }
+            for future in concurrent.futures.as_completed(futures):
+                output, input_path = futures[future]
+                try:
+                    entries[output.as_posix()] = future.result()
+                    logging.info("Packed %s", output_dir / output)
+                except Exception as e:
+                    logging.error("Failed to pack %s: %s", input_path, e)
+                    entries.pop(output.as_posix(), None)
+                    failures += 1
+
+    save_manifest(manifest_path, entries)
+    logging.info(
+        "%i packed, %i up to date, %i failed",
+        len(stale) - failures,
+        len(outputs) - len(stale),
+        failures,
+    )
+    return failures
+
+
 def main():
     logging.basicConfig(
         format="%(asctime)s %(module)s: %(message)s", level=logging.INFO
@@ -185,14 +1546,108 @@ def main():
     parser = argparse.ArgumentParser(
         description="Takes a GLTF file and packs it and all external files into a binary GLB file",
     )
-    parser.add_argument("input", help="The name of the GLTF file to pack")
-    parser.add_argument("output", help="The output filename to be saved")
+    parser.add_argument("input", nargs="?", help="The name of the GLTF file to pack")
+    parser.add_argument("output", nargs="?", help="The output filename to be saved")
+    parser.add_argument(
+        "--batch",
+        nargs="+",
+        metavar="SOURCE",
+        help="Pack every GLTF file in these files, directories or glob patterns "
+        "into --output_dir instead of packing a single file",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=Path,
+        help="Where --batch writes GLB files and the manifest used to skip "
+        "files which are up to date",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of files to pack in parallel in --batch mode "
+        "(default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Pack every file in --batch mode, even if it is up to date",
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Only pack referenced buffer views and images, store identical ones "
+        "once and align each view to its accessors' component size",
+    )
+    parser.add_argument(
+        "--alignment",
+        type=int,
+        choices=(4, 16, 64),
+        default=4,
+        help="Align the BIN chunk and, with --optimize, every view used by "
+        "accessors to this many bytes",
+    )
+    parser.add_argument(
+        "--optimize_meshes",
+        action="store_true",
+        help="Reorder the triangles of each mesh for the vertex cache and remove "
+        "unused vertices (implies --optimize)",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        help="Also store positions, normals, tangents and texture coordinates as "
+        "integers with KHR_mesh_quantization (implies --optimize_meshes)",
+    )
+    parser.add_argument(
+        "--texture_format",
+        choices=sorted(TEXTURE_FORMATS),
+        help="Add a mipmapped GPU-ready version of every PNG and JPEG texture in "
+        "this format, through MSFT_texture_dds or KHR_texture_basisu. The "
+        "original images are kept as a fallback",
+    )
+    parser.add_argument(
+        "--texture_converter",
+        help="Command converting {input} to {output} for --texture_format "
+        "(default: "
+        + "; ".join(f"{name}: {f.converter}" for name, f in TEXTURE_FORMATS.items())
+        + ")",
+    )
+    parser.add_argument(
+        "--texture_cache_dir",
+        help="Where converted textures are cached, by the hash of the image and "
+        f"of the converter command (default: {default_texture_cache_dir()})",
+    )
     args = parser.parse_args()
+    options = {
+        "optimize": args.optimize,
+        "alignment": args.alignment,
+        "optimize_meshes": args.optimize_meshes,
+        "quantize": args.quantize,
+        "texture_format": args.texture_format,
+        "texture_converter": args.texture_converter,
+        "texture_cache_dir": args.texture_cache_dir,
+    }
+
+    if args.batch:
+        if args.input or args.output or not args.output_dir:
+            parser.error("--batch takes --output_dir instead of input and output")
+        try:
+            failures = pack_batch(
+                args.batch, args.output_dir, args.jobs, args.force, **options
+            )
+        except GLTFError as e:
+            logging.error("%s", e)
+            return 1
+        return 1 if failures else 0
+    if not args.input or not args.output:
+        parser.error("input and output are required without --batch")
 
-    with open(args.input, "r") as f:
-        gltf = json.load(f)
+    with open(args.input, "rb") as f:
+        gltf = LazyJSONObject(f.read())
         input_dir = Path(args.input).parent.resolve()
-        pack(gltf, input_dir, Path(args.output))
+        pack(gltf, input_dir, Path(args.output), **options)
     pass
 
 
@@ -1,13 +1,29 @@
 """Loads and renders all scenes in glTF-Sample-Assets."""
 
 import argparse
+import collections
 import concurrent.futures
 import datetime
+import hashlib
 import json
 import os
 import pathlib
+import queue
+import re
+import shutil
+import signal
 import socket
+import statistics
 import subprocess
+import tempfile
+import threading
+import time
+
+# Seconds a timed out test is given to exit after SIGTERM, before SIGKILL.
+_TERMINATE_GRACE_PERIOD = 10
+
+# Logged by `program` around each asset in --gltf-scene-batch mode.
+_BATCH_MARKER = re.compile(rb'gltf-scene-batch: (begin|end) (\d+)')
 
 
 def _get_git_head_commit(path: pathlib.Path) -> str:
@@ -47,9 +63,242 @@ def _build_test_cases(model_index) -> dict[str, str]:
   return test_cases
 
 
+def _hash_file(path: pathlib.Path, digest=None) -> str:
+  """Returns the SHA-256 of a file, after feeding it to `digest` if given."""
+  digest = digest or hashlib.sha256()
+  with path.open('rb') as file:
+    while chunk := file.read(1 << 20):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def _fingerprint_directory(path: pathlib.Path,
+                           previous: dict | None = None) -> dict:
+  """Returns a SHA-256 of the names and contents of all files in a directory.
+
+  Only files whose size or modification time differs from `previous` are read,
+  as in pack_glb.is_up_to_date; the others keep their previous digest.
+
+  Args:
+    path: The directory to hash, e.g. the directory of a glTF-Sample-Assets
+      variant with its .gltf, buffers and textures.
+    previous: The fingerprint of the same directory from a previous run.
+
+  Returns:
+    The hex digest as 'sha256', which changes when any file is added,
+    removed, renamed or modified, and the size, modification time and SHA-256
+    of each file as 'files'.
+  """
+  previous_files = (previous or {}).get('files', {})
+  files = {}
+  for file_path in sorted(p for p in path.rglob('*') if p.is_file()):
+    name = file_path.relative_to(path).as_posix()
+    stat = file_path.stat()
+    entry = previous_files.get(name)
+    # Fingerprints written before per-file digests were kept have no third item
+    if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns] or (
+        len(entry) < 3):
+      entry = [stat.st_size, stat.st_mtime_ns, _hash_file(file_path)]
+    files[name] = entry
+  if previous is not None and previous.get('files') == files:
+    return previous
+
+  digest = hashlib.sha256()
+  for name, (_, _, file_sha256) in files.items():
+    digest.update(f'{name}\0{file_sha256}\0'.encode())
+  return {'sha256': digest.hexdigest(), 'files': files}
+
+
+def _same_viewer(previous_meta: dict, meta: dict) -> bool:
+  """Whether two runs rendered with the same viewer, according to meta.json.
+
+  The viewer is identified by the SHA-256 of --program. Runs that predate it
+  being recorded are compared by BigWheels commit instead.
+  """
+  if 'program_sha256' in previous_meta:
+    return previous_meta['program_sha256'] == meta['program_sha256']
+  return previous_meta['bigwheels_commit_sha'] == meta['bigwheels_commit_sha']
+
+
+def _reusable_tests(output_path: pathlib.Path,
+                    test_names: set[str],
+                    previous_meta: dict,
+                    meta: dict,
+                    previous_hashes: dict[str, dict],
+                    asset_hashes: dict[str, dict] | None = None) -> set[str]:
+  """Picks the tests of a previous run in `output_path` that need no rerun.
+
+  Only tests whose outputs were all written are reused; status.txt is written
+  last. With `asset_hashes` (--incremental), a test is also rerun if its asset
+  files changed, and every test is rerun if the viewer changed.
+
+  Args:
+    output_path: --output of the previous run, which is being resumed.
+    test_names: The test cases of this run.
+    previous_meta: meta.json of the previous run.
+    meta: meta.json of this run.
+    previous_hashes: asset_hashes.json of the previous run.
+    asset_hashes: Fingerprint of the asset directory of each test case, from
+      _fingerprint_directory, to rerun the tests whose inputs changed.
+
+  Returns:
+    The names of the tests to keep the results of.
+  """
+  complete = {
+      test_path.name for test_path in output_path.iterdir()
+      if (test_path / 'status.txt').exists() and test_path.name in test_names
+  }
+  if asset_hashes is None:
+    return complete
+  if not _same_viewer(previous_meta, meta):
+    print('The viewer changed since the previous run, rerunning all tests')
+    return set()
+  return {
+      test_name for test_name in complete
+      if previous_hashes.get(test_name, {}).get('sha256') ==
+      asset_hashes[test_name]['sha256']
+  }
+
+
+def _shard_test_cases(test_cases: dict[str, str],
+                      durations: dict[str, float],
+                      shard_index: int,
+                      shard_count: int) -> dict[str, str]:
+  """Picks the test cases run by one shard, balancing shards by past duration.
+
+  Test cases are assigned longest first to the shard with the least total
+  duration so far, counting test cases without a duration as the median one.
+  Every shard computes the same assignment when given the same durations.
+
+  Args:
+    test_cases: Mapping of test name to test asset, from _build_test_cases.
+    durations: Seconds each test took in a previous run, by test name.
+    shard_index: Which shard to pick the test cases of, from 0.
+    shard_count: The number of shards.
+
+  Returns:
+    The subset of `test_cases` run by shard `shard_index`.
+  """
+  known = [durations[name] for name in test_cases if name in durations]
+  default_duration = statistics.median(known) if known else 1.0
+  totals = [0.0] * shard_count
+  shard = {}
+  for test_name in sorted(
+      test_cases,
+      key=lambda name: (-durations.get(name, default_duration), name)):
+    index = min(range(shard_count), key=lambda i: (totals[i], i))
+    totals[index] += durations.get(test_name, default_duration)
+    if index == shard_index:
+      shard[test_name] = test_cases[test_name]
+  return shard
+
+
+def _merge_shards(shard_paths: list[pathlib.Path],
+                  output_path: pathlib.Path):
+  """Combines the output directories of shards into one results directory.
+
+  Test directories are copied as they are. meta.json lists the hosts of all
+  shards and the earliest start time, and durations.json and asset_hashes.json
+  every test duration and asset hash, so that the result can be used like the
+  output of an unsharded run.
+
+  Args:
+    shard_paths: The --output directory of each shard.
+    output_path: Directory to store the combined results.
+
+  Raises:
+    ValueError: The shards tested different commits, or the same tests.
+  """
+  metas = []
+  durations = {}
+  asset_hashes = {}
+  for shard_path in shard_paths:
+    with (shard_path / 'meta.json').open('r') as meta_file:
+      metas.append(json.load(meta_file))
+    durations_path = shard_path / 'durations.json'
+    if durations_path.exists():
+      with durations_path.open('r') as durations_file:
+        durations.update(json.load(durations_file))
+    hashes_path = shard_path / 'asset_hashes.json'
+    if hashes_path.exists():
+      with hashes_path.open('r') as hashes_file:
+        asset_hashes.update(json.load(hashes_file))
+
+  for key in ('bigwheels_commit_sha', 'glTF-Sample-Assets_commit_sha'):
+    values = {meta[key] for meta in metas}
+    if len(values) > 1:
+      raise ValueError(f'Shards were run with different {key}: {values}')
+  shard_count = metas[0].get('shard_count', 1)
+  missing = (set(range(shard_count)) -
+             {meta.get('shard_index', 0) for meta in metas})
+  if missing:
+    print(f'Missing results of shards {sorted(missing)} of {shard_count}')
+
+  test_paths: dict[str, pathlib.Path] = {}
+  for shard_path in shard_paths:
+    for test_path in sorted(shard_path.iterdir()):
+      if not test_path.is_dir():
+        continue
+      if test_path.name in test_paths:
+        raise ValueError(f'{test_path.name} was run by several shards')
+      test_paths[test_path.name] = test_path
+
+  os.mkdir(output_path)
+  for test_name, test_path in test_paths.items():
+    shutil.copytree(test_path, output_path / test_name)
+
+  # The merged results are those of an unsharded run, e.g. for --resume.
+  meta = dict(metas[0])
+  meta['shard_index'] = 0
+  meta['shard_count'] = 1
+  meta['host'] = ', '.join(dict.fromkeys(shard['host'] for shard in metas))
+  meta['datetime'] = min(shard['datetime'] for shard in metas)
+  meta['shards'] = metas
+  with (output_path / 'meta.json').open('w') as meta_file:
+    json.dump(meta, meta_file)
+  with (output_path / 'durations.json').open('w') as durations_file:
+    json.dump(durations, durations_file, indent=2, sort_keys=True)
+  with (output_path / 'asset_hashes.json').open('w') as hashes_file:
+    json.dump(asset_hashes, hashes_file, indent=2, sort_keys=True)
+
+
+def _signal_process_group(process: subprocess.Popen, kill: bool):
+  """Sends SIGTERM or SIGKILL to a test and any processes it started.
+
+  On Windows only the test process itself is terminated.
+  """
+  if os.name != 'posix':
+    if kill:
+      process.kill()
+    else:
+      process.terminate()
+    return
+  try:
+    os.killpg(process.pid, signal.SIGKILL if kill else signal.SIGTERM)
+  except ProcessLookupError:
+    pass
+
+
+def _wait_for_process_group(process: subprocess.Popen, deadline: float):
+  """Waits until every process in a test's process group has exited, or until
+  `deadline`, a time.monotonic().
+
+  On Windows this returns immediately.
+  """
+  if os.name != 'posix':
+    return
+  while time.monotonic() < deadline:
+    try:
+      os.killpg(process.pid, 0)
+    except ProcessLookupError:
+      return
+    time.sleep(0.01)
+
+
 def _run_test(program: pathlib.Path,
               asset: str,
-              output_path: pathlib.Path):
+              output_path: pathlib.Path,
+              timeout: float | None = None) -> str:
   """Loads and renders a glTF-Sample-Asset scene.
 
   Several outputs are written to disk:
@@ -58,11 +307,18 @@ def _run_test(program: pathlib.Path,
   - ppx.log: Log generated by BigWheels
   - stdout.log: stdout of `program`
   - stderr.log stderr of `program`
+  - status.txt: The status returned by this function
 
   Args:
     program: The program under test used to render the asset under test.
     asset: The glTF-Sample-Asset under test.
     output_path: Directory to store test results.
+    timeout: Seconds after which `program` and any processes it started are
+      sent SIGTERM, then SIGKILL after a grace period.
+
+  Returns:
+    'passed' or 'failed' depending on the exit status of `program`, or
+    'timed_out' if it had to be stopped.
   """
   os.mkdir(output_path)
 
@@ -72,66 +328,437 @@ def _run_test(program: pathlib.Path,
              '--gltf-scene-asset', asset,
              '--screenshot-path', 'actual.ppm',
              '--headless']
-  process = subprocess.run(
-      command, cwd=output_path, capture_output=True, check=False)
+  # Give the test its own process group so that anything it starts is stopped
+  # along with it on a timeout.
+  if os.name == 'posix':
+    process_group = {'process_group': 0}
+  else:
+    process_group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+  process = subprocess.Popen(
+      command, cwd=output_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+      **process_group)
+  try:
+    stdout, stderr = process.communicate(timeout=timeout)
+    status = 'passed' if process.returncode == 0 else 'failed'
+  except subprocess.TimeoutExpired:
+    status = 'timed_out'
+    _signal_process_group(process, kill=False)
+    grace_deadline = time.monotonic() + _TERMINATE_GRACE_PERIOD
+    try:
+      stdout, stderr = process.communicate(timeout=_TERMINATE_GRACE_PERIOD)
+    except subprocess.TimeoutExpired:
+      stdout = stderr = None
+    # Processes the test started can outlive it, so the group is killed even if
+    # the test itself has already exited.
+    _wait_for_process_group(process, grace_deadline)
+    _signal_process_group(process, kill=True)
+    if stdout is None:
+      stdout, stderr = process.communicate()
 
   # Dump debugging information to disk for triaging after a test run
-  (output_path / 'stdout.log').write_bytes(process.stdout)
-  (output_path / 'stderr.log').write_bytes(process.stderr)
+  (output_path / 'stdout.log').write_bytes(stdout)
+  (output_path / 'stderr.log').write_bytes(stderr)
+  (output_path / 'status.txt').write_text(status)
+  return status
+
+
+def _read_lines(stream, name: str, lines: queue.Queue):
+  """Puts `(name, line)` in `lines` for every line of `stream`, then `None`."""
+  for line in stream:
+    lines.put((name, line))
+  lines.put((name, None))
+
+
+def _split_batch_log(lines: list[bytes], test_count: int) -> list[bytes]:
+  """Splits the output of a --gltf-scene-batch process by asset.
+
+  Lines before the first asset (e.g. device creation) are included in the log
+  of every asset, and lines after the last asset (e.g. shutdown) in its log.
+  Assets that were not started get only those first lines.
+
+  Args:
+    lines: Lines of stdout or ppx.log, including the markers.
+    test_count: How many assets the log is split between.
+
+  Returns:
+    The log of each asset in the manifest.
+  """
+  preamble = b''
+  logs = [None] * test_count
+  current = None
+  for line in lines:
+    match = _BATCH_MARKER.search(line)
+    if match and match[1] == b'begin':
+      current = int(match[2])
+      logs[current] = preamble
+    if current is None:
+      preamble += line
+    else:
+      logs[current] += line
+  return [preamble if log is None else log for log in logs]
+
+
+def _run_batch(program: pathlib.Path,
+               assets: dict[str, str],
+               output_path: pathlib.Path,
+               timeout: float | None = None,
+               deadline: float | None = None) -> dict[str, tuple[str, float]]:
+  """Loads and renders several glTF-Sample-Asset scenes per `program` process.
+
+  The assets are rendered one after the other by `program` --gltf-scene-batch,
+  which only creates the device, swapchain and shaders once. When an asset
+  crashes `program` or times out, the following assets are rendered by a new
+  process. Each test directory gets the same outputs as with _run_test, with
+  the logs split by asset.
+
+  Args:
+    program: The program under test used to render the assets under test.
+    assets: Mapping of test name to the glTF-Sample-Asset under test.
+    output_path: Directory to store the results of the tests in.
+    timeout: Seconds after which the process rendering an asset and any
+      processes it started are stopped, as in _run_test. Startup counts
+      towards the timeout of the first asset of a process.
+    deadline: time.monotonic() after which no more assets are rendered, and
+      the process rendering one is stopped.
+
+  Returns:
+    The status and duration in seconds of each test that was run, by test
+    name. Statuses are as returned by _run_test.
+  """
+  if os.name == 'posix':
+    process_group = {'process_group': 0}
+  else:
+    process_group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+
+  results = {}
+  pending = list(assets)
+  while pending and (deadline is None or time.monotonic() < deadline):
+    for test_name in pending:
+      (output_path / test_name).mkdir(exist_ok=True)
+    with tempfile.TemporaryDirectory() as work_dir:
+      work_path = pathlib.Path(work_dir)
+      with (work_path / 'manifest.txt').open('w') as manifest:
+        for test_name in pending:
+          screenshot = (output_path / test_name / 'actual.ppm').resolve()
+          manifest.write(f'{assets[test_name]}\t{screenshot}\n')
+
+      start = time.monotonic()
+      process = subprocess.Popen(
+          [program, '--gltf-scene-batch', 'manifest.txt', '--headless'],
+          cwd=work_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+          **process_group)
+      lines = queue.Queue()
+      for name, stream in (('stdout', process.stdout),
+                           ('stderr', process.stderr)):
+        threading.Thread(target=_read_lines, args=(stream, name, lines),
+                         daemon=True).start()
+
+      # The time each asset was started at, by index in `pending`. Lines are
+      # matched to the last asset started when they are read.
+      begin_times = {}
+      ended = set()
+      stderr = [[] for _ in pending]
+      stderr_preamble = []
+      stdout = []
+      timed_out = False
+      signalled_at = None
+      killed = False
+      open_streams = 2
+      while open_streams:
+        if killed:
+          expiry = None
+        elif signalled_at is not None:
+          expiry = signalled_at + _TERMINATE_GRACE_PERIOD
+        else:
+          limits = []
+          if timeout is not None:
+            limits.append(max(begin_times.values(), default=start) + timeout)
+          if deadline is not None:
+            limits.append(deadline)
+          expiry = min(limits, default=None)
+        now = time.monotonic()
+        if expiry is not None and now >= expiry:
+          if signalled_at is None:
+            timed_out = True
+            signalled_at = now
+            _signal_process_group(process, kill=False)
+          else:
+            _signal_process_group(process, kill=True)
+            killed = True
+          continue
+        try:
+          name, line = lines.get(
+              timeout=None if expiry is None else expiry - now)
+        except queue.Empty:
+          continue
+        if line is None:
+          open_streams -= 1
+        elif name == 'stdout':
+          stdout.append(line)
+          match = _BATCH_MARKER.search(line)
+          if match and match[1] == b'begin':
+            begin_times[int(match[2])] = time.monotonic()
+          elif match:
+            ended.add(int(match[2]))
+        elif begin_times:
+          stderr[max(begin_times)].append(line)
+        else:
+          stderr_preamble.append(line)
+      returncode = process.wait()
+      end = time.monotonic()
+      # As in _run_test, what is left of the group once the grace period is
+      # over is killed, even if `program` has exited.
+      if signalled_at is not None and not killed:
+        _wait_for_process_group(process,
+                                signalled_at + _TERMINATE_GRACE_PERIOD)
+        _signal_process_group(process, kill=True)
+      process.stdout.close()
+      process.stderr.close()
+
+      ppx_log_path = work_path / 'ppx.log'
+      ppx_log = (ppx_log_path.read_bytes().splitlines(keepends=True)
+                 if ppx_log_path.exists() else [])
+
+    # A process that fails before starting any asset is blamed on the first
+    # one, so that every process makes progress.
+    last = max(begin_times, default=0)
+    begin_times[0] = start
+    stdout_logs = _split_batch_log(stdout, len(pending))
+    ppx_logs = _split_batch_log(ppx_log, len(pending))
+    for index in range(last + 1):
+      test_name = pending[index]
+      if index < last:
+        status = 'passed' if index in ended else 'failed'
+      elif timed_out:
+        status = 'timed_out'
+      else:
+        status = 'passed' if index in ended and returncode == 0 else 'failed'
+      test_path = output_path / test_name
+      (test_path / 'stdout.log').write_bytes(stdout_logs[index])
+      (test_path / 'stderr.log').write_bytes(
+          b''.join(stderr_preamble + stderr[index]))
+      (test_path / 'ppx.log').write_bytes(ppx_logs[index])
+      (test_path / 'status.txt').write_text(status)
+      results[test_name] = (
+          status, begin_times.get(index + 1, end) - begin_times[index])
+    pending = pending[last + 1:]
+
+  # Leave no output for tests that were not run, like _run_test.
+  for test_name in pending:
+    test_path = output_path / test_name
+    if test_path.exists() and not any(test_path.iterdir()):
+      test_path.rmdir()
+  return results
 
 
 def main():
   """Loads and renders all scenes in glTF-Sample-Assets."""
   parser = argparse.ArgumentParser(
       description='Loads and renders all glTF-Sample-Assets.')
-  parser.add_argument('--program', type=pathlib.Path, required=True,
+  parser.add_argument('--program', type=pathlib.Path,
                       help=('The program used to load and render a glTF ' +
                             'scene. Must support --gltf-scene-asset and ' +
                             'other BigWheels options.'))
-  parser.add_argument('--model-index', type=pathlib.Path, required=True,
+  parser.add_argument('--model-index', type=pathlib.Path,
                       help='Path to glTF-Sample-Asssets model-index.json.')
   parser.add_argument('--output', type=pathlib.Path, required=True,
                       help='Directory to store test results.')
   parser.add_argument('-j', '--jobs', type=int, default=None,
                       help='How many tests to run in parallel. Default is '
                       '"as much as the CPU can reasonably handle"')
+  parser.add_argument('--timeout', type=float, default=300,
+                      help='Seconds after which a test is stopped and reported '
+                      'as timed out. 0 means no limit.')
+  parser.add_argument('--global-timeout', type=float, default=0,
+                      help='Seconds after which running tests are stopped as '
+                      'with --timeout and no more tests are started. 0 means '
+                      'no limit.')
+  parser.add_argument('--shard-count', type=int, default=1,
+                      help='Split the tests into this many shards with similar '
+                      'total durations according to --history, and only run '
+                      'one of them.')
+  parser.add_argument('--shard-index', type=int, default=0,
+                      help='Which shard to run, from 0 to --shard-count - 1.')
+  parser.add_argument('--history', type=pathlib.Path,
+                      help='durations.json from the output of a previous run, '
+                      'used to balance shards. Every shard must be given the '
+                      'same one.')
+  parser.add_argument('--batch-size', type=int, default=1,
+                      help='Render up to this many assets per --program '
+                      'process, which must then support --gltf-scene-batch. '
+                      'An asset that crashes or times out fails alone, and '
+                      'the rest of its batch is rendered by a new process.')
+  rerun_group = parser.add_mutually_exclusive_group()
+  rerun_group.add_argument('--resume', action='store_true',
+                           help='Continue an interrupted run in --output, '
+                           'skipping the tests it completed. The viewer and '
+                           'both commits must be the same.')
+  rerun_group.add_argument('--incremental', action='store_true',
+                           help='Update the results of a previous run in '
+                           '--output, only rerunning the tests whose asset '
+                           'files changed, or all of them if --program '
+                           'changed.')
+  parser.add_argument('--merge', type=pathlib.Path, nargs='+',
+                      metavar='SHARD_OUTPUT',
+                      help='Instead of running tests, combine the --output '
+                      'directories of shards into --output.')
   args = parser.parse_args()
+  if args.merge:
+    _merge_shards(args.merge, args.output)
+    return
+  if args.program is None or args.model_index is None:
+    parser.error('--program and --model-index are required to run tests')
+  if not 0 <= args.shard_index < args.shard_count:
+    parser.error('--shard-index must be from 0 to --shard-count - 1')
+  if args.batch_size < 1:
+    parser.error('--batch-size must be at least 1')
 
   program = args.program.resolve()
 
   with args.model_index.open('r', encoding='utf-8') as model_index_file:
     model_index = json.load(model_index_file)
 
-  os.mkdir(args.output)
-
   # Dump some state of the test environment to be included in the report.
   bigwheels_commit_sha = _get_git_head_commit(
       pathlib.Path(__file__).parent.resolve())
   assets_commit_sha = _get_git_head_commit(args.model_index.parent.resolve())
-  with (args.output / 'meta.json').open('w') as meta_file:
-    json.dump({'host': str(socket.getfqdn()),
-               'datetime': str(datetime.datetime.now()),
-               'bigwheels_commit_sha': bigwheels_commit_sha,
-               'glTF-Sample-Assets_commit_sha': assets_commit_sha}, meta_file)
+  meta = {'host': str(socket.getfqdn()),
+          'datetime': str(datetime.datetime.now()),
+          'bigwheels_commit_sha': bigwheels_commit_sha,
+          'glTF-Sample-Assets_commit_sha': assets_commit_sha,
+          'program_sha256': _hash_file(program),
+          'shard_index': args.shard_index,
+          'shard_count': args.shard_count}
 
   test_cases = _build_test_cases(model_index)
+  if args.shard_count > 1:
+    history = {}
+    if args.history is not None:
+      with args.history.open('r') as history_file:
+        history = json.load(history_file)
+    test_cases = _shard_test_cases(test_cases, history, args.shard_index,
+                                   args.shard_count)
+  # Test assets are glTF-Sample-Assets/Models/<name>/<variant>/<file>, and
+  # model-index.json is in the Models directory.
+  models_path = args.model_index.parent
+  asset_paths = {
+      test_name: models_path.joinpath(
+          *pathlib.PurePosixPath(asset).parent.parts[2:])
+      for test_name, asset in test_cases.items()
+  }
+
+  def fingerprint_assets() -> dict[str, dict]:
+    return {
+        test_name: _fingerprint_directory(path, previous_hashes.get(test_name))
+        for test_name, path in asset_paths.items()
+    }
+
+  durations = {}
+  previous_hashes = {}
+  asset_hashes = None
+  meta_path = args.output / 'meta.json'
+  if (args.resume or args.incremental) and meta_path.exists():
+    with meta_path.open('r') as meta_file:
+      previous_meta = json.load(meta_file)
+    if args.resume:
+      for key in ('bigwheels_commit_sha', 'glTF-Sample-Assets_commit_sha',
+                  'program_sha256', 'shard_index', 'shard_count'):
+        if previous_meta.get(key) != meta[key]:
+          parser.error(f'cannot --resume a run with a different {key}, '
+                       'use --incremental instead')
+    hashes_path = args.output / 'asset_hashes.json'
+    if hashes_path.exists():
+      with hashes_path.open('r') as hashes_file:
+        previous_hashes = json.load(hashes_file)
+    durations_path = args.output / 'durations.json'
+    if durations_path.exists():
+      with durations_path.open('r') as durations_file:
+        durations = json.load(durations_file)
+
+    if args.incremental:
+      asset_hashes = fingerprint_assets()
+    reused = _reusable_tests(args.output, set(test_cases), previous_meta, meta,
+                             previous_hashes, asset_hashes)
+    # Clear incomplete, outdated and removed tests out of the way.
+    for test_path in args.output.iterdir():
+      if test_path.is_dir() and test_path.name not in reused:
+        shutil.rmtree(test_path)
+    durations = {test_name: duration
+                 for test_name, duration in durations.items()
+                 if test_name in reused}
+    test_cases = {test_name: asset for test_name, asset in test_cases.items()
+                  if test_name not in reused}
+    print(f'Reusing the results of {len(reused)} tests')
+  elif args.resume or args.incremental:
+    args.output.mkdir(parents=True, exist_ok=True)
+  else:
+    os.mkdir(args.output)
+
+  with meta_path.open('w') as meta_file:
+    json.dump(meta, meta_file)
+
   test_count = len(test_cases)  # Used for printing progress
   test_index = 1  # Used for printing progress
 
+  deadline = (time.monotonic() + args.global_timeout
+              if args.global_timeout else None)
+
+  def run(test_names: list[str]) -> dict[str, str]:
+    if args.batch_size > 1:
+      results = _run_batch(
+          program,
+          {test_name: test_cases[test_name] for test_name in test_names},
+          args.output, args.timeout or None, deadline)
+      batch_statuses = {}
+      for test_name in test_names:
+        if test_name in results:
+          batch_statuses[test_name], durations[test_name] = results[test_name]
+        else:
+          batch_statuses[test_name] = 'not_run'
+      return batch_statuses
+
+    test_name, = test_names
+    timeout = args.timeout or None
+    if deadline is not None:
+      remaining = deadline - time.monotonic()
+      # Leave no output so that the report treats the test as not run
+      if remaining <= 0:
+        return {test_name: 'not_run'}
+      timeout = min(timeout or remaining, remaining)
+    start = time.monotonic()
+    status = _run_test(program, test_cases[test_name],
+                       args.output / test_name, timeout)
+    durations[test_name] = time.monotonic() - start
+    return {test_name: status}
+
+  test_names = list(test_cases)
+  batches = [test_names[i:i + args.batch_size]
+             for i in range(0, len(test_names), args.batch_size)]
+  statuses = collections.Counter()
   with concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
-    futures_to_test_name = {
-      executor.submit(
-          _run_test, program, test_cases[test_name], args.output / test_name
-      ): test_name
-      for test_name in test_cases
-    }
+    futures = [executor.submit(run, batch) for batch in batches]
     print('Launched jobs, waiting for results...')
-    for future in concurrent.futures.as_completed(futures_to_test_name):
-      test_name = futures_to_test_name[future]
-      print(f'{test_index}/{test_count}: {test_name}')
-      test_index += 1
+    for future in concurrent.futures.as_completed(futures):
+      for test_name, status in future.result().items():
+        statuses[status] += 1
+        if status in ('timed_out', 'not_run'):
+          print(f'{test_index}/{test_count}: {test_name} ({status})')
+        else:
+          print(f'{test_index}/{test_count}: {test_name}')
+        test_index += 1
+
+  # Record how long each test took, to balance the shards of later runs.
+  with (args.output / 'durations.json').open('w') as durations_file:
+    json.dump(durations, durations_file, indent=2, sort_keys=True)
+  # Lets a later --incremental run tell which assets changed. Unless this run
+  # needed them up front, assets are only hashed once the tests are done.
+  if asset_hashes is None:
+    asset_hashes = fingerprint_assets()
+  with (args.output / 'asset_hashes.json').open('w') as hashes_file:
+    json.dump(asset_hashes, hashes_file, indent=2, sort_keys=True)
 
-  print('Done tests')
+  print('Done tests: ' +
+        ', '.join(f'{count} {status}' for status, count in statuses.items()))
 
 if __name__ == '__main__':
   main()
@@ -4,12 +4,20 @@ from concurrent import futures
 import argparse
 import dataclasses
 import enum
+import hashlib
+import json
 import logging
+import os
 import pathlib
 import platform
+import shutil
+import signal
+import statistics
 import subprocess
 import stat
 import sys
+import time
+from typing import Any, Callable, Iterator
 
 
 LOGGER = logging.getLogger()
@@ -23,6 +31,50 @@ KNOWN_ISSUES: dict[str, str] = {
     "dx12_dynamic_rendering": "https://github.com/google/bigwheels/issues/449",
 }
 
+# Arguments every test executable is run with, before any executable_args
+TEST_ARGUMENTS = ["--frame-count=2", "--screenshot-frame-number=1"]
+
+# Format version of the keys and layout of the result cache
+CACHE_VERSION = 1
+
+# Environment variables which select the Vulkan drivers and layers tests use
+DRIVER_ENVIRONMENT_VARIABLES = (
+    "VK_ICD_FILENAMES",
+    "VK_DRIVER_FILES",
+    "VK_ADD_DRIVER_FILES",
+    "VK_INSTANCE_LAYERS",
+    "VK_LOADER_LAYERS_ENABLE",
+    "VK_LOADER_LAYERS_DISABLE",
+    "VK_LAYER_PATH",
+    "VK_ADD_LAYER_PATH",
+)
+
+# Directories searched by the Vulkan loader for driver manifests on Linux
+VULKAN_ICD_DIRECTORIES = (
+    "/etc/vulkan/icd.d",
+    "/usr/local/share/vulkan/icd.d",
+    "/usr/share/vulkan/icd.d",
+    "~/.local/share/vulkan/icd.d",
+)
+
+# Format version of the file recording how long each test took and what it used
+HISTORY_VERSION = 1
+
+# Weight of the newest run in the moving averages kept in the history file
+HISTORY_SMOOTHING = 0.5
+
+# Tests spending less than this fraction of their wall time on the CPU are
+# assumed to be waiting on the GPU, and are limited by --gpu_jobs
+GPU_BOUND_CPU_FRACTION = 0.5
+
+# Assumed cost of tests that have never been run. They are scheduled first and
+# counted as GPU-heavy, so that a slow new test can't extend the makespan.
+UNKNOWN_TEST_DURATION = float("inf")
+UNKNOWN_TEST_PEAK_RSS = 512 * 1024 * 1024
+
+# Seconds a timed out test is given to exit after SIGTERM, before SIGKILL
+TERMINATE_GRACE_PERIOD = 10
+
 
 class CmakeBuildConfig(enum.StrEnum):
     """Common values of --config used by CMake"""
@@ -32,26 +84,239 @@ class CmakeBuildConfig(enum.StrEnum):
     REL_WITH_DEB_INFO = "RelWithDebInfo"
 
 
+class TestStatus(enum.StrEnum):
+    """How a test executable finished"""
+
+    PASSED = "passed"
+    FAILED = "failed"
+    TIMED_OUT = "timed_out"
+    # The global timeout expired before the test could be started
+    NOT_RUN = "not_run"
+
+
+@dataclasses.dataclass
+class TestUsage:
+    """What running a test cost, as recorded in the history file
+
+    Attributes:
+        duration: Wall time of the run in seconds
+        cpu_time: User and system CPU time of the run in seconds
+        peak_rss: Peak resident set size of the executable in bytes, or 0 where
+          the platform doesn't report it
+    """
+
+    duration: float = 0.0
+    cpu_time: float = 0.0
+    peak_rss: int = 0
+
+    @property
+    def known(self) -> bool:
+        """Whether the usage was measured, rather than assumed for a new test"""
+        return 0 < self.duration < UNKNOWN_TEST_DURATION
+
+    @property
+    def gpu_bound(self) -> bool:
+        """Whether the test spent most of its time waiting rather than on the CPU"""
+        if not self.known:
+            return True
+        return self.cpu_time / self.duration < GPU_BOUND_CPU_FRACTION
+
+    @property
+    def cpus(self) -> float:
+        """The average number of CPUs kept busy by the test"""
+        if not self.known:
+            return 1.0
+        return min(max(self.cpu_time / self.duration, 0.1), os.cpu_count() or 1)
+
+    def updated(self, latest: "TestUsage") -> "TestUsage":
+        """Returns the moving averages including the latest run.
+
+        The peak RSS follows increases immediately, so that the memory budget
+        isn't exceeded twice, and decreases gradually.
+        """
+        return TestUsage(
+            duration=_smooth(self.duration, latest.duration),
+            cpu_time=_smooth(self.cpu_time, latest.cpu_time),
+            peak_rss=max(latest.peak_rss, int(_smooth(self.peak_rss, latest.peak_rss))),
+        )
+
+
 @dataclasses.dataclass
 class TestResult:
     """Information about how the test fared
 
     Attributes:
+        status: Whether the test passed, failed, timed out or wasn't run
         returncode: The exit status of the executable when run
         executable: The path to the executable run for the test
         output_directory: The path to a directory containing files produced
           during the test. This includes logs and screenshots.
+        usage: What running the executable cost
     """
 
+    status: TestStatus = TestStatus.PASSED
     returncode: int = 0
     executable: pathlib.Path = pathlib.Path()
     output_directory: pathlib.Path = pathlib.Path()
+    usage: TestUsage | None = None
+
+
+@dataclasses.dataclass
+class ResourceBudget:
+    """How much of the machine concurrently running tests may use
+
+    Attributes:
+        cpus: Number of CPUs to share between tests, by their average usage
+        memory: Bytes of memory to share between tests, by their peak RSS, or
+          None for no limit
+        gpu_jobs: Number of GPU-bound tests to run at once
+        jobs: Maximum number of tests to run at once, or None for no limit
+    """
+
+    cpus: float
+    memory: int | None
+    gpu_jobs: int
+    jobs: int | None = None
+
+
+def _smooth(average: float, latest: float) -> float:
+    return HISTORY_SMOOTHING * latest + (1 - HISTORY_SMOOTHING) * average
+
+
+def _physical_memory() -> int | None:
+    """Returns the number of bytes of physical memory, if it can be determined"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _signal_process_group(process: subprocess.Popen, kill: bool) -> None:
+    """Asks a test and any processes it started to exit, or kills them.
+
+    On Windows only the test process itself is signalled.
+    """
+    if os.name != "posix":
+        if kill:
+            process.kill()
+        else:
+            process.terminate()
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL if kill else signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def _wait_for_process_group(process: subprocess.Popen, deadline: float):
+    """Waits until every process in a test's process group has exited, or until
+    `deadline`.
+
+    On Windows this returns immediately.
+    """
+    if os.name != "posix":
+        return
+    while time.monotonic() < deadline:
+        try:
+            os.killpg(process.pid, 0)
+        except ProcessLookupError:
+            return
+        time.sleep(0.01)
+
+
+def _wait4(pid: int, timeout: float | None) -> tuple[int, Any] | None:
+    """Reaps a process with os.wait4, or returns None if it is still running
+    after `timeout` seconds. Polls with the same backoff as Popen.wait."""
+    if timeout is None:
+        return os.wait4(pid, 0)[1:]
+    deadline = time.monotonic() + timeout
+    delay = 0.0005
+    while True:
+        reaped, status, rusage = os.wait4(pid, os.WNOHANG)
+        if reaped:
+            return status, rusage
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        delay = min(delay * 2, remaining, 0.05)
+        time.sleep(delay)
+
+
+def _wait_with_usage(
+    process: subprocess.Popen, start: float, timeout: float | None
+) -> tuple[int, TestUsage, bool]:
+    """Waits for a process to exit and returns its exit status, its usage and
+    whether it timed out.
+
+    A process still running `timeout` seconds after `start` is sent SIGTERM
+    along with its process group. Whatever is left of the group
+    TERMINATE_GRACE_PERIOD seconds later is sent SIGKILL, even if the process
+    itself has exited by then.
+
+    Where os.wait4 is available the process is reaped with it, which reports the
+    CPU time and peak RSS of just that process, even with other tests running.
+    """
+
+    def wait(timeout: float | None) -> tuple[int, Any | None] | None:
+        if hasattr(os, "wait4"):
+            return _wait4(process.pid, timeout)
+        try:
+            return process.wait(timeout), None
+        except subprocess.TimeoutExpired:
+            return None
+
+    timed_out = False
+    result = wait(
+        None if timeout is None else max(start + timeout - time.monotonic(), 0)
+    )
+    if result is None:
+        timed_out = True
+        LOGGER.warning(f"{process.args[0]} timed out after {timeout:.0f}s, terminating")
+        _signal_process_group(process, kill=False)
+        grace_deadline = time.monotonic() + TERMINATE_GRACE_PERIOD
+        result = wait(TERMINATE_GRACE_PERIOD)
+        if result is None:
+            LOGGER.warning(f"{process.args[0]} ignored SIGTERM, killing")
+        # Processes the test started can outlive it, so the group is killed
+        # even if the test itself has already exited
+        _wait_for_process_group(process, grace_deadline)
+        _signal_process_group(process, kill=True)
+        if result is None:
+            result = wait(None)
+    duration = time.monotonic() - start
+
+    assert result is not None
+    status, rusage = result
+    if rusage is None:
+        return status, TestUsage(duration=duration), timed_out
+    returncode = os.waitstatus_to_exitcode(status)
+    # The process is reaped, so stop Popen from waiting for it again
+    process.returncode = returncode
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return (
+        returncode,
+        TestUsage(
+            duration=duration,
+            cpu_time=rusage.ru_utime + rusage.ru_stime,
+            peak_rss=peak_rss,
+        ),
+        timed_out,
+    )
+
+
+def test_output_directory(
+    base_output_directory: pathlib.Path, executable: pathlib.Path
+) -> pathlib.Path:
+    """Returns where the results of running a test executable are stored"""
+    return base_output_directory / f"{executable.stem}_results"
 
 
 def run_test(
     executable: pathlib.Path,
     base_output_directory: pathlib.Path,
     args: list[str] | None,
+    timeout: float | None = None,
 ) -> TestResult | None:
     """Runs a test executable and returns information about what happened.
 
@@ -60,6 +325,8 @@ def run_test(
     - stdout.txt: stdout produced when running the executable
     - stderr.txt: stderr produced when running the executable
     - returncode.txt: The exit status of running the executable
+    - status.txt: The TestStatus of the test
+    - usage.json: The TestUsage of the run, which --merge adds to the history
     - screenshot_frame_1.ppm: For samples that present to a window, the
       contents of the window just before exitting
     - ppx.log: The BigWheels log file
@@ -71,6 +338,8 @@ def run_test(
     Args:
         executable: Which program to run for the text
         args: Additional arguments to provide to the executable when run
+        timeout: Seconds after which the executable and any processes it started
+          are stopped, and the test reported as timed out
 
     Returns:
         A bundle of information about what happened during the test. If the test
@@ -81,22 +350,464 @@ def run_test(
         print(f"Skipping {executable} because of {KNOWN_ISSUES[test_name]}")
         return None
     LOGGER.debug(f"Running: {executable}")
-    output_directory = base_output_directory / f"{executable.stem}_results"
+    output_directory = test_output_directory(base_output_directory, executable)
     output_directory.mkdir(parents=True, exist_ok=True)
-    command = [str(executable), "--frame-count=2", "--screenshot-frame-number=1"]
+    command = [str(executable), *TEST_ARGUMENTS]
     if args:
         command.extend(args)
-    results = subprocess.run(command, capture_output=True, cwd=output_directory)
-    (output_directory / "stdout.txt").write_bytes(results.stdout)
-    (output_directory / "stderr.txt").write_bytes(results.stderr)
-    (output_directory / "returncode.txt").write_text(str(results.returncode))
+    with open(output_directory / "stdout.txt", "wb") as stdout, open(
+        output_directory / "stderr.txt", "wb"
+    ) as stderr:
+        start = time.monotonic()
+        # Each test gets its own process group, so that anything it starts can
+        # be stopped along with it if it times out
+        process = subprocess.Popen(
+            command,
+            stdout=stdout,
+            stderr=stderr,
+            cwd=output_directory,
+            **(
+                {"process_group": 0}
+                if os.name == "posix"
+                else {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+            ),
+        )
+        returncode, usage, timed_out = _wait_with_usage(process, start, timeout)
+    if timed_out:
+        status = TestStatus.TIMED_OUT
+    elif returncode != 0:
+        status = TestStatus.FAILED
+    else:
+        status = TestStatus.PASSED
+    (output_directory / "returncode.txt").write_text(str(returncode))
+    (output_directory / "status.txt").write_text(str(status))
+    (output_directory / "usage.json").write_text(json.dumps(dataclasses.asdict(usage)))
     return TestResult(
-        returncode=results.returncode,
+        status=status,
+        returncode=returncode,
         executable=executable,
         output_directory=output_directory,
+        usage=usage,
     )
 
 
+class FileHashes:
+    """SHA-256 hashes of files, which are only recomputed when the size or
+    modification time of a file changes.
+
+    The hashes are kept in a JSON file between runs, so that only the files
+    which changed since the previous run are read. Only the files hashed during
+    this run are kept when saving, so deleted files don't accumulate.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        try:
+            with open(path, "r") as f:
+                self.hashes: dict[str, list] = json.load(f)
+        except (OSError, ValueError):
+            self.hashes = {}
+        self.used: set[str] = set()
+
+    def hash(self, path: pathlib.Path) -> str:
+        """Returns the hex SHA-256 hash of the contents of a file"""
+        stat_result = path.stat()
+        fingerprint = [stat_result.st_size, stat_result.st_mtime_ns]
+        self.used.add(str(path))
+        cached = self.hashes.get(str(path))
+        if cached is not None and cached[:2] == fingerprint:
+            return cached[2]
+        with open(path, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        self.hashes[str(path)] = [*fingerprint, digest]
+        return digest
+
+    def hash_directory(self, directory: pathlib.Path) -> str:
+        """Returns a hash of the names and contents of every file in a
+        directory, or of its absence"""
+        digest = hashlib.sha256()
+        if not directory.is_dir():
+            digest.update(b"missing")
+            return digest.hexdigest()
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                path = pathlib.Path(root) / name
+                relative_path = path.relative_to(directory).as_posix()
+                digest.update(f"{relative_path}\0{self.hash(path)}\0".encode())
+        return digest.hexdigest()
+
+    def save(self) -> None:
+        """Writes the hashes, replacing the file atomically"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump({path: self.hashes[path] for path in sorted(self.used)}, f)
+        os.replace(temp_path, self.path)
+
+
+def _extra_assets_paths(
+    args: list[str] | None, working_directory: pathlib.Path
+) -> list[pathlib.Path]:
+    """Returns the directories added by --extra-assets-path in test arguments,
+    with relative paths resolved against the directory the test runs in"""
+    paths = []
+    args = args or []
+    for index, arg in enumerate(args):
+        if arg.startswith("--extra-assets-path="):
+            value = arg.split("=", 1)[1]
+        elif arg == "--extra-assets-path" and index + 1 < len(args):
+            value = args[index + 1]
+        else:
+            continue
+        paths.extend(working_directory / path for path in value.split(","))
+    return paths
+
+
+def driver_identity(api: str) -> dict:
+    """Describes the graphics drivers that tests would run on.
+
+    For Vulkan this includes the contents of the driver manifests the loader
+    would find, and the size and modification time of the libraries they name,
+    so that installing a different driver changes the identity.
+
+    Args:
+        api: Which graphics API is being tested
+
+    Returns:
+        A JSON-serializable description of the platform and drivers
+    """
+    identity: dict = {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "environment": {
+            name: os.environ[name]
+            for name in DRIVER_ENVIRONMENT_VARIABLES
+            if name in os.environ
+        },
+    }
+    if api != "vk":
+        return identity
+
+    manifests: list[pathlib.Path] = []
+    for name in ("VK_ICD_FILENAMES", "VK_DRIVER_FILES", "VK_ADD_DRIVER_FILES"):
+        manifests.extend(
+            pathlib.Path(path)
+            for path in os.environ.get(name, "").split(os.pathsep)
+            if path
+        )
+    for directory in VULKAN_ICD_DIRECTORIES:
+        directory_path = pathlib.Path(directory).expanduser()
+        if directory_path.is_dir():
+            manifests.extend(sorted(directory_path.glob("*.json")))
+
+    drivers = {}
+    for manifest in manifests:
+        try:
+            contents = manifest.read_bytes()
+            library = json.loads(contents)["ICD"]["library_path"]
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+        library_path = manifest.parent / library
+        library_stat = (
+            [library_path.stat().st_size, library_path.stat().st_mtime_ns]
+            if os.sep in library and library_path.exists()
+            else None
+        )
+        drivers[str(manifest)] = {
+            "manifest": hashlib.sha256(contents).hexdigest(),
+            "library": library_stat,
+        }
+    identity["drivers"] = drivers
+    return identity
+
+
+def cache_key(
+    executable_hash: str,
+    args: list[str] | None,
+    assets: dict[str, str],
+    driver: dict,
+) -> str:
+    """Returns the key under which the result of a test is cached.
+
+    The key covers everything that can change the result of a test: the
+    executable, its arguments, the assets it may read and the drivers it runs on.
+    Tests look assets up by path at run time, so which of them a test reads
+    isn't known, and the hashes of whole asset directories are used instead.
+
+    Args:
+        executable_hash: The hash of the test executable
+        args: Additional arguments the executable is run with
+        assets: The hash of each directory the executable may read assets from
+        driver: The result of driver_identity()
+
+    Returns:
+        A hex SHA-256 hash
+    """
+    key = {
+        "version": CACHE_VERSION,
+        "executable": executable_hash,
+        "arguments": [*TEST_ARGUMENTS, *(args or [])],
+        "assets": assets,
+        "driver": driver,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def restore_cached_result(
+    cache_dir: pathlib.Path,
+    executable: pathlib.Path,
+    key: str,
+    base_output_directory: pathlib.Path,
+) -> TestResult | None:
+    """Copies the cached output of a passing test run into the output directory.
+
+    Args:
+        cache_dir: The base directory of the result cache
+        executable: The test executable
+        key: The cache_key() of the test
+        base_output_directory: The base of the directory to store results
+
+    Returns:
+        The result of the cached run, or None if there isn't one with this key
+    """
+    entry = cache_dir / f"{executable.stem}-{key}"
+    if not entry.is_dir():
+        return None
+    output_directory = test_output_directory(base_output_directory, executable)
+    shutil.copytree(entry, output_directory, dirs_exist_ok=True)
+    # The test wasn't run, so there's no usage to add to the history
+    (output_directory / "usage.json").unlink(missing_ok=True)
+    return TestResult(executable=executable, output_directory=output_directory)
+
+
+def store_cached_result(
+    cache_dir: pathlib.Path, executable: pathlib.Path, key: str, result: TestResult
+) -> None:
+    """Copies the output of a passing test run into the result cache.
+
+    Only the latest result of each test is kept, so the cache stays the size of
+    a single run's output.
+
+    Args:
+        cache_dir: The base directory of the result cache
+        executable: The test executable
+        key: The cache_key() of the test
+        result: The result of running the test
+    """
+    entry = cache_dir / f"{executable.stem}-{key}"
+    temp_entry = cache_dir / f".{entry.name}.tmp"
+    shutil.rmtree(temp_entry, ignore_errors=True)
+    shutil.copytree(
+        result.output_directory, temp_entry, ignore=shutil.ignore_patterns("usage.json")
+    )
+    for previous in cache_dir.glob(f"{executable.stem}-*"):
+        if previous.name.rsplit("-", 1)[0] == executable.stem:
+            shutil.rmtree(previous, ignore_errors=True)
+    os.replace(temp_entry, entry)
+
+
+def load_history(path: pathlib.Path) -> dict[str, TestUsage]:
+    """Reads the usage recorded by previous runs, by test name.
+
+    A missing, unreadable or outdated history file is treated as empty.
+    """
+    try:
+        with open(path, "r") as f:
+            history = json.load(f)
+        if history.get("version") != HISTORY_VERSION:
+            return {}
+        return {name: TestUsage(**usage) for name, usage in history["tests"].items()}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def save_history(path: pathlib.Path, history: dict[str, TestUsage]) -> None:
+    """Writes the usage of each test, replacing the history file atomically."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp_path, "w") as f:
+        json.dump(
+            {
+                "version": HISTORY_VERSION,
+                "tests": {
+                    name: dataclasses.asdict(usage)
+                    for name, usage in sorted(history.items())
+                },
+            },
+            f,
+            indent=2,
+        )
+    os.replace(temp_path, path)
+
+
+def schedule_tests(
+    executables: list[pathlib.Path],
+    history: dict[str, TestUsage],
+    budget: ResourceBudget,
+    run: Callable[[pathlib.Path], TestResult | None],
+) -> Iterator[TestResult | None]:
+    """Runs tests longest first, as many at once as the budget allows.
+
+    Starting the longest tests first brings the total time close to that of the
+    longest test when there are enough CPUs, rather than leaving it to start
+    last. Whenever a test finishes, the longest pending tests that fit in the
+    resources it freed are started; a test which doesn't fit yet doesn't hold
+    back shorter ones that do. A test is always started when nothing is
+    running, even if it exceeds the budget on its own.
+
+    Args:
+        executables: The test executables to run
+        history: Usage recorded by previous runs, by test name
+        budget: The resources to share between concurrently running tests
+        run: Runs one test executable and returns its result
+
+    Yields:
+        The result of each test, in the order that they finish.
+    """
+
+    def usage(executable: pathlib.Path) -> TestUsage:
+        return history.get(
+            executable.stem,
+            TestUsage(
+                duration=UNKNOWN_TEST_DURATION,
+                peak_rss=UNKNOWN_TEST_PEAK_RSS,
+            ),
+        )
+
+    pending = sorted(executables, key=lambda e: usage(e).duration, reverse=True)
+    running: dict[futures.Future, TestUsage] = {}
+
+    def fits(cost: TestUsage) -> bool:
+        if not running:
+            return True
+        if budget.jobs is not None and len(running) >= budget.jobs:
+            return False
+        if sum(u.cpus for u in running.values()) + cost.cpus > budget.cpus:
+            return False
+        if budget.memory is not None:
+            memory = sum(u.peak_rss for u in running.values())
+            if memory + cost.peak_rss > budget.memory:
+                return False
+        if cost.gpu_bound:
+            gpu_jobs = sum(u.gpu_bound for u in running.values())
+            if gpu_jobs + 1 > budget.gpu_jobs:
+                return False
+        return True
+
+    with futures.ThreadPoolExecutor(max_workers=max(len(executables), 1)) as pool:
+        while pending or running:
+            for executable in list(pending):
+                cost = usage(executable)
+                if fits(cost):
+                    LOGGER.debug(
+                        f"Starting {executable.stem}: {cost.duration:.1f}s, "
+                        f"{cost.cpus:.1f} CPUs, {cost.peak_rss // 2**20} MiB"
+                        f"{', GPU-bound' if cost.gpu_bound else ''}"
+                        if cost.known
+                        else f"Starting {executable.stem}, which has no history"
+                    )
+                    running[pool.submit(run, executable)] = cost
+                    pending.remove(executable)
+            done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                yield future.result()
+
+
+def shard_tests(
+    executables: list[pathlib.Path],
+    history: dict[str, TestUsage],
+    shard_index: int,
+    shard_count: int,
+) -> list[pathlib.Path]:
+    """Returns the tests which a shard runs, balancing shards by past duration.
+
+    Tests are assigned longest first to the shard with the least total duration
+    so far. Tests without history count as the median duration. The assignment
+    only depends on the names of the tests and on the history, so every shard
+    computes the same one, as long as they are given the same history file.
+
+    Args:
+        executables: Every test executable
+        history: Usage recorded by previous runs, by test name
+        shard_index: Which shard to return the tests of, from 0
+        shard_count: The number of shards
+
+    Returns:
+        The test executables of shard `shard_index`
+    """
+    known_durations = [
+        history[executable.stem].duration
+        for executable in executables
+        if executable.stem in history
+    ]
+    default_duration = statistics.median(known_durations) if known_durations else 1.0
+
+    def duration(executable: pathlib.Path) -> float:
+        if executable.stem in history:
+            return history[executable.stem].duration
+        return default_duration
+
+    totals = [0.0] * shard_count
+    shard = []
+    for executable in sorted(executables, key=lambda e: (-duration(e), e.stem)):
+        index = min(range(shard_count), key=lambda i: (totals[i], i))
+        totals[index] += duration(executable)
+        if index == shard_index:
+            shard.append(executable)
+    LOGGER.debug(
+        f"Shard {shard_index} of {shard_count}: {len(shard)} tests, "
+        f"{totals[shard_index]:.1f}s expected"
+    )
+    return shard
+
+
+def merge_shards(
+    shard_directories: list[pathlib.Path],
+    base_output_directory: pathlib.Path,
+    history: dict[str, TestUsage],
+) -> bool:
+    """Combines the output directories of shards into one.
+
+    The result directory of each test is copied into `base_output_directory`,
+    and the usage recorded by each run is added to `history`.
+
+    Args:
+        shard_directories: The --output_dir of each shard
+        base_output_directory: Where to store the combined results
+        history: Usage recorded by previous runs, updated in place
+
+    Returns:
+        Whether all the tests in the shards passed
+    """
+    all_passed = True
+    for shard_directory in shard_directories:
+        for result_directory in sorted(shard_directory.glob("*_results")):
+            name = result_directory.name.removesuffix("_results")
+            output_directory = base_output_directory / result_directory.name
+            shutil.copytree(result_directory, output_directory, dirs_exist_ok=True)
+
+            usage_path = result_directory / "usage.json"
+            if usage_path.exists():
+                usage = TestUsage(**json.loads(usage_path.read_text()))
+                history[name] = (
+                    history[name].updated(usage) if name in history else usage
+                )
+
+            status_path = result_directory / "status.txt"
+            status = (
+                status_path.read_text().strip() if status_path.exists() else "unknown"
+            )
+            if status != TestStatus.PASSED:
+                print(
+                    f"{name} {status.replace('_', ' ')} in {shard_directory}. "
+                    f"Look at the output in {output_directory}"
+                )
+                all_passed = False
+    return all_passed
+
+
 def find_test_executable_directory(
     build_dir: pathlib.Path, build_config: CmakeBuildConfig
 ) -> pathlib.Path:
@@ -129,13 +840,29 @@ def find_test_executable_directory(
 def main(args: argparse.Namespace):
     """Finds all test executable and runs them.
 
+    Tests are run longest first, within the resource budget given by the
+    arguments, according to the usage recorded in the history file, which is
+    then updated with this run.
+
+    Unless --no_cache is given, tests whose cache_key() matches that of a
+    previous passing run aren't run again, and the output of that run is copied
+    into the output directory instead.
+
     This function never returns. It exits with 0 if all tests passed or 1 if
-    any test executable return a non-zero exit code.
+    any test executable return a non-zero exit code, timed out or wasn't run
+    before the global timeout.
 
     Args:
         args: Parsed arguments. See parse_args()
     """
     logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    if args.merge:
+        history = load_history(args.history_file)
+        all_passed = merge_shards(args.merge, args.output_dir, history)
+        save_history(args.history_file, history)
+        print(f"Merged results are stored in: {args.output_dir}")
+        sys.exit(0 if all_passed else 1)
+
     test_executable_directory = find_test_executable_directory(
         args.build_dir, args.build_config
     )
@@ -150,31 +877,131 @@ def main(args: argparse.Namespace):
         "\n".join([str(executable) for executable in test_executables]),
     )
 
-    LOGGER.debug("Starting threadpool")
-    test_succeeded = True
-    with futures.ThreadPoolExecutor(max_workers=args.jobs) as executor:
-        test_futures = [
-            executor.submit(
-                run_test,
-                executable,
-                args.output_dir,
-                args.executable_args,
+    history = load_history(args.history_file)
+    if args.shard_count > 1:
+        test_executables = shard_tests(
+            test_executables, history, args.shard_index, args.shard_count
+        )
+    memory = _physical_memory()
+    budget = ResourceBudget(
+        cpus=args.cpu_budget,
+        memory=(
+            int(memory * args.memory_budget / 100)
+            if memory is not None and args.memory_budget
+            else None
+        ),
+        gpu_jobs=args.gpu_jobs,
+        jobs=args.jobs,
+    )
+    cache_keys: dict[pathlib.Path, str] = {}
+    if not args.no_cache:
+        file_hashes = FileHashes(args.cache_dir / "file_hashes.json")
+        directory_hashes: dict[pathlib.Path, str] = {}
+
+        def hash_directory(directory: pathlib.Path) -> str:
+            if directory not in directory_hashes:
+                directory_hashes[directory] = file_hashes.hash_directory(directory)
+            return directory_hashes[directory]
+
+        driver = driver_identity(args.api)
+        for executable in test_executables:
+            if executable.stem not in KNOWN_ISSUES:
+                # Tests run in their output directory, which is what relative
+                # --extra-assets-path directories are found from
+                asset_directories = [
+                    args.build_dir / "assets",
+                    args.build_dir / "third_party" / "assets",
+                    *_extra_assets_paths(
+                        args.executable_args,
+                        test_output_directory(args.output_dir, executable),
+                    ),
+                ]
+                cache_keys[executable] = cache_key(
+                    file_hashes.hash(executable),
+                    args.executable_args,
+                    {
+                        str(directory): hash_directory(directory)
+                        for directory in asset_directories
+                    },
+                    driver,
+                )
+        file_hashes.save()
+
+        uncached_executables = []
+        for executable in test_executables:
+            if executable in cache_keys and restore_cached_result(
+                args.cache_dir, executable, cache_keys[executable], args.output_dir
+            ):
+                LOGGER.debug(f"Reusing the cached result of {executable.stem}")
+            else:
+                uncached_executables.append(executable)
+        cached_count = len(test_executables) - len(uncached_executables)
+        if cached_count:
+            print(
+                f"Reusing the cached results of {cached_count} tests whose "
+                "executable, arguments, assets and drivers are unchanged"
             )
-            for executable in test_executables
-        ]
-        for completed_future in futures.as_completed(test_futures):
-            result = completed_future.result()
+        test_executables = uncached_executables
+
+    LOGGER.debug(f"Scheduling tests within {budget}")
+    deadline = time.monotonic() + args.global_timeout if args.global_timeout else None
+
+    def run(executable: pathlib.Path) -> TestResult | None:
+        timeout = args.timeout or None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return TestResult(status=TestStatus.NOT_RUN, executable=executable)
+            timeout = min(timeout or remaining, remaining)
+        return run_test(executable, args.output_dir, args.executable_args, timeout)
+
+    test_succeeded = True
+    try:
+        for result in schedule_tests(test_executables, history, budget, run):
             # Ignore skipped tests
             if not result:
                 continue
 
-            if result.returncode != 0:
+            if result.usage is not None:
+                name = result.executable.stem
+                history[name] = (
+                    history[name].updated(result.usage)
+                    if name in history
+                    else result.usage
+                )
+
+            if result.status == TestStatus.PASSED and result.executable in cache_keys:
+                store_cached_result(
+                    args.cache_dir,
+                    result.executable,
+                    cache_keys[result.executable],
+                    result,
+                )
+
+            if result.status == TestStatus.NOT_RUN:
+                print(
+                    f"{str(result.executable)} was not run because the global "
+                    "timeout expired"
+                )
+                test_succeeded = False
+            elif result.status == TestStatus.TIMED_OUT:
+                print(
+                    f"{str(result.executable)} timed out. Look at the output in "
+                    f"{result.output_directory}"
+                )
+                test_succeeded = False
+            elif result.returncode != 0:
                 print(
                     f"{str(result.executable)} failed with returncode "
                     f"{str(result.returncode)}. Look at the output in "
                     f"{result.output_directory}"
                 )
                 test_succeeded = False
+    finally:
+        # Shards must all see the same history to agree on which tests each one
+        # runs, so it's only updated by --merge
+        if args.shard_count == 1:
+            save_history(args.history_file, history)
 
     if test_succeeded:
         print("All tests passed.")
@@ -231,8 +1058,53 @@ def parse_args() -> argparse.Namespace:
         "--jobs",
         type=int,
         default=None,
-        help="Number of test executables to run in parallel. If this is too "
-        "high then tests may sporadically fail.",
+        help="Maximum number of test executables to run in parallel, on top of "
+        "the resource budget. If this is too high then tests may sporadically "
+        "fail.",
+    )
+    parser.add_argument(
+        "--cpu_budget",
+        type=float,
+        default=os.cpu_count() or 1,
+        help="Number of CPUs to share between tests running in parallel, "
+        "according to the CPU time each used in previous runs",
+    )
+    parser.add_argument(
+        "--memory_budget",
+        type=float,
+        default=75,
+        help="Percentage of physical memory to share between tests running in "
+        "parallel, according to the peak memory each used in previous runs. "
+        "0 means no limit.",
+    )
+    parser.add_argument(
+        "--gpu_jobs",
+        type=int,
+        default=4,
+        help="Number of GPU-bound tests, which spent most of their previous "
+        "runs waiting rather than on the CPU, to run in parallel",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=300,
+        help="Seconds after which a test executable and any processes it "
+        "started are stopped, with SIGTERM and then SIGKILL, and the test "
+        "reported as timed out. 0 means no limit.",
+    )
+    parser.add_argument(
+        "--global_timeout",
+        type=float,
+        default=0,
+        help="Seconds after which running tests are stopped as with --timeout "
+        "and no more tests are started. 0 means no limit.",
+    )
+    parser.add_argument(
+        "--history_file",
+        type=pathlib.Path,
+        default=build_dir / "test_projects_history.json",
+        help="Where the duration, CPU time and peak memory of each test are "
+        "recorded, to run the longest tests first and within the budget",
     )
     parser.add_argument(
         "--output_dir",
@@ -240,12 +1112,52 @@ def parse_args() -> argparse.Namespace:
         default=build_dir / "test_projects_results",
         help="The base of the directory to store test executable results",
     )
+    parser.add_argument(
+        "--cache_dir",
+        type=pathlib.Path,
+        default=build_dir / "test_projects_cache",
+        help="Where the output of passing tests is kept, to be reused while "
+        "the executable, its arguments, the assets and the drivers are "
+        "unchanged",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Run every test, without reusing or storing cached results",
+    )
+    parser.add_argument(
+        "--shard_count",
+        type=int,
+        default=1,
+        help="Split the tests into this many shards, with similar total "
+        "durations according to --history_file, and only run one of them. "
+        "Every shard must be given the same history file, which shards don't "
+        "update; --merge does.",
+    )
+    parser.add_argument(
+        "--shard_index",
+        type=int,
+        default=0,
+        help="Which shard to run, from 0 to --shard_count - 1",
+    )
+    parser.add_argument(
+        "--merge",
+        nargs="+",
+        type=pathlib.Path,
+        metavar="SHARD_OUTPUT_DIR",
+        help="Instead of running tests, combine the output directories of "
+        "shards into --output_dir, add their usage to --history_file and exit "
+        "with 1 if any of their tests didn't pass",
+    )
     parser.add_argument(
         "executable_args",
         nargs="*",
         help="Arguments passed to the test executable",
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error("--shard_index must be from 0 to --shard_count - 1")
+    return args
 
 
 if __name__ == "__main__":
@@ -0,0 +1,412 @@
+# Copyright 2023 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import mimetypes
+import mmap
+import os
+from pathlib import Path
+import sys
+import tempfile
+from typing import TextIO
+
+from pack_glb import (
+    COMPONENT_TYPE_FORMATS,
+    COMPONENT_TYPE_SIZES,
+    TYPE_COMPONENTS,
+    GLTFError,
+    LazyJSONObject,
+    buffer_view_references,
+    element_size,
+    pack,
+)
+
+# File extensions of image MIME types, for those the mimetypes module doesn't know
+IMAGE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/ktx2": ".ktx2",
+    "image/png": ".png",
+    "image/vnd-ms.dds": ".dds",
+    "image/webp": ".webp",
+}
+
+CHUNK_TYPE_JSON = b"JSON"
+CHUNK_TYPE_BIN = b"BIN\x00"
+
+
+class GLBReader:
+    """Reads a GLB file through a read-only memory map.
+
+    The file is validated when it is opened. Buffer views, accessors and images
+    are returned as memoryviews into the map, so nothing is copied or loaded
+    until it is used. Those memoryviews must be released before the reader is
+    closed.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.bin: memoryview | None = None
+        with contextlib.ExitStack() as stack:
+            self._file = stack.enter_context(open(path, "rb"))
+            if os.fstat(self._file.fileno()).st_size < 12:
+                raise GLTFError(f"{path} is too small to be a GLB file")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = memoryview(self._mmap)
+            stack.callback(self.close)
+            self._read_chunks()
+            self._validate_description()
+            # Keep everything open for the caller, who closes the reader
+            stack.pop_all()
+
+    def __enter__(self) -> "GLBReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.bin is not None:
+            self.bin.release()
+        self.data.release()
+        self._mmap.close()
+        self._file.close()
+
+    def _read_chunks(self) -> None:
+        data = self.data
+        if data[0:4] != b"glTF":
+            raise GLTFError(f"{self.path} is not a GLB file")
+        version = int.from_bytes(data[4:8], byteorder="little")
+        if version != 2:
+            raise GLTFError(f"Unsupported GLB version {version}")
+        length = int.from_bytes(data[8:12], byteorder="little")
+        if length != len(data):
+            raise GLTFError(
+                f"GLB header length {length} doesn't match the file size {len(data)}"
+            )
+
+        # chunks as (type, offset of the chunk data, length)
+        self.chunks: list[tuple[bytes, int, int]] = []
+        offset = 12
+        while offset < length:
+            if offset + 8 > length:
+                raise GLTFError(f"Truncated chunk header at offset {offset}")
+            chunk_length = int.from_bytes(data[offset : offset + 4], byteorder="little")
+            chunk_type = bytes(data[offset + 4 : offset + 8])
+            if chunk_length % 4 != 0:
+                raise GLTFError(
+                    f"Length {chunk_length} of chunk {chunk_type!r} at offset {offset} "
+                    "isn't aligned to 4 bytes"
+                )
+            if offset + 8 + chunk_length > length:
+                raise GLTFError(
+                    f"Chunk {chunk_type!r} at offset {offset} extends past the end of "
+                    "the file"
+                )
+            self.chunks.append((chunk_type, offset + 8, chunk_length))
+            offset += 8 + chunk_length
+
+        types = [chunk_type for chunk_type, _, _ in self.chunks]
+        if not types or types[0] != CHUNK_TYPE_JSON:
+            raise GLTFError("The first chunk of a GLB file must be JSON")
+        if CHUNK_TYPE_BIN in types[2:] or types.count(CHUNK_TYPE_BIN) > 1:
+            raise GLTFError("A GLB file may only have one BIN chunk, after the JSON")
+
+        _, json_offset, json_length = self.chunks[0]
+        try:
+            self.description = json.loads(
+                data[json_offset : json_offset + json_length].tobytes().decode("utf-8")
+            )
+        except ValueError as e:
+            raise GLTFError(f"Invalid JSON chunk: {e}") from e
+        if len(self.chunks) > 1 and types[1] == CHUNK_TYPE_BIN:
+            _, bin_offset, bin_length = self.chunks[1]
+            self.bin = data[bin_offset : bin_offset + bin_length]
+
+    def _validate_description(self) -> None:
+        buffers = self.description.get("buffers", [])
+        for index, buffer in enumerate(buffers):
+            if "uri" in buffer:
+                continue
+            if index != 0:
+                raise GLTFError('Only the first buffer may omit the "uri" property')
+            if self.bin is None:
+                raise GLTFError("Buffer 0 refers to a missing BIN chunk")
+            # The BIN chunk is padded to 4 bytes, so it may be up to 3 bytes longer
+            if not buffer["byteLength"] <= len(self.bin) <= buffer["byteLength"] + 3:
+                raise GLTFError(
+                    f"Buffer 0 byteLength {buffer['byteLength']} doesn't match the "
+                    f"BIN chunk length {len(self.bin)}"
+                )
+
+        views = self.description.get("bufferViews", [])
+        for index, view in enumerate(views):
+            if not 0 <= view["buffer"] < len(buffers):
+                raise GLTFError(f"bufferView {index} refers to a missing buffer")
+            end = view.get("byteOffset", 0) + view["byteLength"]
+            if end > buffers[view["buffer"]]["byteLength"]:
+                raise GLTFError(f"bufferView {index} extends past its buffer")
+            stride = view.get("byteStride")
+            if stride is not None and (stride % 4 != 0 or not 4 <= stride <= 252):
+                raise GLTFError(f"bufferView {index} has invalid byteStride {stride}")
+
+        for index, accessor in enumerate(self.description.get("accessors", [])):
+            if accessor["componentType"] not in COMPONENT_TYPE_SIZES:
+                raise GLTFError(
+                    f"accessor {index} has an invalid componentType "
+                    f"{accessor['componentType']}"
+                )
+            if "bufferView" not in accessor:
+                continue
+            if not 0 <= accessor["bufferView"] < len(views):
+                raise GLTFError(f"accessor {index} refers to a missing bufferView")
+            view = views[accessor["bufferView"]]
+            component_size = COMPONENT_TYPE_SIZES[accessor["componentType"]]
+            offset = accessor.get("byteOffset", 0)
+            if (view.get("byteOffset", 0) + offset) % component_size != 0:
+                raise GLTFError(
+                    f"accessor {index} isn't aligned to its component size "
+                    f"{component_size}"
+                )
+            if accessor["count"] > 0:
+                size = element_size(accessor)
+                stride = view.get("byteStride", size)
+                end = offset + stride * (accessor["count"] - 1) + size
+                if end > view["byteLength"]:
+                    raise GLTFError(f"accessor {index} extends past its bufferView")
+
+    def buffer_view(self, index: int) -> memoryview:
+        """Return the bytes of a buffer view stored in the BIN chunk."""
+        view = self.description["bufferViews"][index]
+        if view["buffer"] != 0 or "uri" in self.description["buffers"][0]:
+            raise GLTFError(f"bufferView {index} isn't stored in the GLB file")
+        assert self.bin is not None
+        offset = view.get("byteOffset", 0)
+        return self.bin[offset : offset + view["byteLength"]]
+
+    def accessor(self, index: int) -> memoryview:
+        """Return the data of an accessor.
+
+        Tightly packed data is returned cast to the component type, with a shape
+        of (count, components) or (count,) for scalars. Interleaved data, and
+        matrices with padded columns, are returned as the bytes spanning all
+        elements. Sparse substitutions aren't applied, and values are in the
+        native byte order, which matches glTF's little-endian on common hosts.
+        """
+        accessor = self.description["accessors"][index]
+        if "bufferView" not in accessor:
+            raise GLTFError(f"accessor {index} has no bufferView")
+        view = self.buffer_view(accessor["bufferView"])
+        size = element_size(accessor)
+        stride = self.description["bufferViews"][accessor["bufferView"]].get(
+            "byteStride", size
+        )
+        offset = accessor.get("byteOffset", 0)
+        count = accessor["count"]
+        if count == 0:
+            return view[offset:offset]
+        data = view[offset : offset + stride * (count - 1) + size]
+
+        components, _ = TYPE_COMPONENTS[accessor["type"]]
+        component_size = COMPONENT_TYPE_SIZES[accessor["componentType"]]
+        if stride != size or size != components * component_size:
+            return data
+        shape = [count] if components == 1 else [count, components]
+        return data.cast(COMPONENT_TYPE_FORMATS[accessor["componentType"]], shape)
+
+    def image(self, index: int) -> memoryview:
+        """Return the encoded bytes of an image stored in the BIN chunk."""
+        image = self.description["images"][index]
+        if "bufferView" not in image:
+            raise GLTFError(f"image {index} isn't stored in the GLB file")
+        return self.buffer_view(image["bufferView"])
+
+    def unpack(self, output_dir: Path, name: str) -> Path:
+        """Write the contents as name.gltf, name.bin and one file per image.
+
+        Buffer views holding only an image are laid out after all other views
+        by pack_glb.py; when that's the case they are left out of name.bin.
+        Members of the JSON chunk that don't need rewriting are copied to
+        name.gltf as is, so for a GLB file written by pack_glb.py with its
+        default options, packing the result again gives back the same file.
+        Returns the path of the GLTF file.
+        """
+        description = json.loads(json.dumps(self.description))
+        views = description.get("bufferViews", [])
+        images = description.get("images", [])
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        image_views = {image["bufferView"] for image in images if "bufferView" in image}
+        image_ids = {id(image) for image in images}
+        shared_views = {
+            node["bufferView"]
+            for node in buffer_view_references(description)
+            if node["bufferView"] in image_views and id(node) not in image_ids
+        }
+        other_ends = [
+            view.get("byteOffset", 0) + view["byteLength"]
+            for index, view in enumerate(views)
+            if view["buffer"] == 0 and index not in image_views
+        ]
+        image_starts = [
+            views[index].get("byteOffset", 0)
+            for index in image_views
+            if views[index]["buffer"] == 0
+        ]
+        separate_images = not shared_views and max(other_ends, default=0) <= min(
+            image_starts, default=0
+        )
+
+        for index, image in enumerate(images):
+            if "bufferView" not in image or views[image["bufferView"]]["buffer"] != 0:
+                continue
+            mime_type = image.get("mimeType", "")
+            extension = IMAGE_EXTENSIONS.get(mime_type) or (
+                mimetypes.guess_extension(mime_type) or ".bin"
+            )
+            image_name = f"{name}_image{index}{extension}"
+            with open(output_dir / image_name, "wb") as f:
+                f.write(self.image(index))
+            if separate_images:
+                del image["bufferView"]
+                image["uri"] = image_name
+
+        if self.bin is not None and "uri" not in description["buffers"][0]:
+            bin_length = description["buffers"][0]["byteLength"]
+            if separate_images and image_starts:
+                bin_length = min(image_starts)
+                new_indices = {}
+                for index, view in enumerate(views):
+                    if index not in image_views:
+                        new_indices[index] = len(new_indices)
+                for node in buffer_view_references(description):
+                    node["bufferView"] = new_indices[node["bufferView"]]
+                description["bufferViews"] = [
+                    view for index, view in enumerate(views) if index in new_indices
+                ]
+            with open(output_dir / f"{name}.bin", "wb") as f:
+                f.write(self.bin[:bin_length])
+            description["buffers"][0]["byteLength"] = bin_length
+            description["buffers"][0]["uri"] = f"{name}.bin"
+
+        _, json_offset, json_length = self.chunks[0]
+        gltf = LazyJSONObject(
+            self.data[json_offset : json_offset + json_length].tobytes()
+        )
+        for key, value in description.items():
+            if value != self.description[key]:
+                gltf[key] = value
+        gltf_path = output_dir / f"{name}.gltf"
+        with open(gltf_path, "wb") as f:
+            f.write(gltf.encode())
+        return gltf_path
+
+    def print_info(self, file: TextIO | None = None) -> None:
+        """Print the chunks, and the offset, length and SHA-256 of each buffer view.
+
+        The output is meant to be compared with diff to find what changed
+        between two GLB files.
+        """
+        for chunk_type, offset, length in self.chunks:
+            print(
+                f"chunk {chunk_type.decode('ascii', 'replace')!r} "
+                f"offset {offset} length {length}",
+                file=file,
+            )
+        for key in ("buffers", "bufferViews", "accessors", "images", "meshes"):
+            print(f"{key}: {len(self.description.get(key, []))}", file=file)
+        for index, view in enumerate(self.description.get("bufferViews", [])):
+            try:
+                digest = hashlib.sha256(self.buffer_view(index)).hexdigest()
+            except GLTFError:
+                digest = "external"
+            print(
+                f"bufferView {index} offset {view.get('byteOffset', 0)} "
+                f"length {view['byteLength']} sha256 {digest}",
+                file=file,
+            )
+
+
+def repacks_identically(glb_path: Path, gltf_path: Path) -> bool:
+    """Return whether packing a GLTF file with pack_glb.py's default options
+    gives back a GLB file byte for byte."""
+    with open(gltf_path, "rb") as f:
+        gltf = LazyJSONObject(f.read())
+    with tempfile.TemporaryDirectory() as temp_dir:
+        repacked_path = Path(temp_dir) / glb_path.name
+        pack(gltf, gltf_path.parent.resolve(), repacked_path)
+        if repacked_path.stat().st_size != glb_path.stat().st_size:
+            return False
+        with open(repacked_path, "rb") as repacked, open(glb_path, "rb") as original:
+            while True:
+                chunk = original.read(1 << 20)
+                if chunk != repacked.read(1 << 20):
+                    return False
+                if not chunk:
+                    return True
+
+
+def main():
+    logging.basicConfig(
+        format="%(asctime)s %(module)s: %(message)s", level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(
+        description="Validates a GLB file and unpacks it into a GLTF file, a binary "
+        "buffer file and image files",
+    )
+    parser.add_argument("input", type=Path, help="The name of the GLB file to unpack")
+    parser.add_argument(
+        "output_dir",
+        type=Path,
+        nargs="?",
+        help="The directory to unpack into; if omitted the file is only validated",
+    )
+    parser.add_argument(
+        "--info",
+        action="store_true",
+        help="Print the chunks and the offset, length and hash of each buffer view",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="After unpacking, pack the result again and fail unless that gives "
+        "back the same GLB file",
+    )
+    args = parser.parse_args()
+    if args.check and not args.output_dir:
+        parser.error("--check needs an output directory to unpack into")
+
+    try:
+        with GLBReader(args.input) as reader:
+            if args.info:
+                reader.print_info()
+            if args.output_dir:
+                gltf_path = reader.unpack(args.output_dir, args.input.stem)
+                logging.info("Unpacked %s to %s", args.input, gltf_path)
+                if args.check and not repacks_identically(args.input, gltf_path):
+                    logging.error(
+                        "Packing %s doesn't give back %s", gltf_path, args.input
+                    )
+                    return 1
+    except GLTFError as e:
+        logging.error("%s: %s", args.input, e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())